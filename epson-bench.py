@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+#
+# Benchmark the ESC/P and ESC/P-R encoders
+#
+#
+#  Copyright (C) 2016, Jason S. McMullan <jason.mcmullan@gmail.com>
+#  All rights reserved.
+#
+#  Licensed under the MIT License:
+#
+#  Permission is hereby granted, free of charge, to any person obtaining
+#  a copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+import json
+import math
+import time
+import argparse
+import platform
+import subprocess
+
+import epson.io
+import epson.escp
+import epson.escpr
+import epson.raster
+import epson.stats
+from epson.stats import Sampler, rss
+from epson.constant import *
+
+
+def printable(msid, dpi, margin=3):
+    mm2in = 1.0 / 25.4
+    width = math.ceil(msid[0] * mm2in * dpi) - 2 * math.floor(margin * mm2in * dpi)
+    height = math.ceil(msid[1] * mm2in * dpi) - 2 * math.floor(margin * mm2in * dpi)
+    return (width, height)
+
+
+def measure(func, repeat):
+    """Best-of-N timing of func(), which returns (lines, raw_bytes, sink)
+
+    Memory is sampled while the case runs: rss_delta is its peak RSS over
+    the RSS before it started, rather than the process' high-water mark.
+    """
+    best = None
+    before = rss()
+    peak = before
+    for _ in range(repeat):
+        with Sampler(interval=0.005) as sampler:
+            start = time.perf_counter()
+            lines, raw, out, extra = func()
+            elapsed = time.perf_counter() - start
+        peak = max(peak, sampler.peak)
+        if best is None or elapsed < best[0]:
+            best = (elapsed, lines, raw, out, extra)
+
+    elapsed, lines, raw, out, extra = best
+    result = {
+        "seconds": elapsed,
+        "lines": lines,
+        "lines_per_s": lines / elapsed if elapsed else None,
+        "mb_per_s": raw / elapsed / 1e6 if elapsed else None,
+        "bytes_in": raw,
+        "bytes_out": out,
+        "rss_before": before,
+        "rss_peak": peak,
+        "rss_delta": peak - before,
+    }
+    result.update(extra)
+    return result
+
+
+def bench_encode(image, bpp):
+    """run_length_encode() alone"""
+
+    def run():
+        raw = 0
+        out = 0
+        for y in range(image.size[1]):
+            line = image.line(y)
+            raw += len(line)
+            out += len(run_length_encode(line, bpp))
+        ratio = raw / out if out else None
+        return image.size[1], raw, out, {"ratio": ratio}
+
+    return run
+
+
+def bench_job(job_class, image):
+    """Full print_pages() into a discarding sink"""
+
+    def run():
+        sink = epson.io.Null()
+        job = job_class(io=sink)
+        job.msid = image.msid
+        job.dpi = image.dpi
+        job.stats = epson.stats.Stats()
+        job.print_pages(rasters=[image])
+        stats = job.stats
+        extra = {"ratio": stats.ratio, "commands": stats.commands}
+        extra["stages"] = stats.as_dict()["wall"]
+        # Throughput is over the whole raster, whatever cropping skips, so
+        # that results stay comparable between revisions
+        raw = image.size[0] * image.size[1] * 3
+        return image.size[1], raw, sink.count, extra
+
+    return run
+
+
+def git_revision():
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        )
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    results = []
+    for msid_name in args.msid:
+        msid = MSID[msid_name]
+        for dpi in args.dpi:
+            width, height = printable(msid, dpi)
+            height = min(height, args.lines)
+            for name in args.corpus:
+                image = epson.raster.Pattern(
+                    size=(width, height), kind=name, rows=args.rows
+                )
+                image.msid = msid
+                image.dpi = dpi
+
+                cases = [
+                    ("encode-rgb", bench_encode(image, 3)),
+                    ("escpr-job", bench_job(epson.escpr.Job, image)),
+                    ("escp-job", bench_job(epson.escp.Job, image)),
+                ]
+                for case, func in cases:
+                    if args.case and case not in args.case:
+                        continue
+                    result = {
+                        "case": case,
+                        "corpus": name,
+                        "msid": msid_name,
+                        "dpi": dpi,
+                        "size": [width, height],
+                    }
+                    result.update(measure(func, args.repeat))
+                    results.append(result)
+                    if not args.quiet:
+                        print(
+                            "%-10s %-8s %-7s %4d dpi: %10.0f lines/s %8.2f MB/s"
+                            " rss %+6.1f MB"
+                            % (
+                                case,
+                                name,
+                                msid_name,
+                                dpi,
+                                result["lines_per_s"] or 0,
+                                result["mb_per_s"] or 0,
+                                result["rss_delta"] / 1e6,
+                            ),
+                            file=sys.stderr,
+                        )
+
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "machine": platform.machine(),
+            "revision": git_revision(),
+            "lines": args.lines,
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+
+
+def compare(old, new):
+    """Print throughput changes between two result sets"""
+    key = lambda r: (r["case"], r["corpus"], r["msid"], r["dpi"])
+    before = dict((key(r), r) for r in old["results"])
+    for result in new["results"]:
+        prev = before.get(key(result))
+        if prev is None or not prev["lines_per_s"]:
+            continue
+        change = result["lines_per_s"] / prev["lines_per_s"] - 1.0
+        print("%-10s %-8s %-7s %4d dpi: %+6.1f%%" % (key(result) + (change * 100,)))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the ESC/P and ESC/P-R encoders"
+    )
+    parser.add_argument(
+        "--corpus",
+        nargs="+",
+        default=sorted(epson.raster.Pattern.KINDS),
+        choices=epson.raster.Pattern.KINDS,
+        help="page patterns (see epson.raster.Pattern)",
+    )
+    parser.add_argument("--msid", nargs="+", default=["A6", "LETTER"])
+    parser.add_argument("--dpi", nargs="+", type=int, default=[360, 720])
+    parser.add_argument("--case", nargs="+", default=None)
+    parser.add_argument("--lines", type=int, default=128, help="lines per page")
+    parser.add_argument("--rows", type=int, default=32, help="distinct rows")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", default=None, help="write JSON results")
+    parser.add_argument("--compare", default=None, help="baseline JSON results")
+    parser.add_argument("--quiet", action="store_true")
+    args = parser.parse_args(argv)
+
+    results = run(args)
+
+    if args.output:
+        with open(args.output, "w") as fout:
+            json.dump(results, fout, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as fin:
+            compare(json.load(fin), results)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
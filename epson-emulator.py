@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+#
+# Emulate a port 9100 EPSON printer, reporting per-page timing
+#
+#
+#  Copyright (C) 2016, Jason S. McMullan <jason.mcmullan@gmail.com>
+#  All rights reserved.
+#
+#  Licensed under the MIT License:
+#
+#  Permission is hereby granted, free of charge, to any person obtaining
+#  a copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+import json
+import time
+import argparse
+
+from epson.emulator import Emulator
+
+
+def report(session, as_json=False):
+    result = session.as_dict()
+    if as_json:
+        print(json.dumps(result, indent=2), flush=True)
+        return
+
+    print(
+        "%d bytes, %d pages in %.3fs (%.2f MB/s), %d status queries"
+        % (
+            result["bytes"],
+            len(result["pages"]),
+            result["seconds"],
+            result["mb_per_s"],
+            result["queries"],
+        ),
+        flush=True,
+    )
+    for page in result["pages"]:
+        print(
+            "  page %(page)d: %(start).3fs - %(end).3fs, %(dots)d dots, %(bytes)d bytes"
+            % page,
+            flush=True,
+        )
+    if result["error"]:
+        print("  error: %s" % result["error"], flush=True)
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description="Emulate a port 9100 EPSON printer")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--rate", type=float, default=None, help="MB/s consumed")
+    parser.add_argument("--dots", type=float, default=None, help="Mdots/s printed")
+    parser.add_argument("--buffer", type=int, default=1024, help="buffer, KiB")
+    parser.add_argument("--no-status", action="store_true")
+    parser.add_argument("--json", action="store_true")
+    parser.add_argument("files", nargs="*", help="spools to consume instead")
+    options = parser.parse_args(args)
+
+    emulator = Emulator(
+        rate=options.rate * 1e6 if options.rate else None,
+        dot_rate=options.dots * 1e6 if options.dots else None,
+        buffer=options.buffer << 10,
+        status=not options.no_status,
+    )
+
+    if options.files:
+        for filename in options.files:
+            report(emulator.consume_file(filename), options.json)
+        return 0
+
+    port = emulator.start(options.host, options.port)
+    print("Listening on %s:%d" % (options.host, port), file=sys.stderr)
+
+    count = 0
+    try:
+        while True:
+            sessions = emulator.wait(count + 1)
+            report(sessions[-1], options.json)
+            count += 1
+    except KeyboardInterrupt:
+        emulator.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+#
+# Soak test: submit many concurrent jobs and report latency, throughput and memory
+#
+#
+#  Copyright (C) 2016, Jason S. McMullan <jason.mcmullan@gmail.com>
+#  All rights reserved.
+#
+#  Licensed under the MIT License:
+#
+#  Permission is hereby granted, free of charge, to any person obtaining
+#  a copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+import json
+import math
+import time
+import argparse
+import platform
+from concurrent.futures import ThreadPoolExecutor
+
+import epson.io
+import epson.escp
+import epson.escpr
+import epson.raster
+import epson.emulator
+from epson.stats import Sampler, rss
+from epson.constant import *
+
+JOBS = {"escpr": epson.escpr.Job, "escp": epson.escp.Job}
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of a sorted list"""
+    if not values:
+        return None
+    rank = max(0, math.ceil(p / 100.0 * len(values)) - 1)
+    return values[rank]
+
+
+def run_config(args, protocol, concurrency, emulator):
+    job_class = JOBS[protocol]
+    settings = job_class(io=None).settings.replace(msid=MSID[args.msid], dpi=args.dpi)
+    width, height = settings.printable_size
+    height = min(height, args.lines)
+
+    def one(n):
+        if emulator is not None:
+            io = emulator.connect()
+        else:
+            io = epson.io.Null()
+
+        pages = [
+            epson.raster.Pattern(
+                size=(width, height), kind=args.pattern, rows=args.rows, seed=n
+            )
+            for _ in range(args.pages)
+        ]
+        start = time.perf_counter()
+        job = job_class(io=io, settings=settings)
+        job.print_pages(pages)
+        io.close()
+        latency = time.perf_counter() - start
+
+        if emulator is not None:
+            sent = io.session.bytes
+        else:
+            sent = io.count
+        return latency, sent
+
+    before = rss()
+    with Sampler() as sampler:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            outcomes = list(pool.map(one, range(args.jobs)))
+        elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency for latency, _ in outcomes)
+    total = sum(sent for _, sent in outcomes)
+    return {
+        "protocol": protocol,
+        "concurrency": concurrency,
+        "jobs": args.jobs,
+        "pages": args.pages,
+        "size": [width, height],
+        "seconds": elapsed,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "mb_per_s": total / elapsed / 1e6 if elapsed > 0 else None,
+        "bytes": total,
+        "rss_before": before,
+        "rss_peak": sampler.peak,
+        "rss_after": rss(),
+    }
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description="Submit many concurrent jobs and report latency and memory"
+    )
+    parser.add_argument("--protocol", nargs="+", default=sorted(JOBS))
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 8, 64])
+    parser.add_argument("--jobs", type=int, default=64, help="jobs per config")
+    parser.add_argument("--pages", type=int, default=1, help="pages per job")
+    parser.add_argument("--pattern", default="text", choices=epson.raster.Pattern.KINDS)
+    parser.add_argument("--msid", default="A6")
+    parser.add_argument("--dpi", type=int, default=360)
+    parser.add_argument("--lines", type=int, default=256, help="lines per page")
+    parser.add_argument("--rows", type=int, default=32, help="distinct rows")
+    parser.add_argument(
+        "--emulate", type=float, default=None, help="send to emulators at MB/s"
+    )
+    parser.add_argument("--output", default=None, help="write JSON results")
+    parser.add_argument("--quiet", action="store_true")
+    args = parser.parse_args(argv)
+
+    emulator = None
+    if args.emulate is not None:
+        emulator = epson.emulator.Emulator(rate=args.emulate * 1e6 or None)
+
+    results = []
+    for protocol in args.protocol:
+        for concurrency in args.concurrency:
+            result = run_config(args, protocol, concurrency, emulator)
+            results.append(result)
+            if not args.quiet:
+                print(
+                    "%-6s x%-4d p50 %7.3fs p95 %7.3fs p99 %7.3fs %8.2f MB/s rss %6.1f MB"
+                    % (
+                        protocol,
+                        concurrency,
+                        result["p50"],
+                        result["p95"],
+                        result["p99"],
+                        result["mb_per_s"] or 0,
+                        result["rss_peak"] / 1e6,
+                    ),
+                    file=sys.stderr,
+                )
+
+    output = {
+        "meta": {
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "machine": platform.machine(),
+            "pattern": args.pattern,
+            "msid": args.msid,
+            "dpi": args.dpi,
+            "emulate": args.emulate,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as fout:
+            json.dump(output, fout, indent=2)
+    elif args.quiet:
+        json.dump(output, sys.stdout, indent=2)
+        print()
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -28,4 +28,24 @@ from __future__ import division
 from __future__ import print_function
 
 
-__all__ = ["escp", "escpr", "raster", "constant", "io"]
+__all__ = [
+    "escp",
+    "escpr",
+    "raster",
+    "constant",
+    "io",
+    "decode",
+    "diff",
+    "stats",
+    "settings",
+    "scheduler",
+    "cache",
+    "resample",
+    "color",
+    "command",
+    "status",
+    "d4",
+    "emulator",
+    "impose",
+    "rotate",
+]
@@ -0,0 +1,244 @@
+#
+#  Copyright (C) 2016, Jason S. McMullan <jason.mcmullan@gmail.com>
+#  All rights reserved.
+#
+#  Licensed under the MIT License:
+#
+#  Permission is hereby granted, free of charge, to any person obtaining
+#  a copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+class PageCache(object):
+    """LRU cache of encoded page data
+
+    Maps a key built from a page's content digest and the job settings
+    (see key()) to the page's encoded command bytes. Entries live in memory,
+    bounded by max_bytes and max_entries, and optionally in a directory on
+    disk, bounded by disk_bytes. Instances are thread-safe and may be shared
+    between jobs.
+
+    Attach to a job with job.page_cache = PageCache().
+    """
+
+    def __init__(
+        self, max_bytes=64 << 20, max_entries=1024, directory=None, disk_bytes=None
+    ):
+        """
+        @param max_bytes   : Memory limit for cached page data
+        @param max_entries : Maximum number of pages held in memory
+        @param directory   : Optional on-disk cache directory
+        @param disk_bytes  : Optional size limit of the on-disk cache
+        """
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.directory = directory
+        self.disk_bytes = disk_bytes
+
+        self.lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._disk = OrderedDict()
+        self._disk_size = 0
+        # Keys being written to disk
+        self._writing = set()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if directory is not None:
+            os.makedirs(self._tmp(), exist_ok=True)
+            self._scan()
+
+    @staticmethod
+    def key(*parts):
+        """Build a cache key from hashable, repr()-stable parts"""
+        h = hashlib.blake2b(digest_size=20)
+        for part in parts:
+            if isinstance(part, (bytes, bytearray)):
+                h.update(part)
+            else:
+                h.update(repr(part).encode())
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def get(self, key):
+        """Return the cached data for key, or None"""
+        with self.lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return data
+
+            if key not in self._disk:
+                self.misses += 1
+                return None
+
+        # Files are read without holding the lock
+        data = self._read(key)
+
+        with self.lock:
+            if data is None:
+                self._disk_size -= self._disk.pop(key, 0)
+                self.misses += 1
+                return None
+
+            if key in self._disk:
+                self._disk.move_to_end(key)
+            self.disk_hits += 1
+            self._remember(key, data)
+            return data
+
+    def put(self, key, data):
+        """Store data for key"""
+        data = bytes(data)
+        with self.lock:
+            self._remember(key, data)
+            if self.directory is None or key in self._disk or key in self._writing:
+                return
+            self._writing.add(key)
+
+        # Files are written without holding the lock
+        written = False
+        try:
+            written = self._write(key, data)
+        finally:
+            with self.lock:
+                self._writing.discard(key)
+                if written and key not in self._disk:
+                    self._disk[key] = len(data)
+                    self._disk_size += len(data)
+                    self._trim()
+
+    def clear(self):
+        """Drop the in-memory entries (the disk cache is kept)"""
+        with self.lock:
+            self._memory.clear()
+            self._memory_size = 0
+
+    def as_dict(self):
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self._memory),
+            "bytes": self._memory_size,
+            "disk_entries": len(self._disk),
+            "disk_bytes": self._disk_size,
+        }
+
+    def _remember(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_size -= len(old)
+
+        self._memory[key] = data
+        self._memory_size += len(data)
+
+        while (
+            self._memory_size > self.max_bytes or len(self._memory) > self.max_entries
+        ):
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted)
+            self.evictions += 1
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def _tmp(self):
+        """Directory of the files being written, outside the entries"""
+        return os.path.join(self.directory, "tmp")
+
+    def _scan(self):
+        # Partial files left by an interrupted write
+        for name in os.listdir(self._tmp()):
+            try:
+                os.unlink(os.path.join(self._tmp(), name))
+            except OSError:
+                pass
+
+        found = []
+        for sub in os.listdir(self.directory):
+            subdir = os.path.join(self.directory, sub)
+            if sub == "tmp" or not os.path.isdir(subdir):
+                continue
+            for name in os.listdir(subdir):
+                st = os.stat(os.path.join(subdir, name))
+                found.append((st.st_mtime, name, st.st_size))
+
+        for mtime, name, size in sorted(found):
+            self._disk[name] = size
+            self._disk_size += size
+
+        self._trim()
+
+    def _read(self, key):
+        try:
+            with open(self._path(key), "rb") as fin:
+                return fin.read()
+        except OSError:
+            return None
+
+    def _write(self, key, data):
+        """Write an entry's file; returns whether it was written"""
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self._tmp())
+        except OSError:
+            return False
+        try:
+            with os.fdopen(fd, "wb") as fout:
+                fout.write(data)
+            os.replace(tmp, path)
+        except OSError:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            return False
+        return True
+
+    def _trim(self):
+        if self.disk_bytes is None:
+            return
+
+        while self._disk_size > self.disk_bytes and len(self._disk) > 1:
+            name, size = self._disk.popitem(last=False)
+            self._disk_size -= size
+            try:
+                os.unlink(self._path(name))
+            except OSError:
+                pass
@@ -0,0 +1,282 @@
+#
+#  Copyright (C) 2016, Jason S. McMullan <jason.mcmullan@gmail.com>
+#  All rights reserved.
+#
+#  Licensed under the MIT License:
+#
+#  Permission is hereby granted, free of charge, to any person obtaining
+#  a copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import weakref
+import hashlib
+import functools
+import threading
+from dataclasses import dataclass
+from typing import Optional
+
+from epson.constant import *
+from epson.raster import Image
+
+# Dot gain of the media: output tones are lightened by this exponent
+MediaGain = {
+    MTID.PLAIN: 1.15,
+    MTID.RECYCLED: 1.2,
+    MTID.COLOR: 1.15,
+    MTID.LETTERHEAD: 1.15,
+    MTID.PREPRINTED: 1.15,
+    MTID.THICKPAPER: 1.1,
+    MTID.ENVELOPE: 1.2,
+}
+
+
+def _srgb_decode(v):
+    if v <= 0.04045:
+        return v / 12.92
+    return ((v + 0.055) / 1.055) ** 2.4
+
+
+def _srgb_encode(v):
+    if v <= 0.0031308:
+        return v * 12.92
+    return 1.055 * v ** (1 / 2.4) - 0.055
+
+
+@dataclass(frozen=True)
+class Profile(object):
+    """Device link from source RGB to printer RGB
+
+    Source values are linearised, mixed with a 3x3 matrix, clipped and
+    re-encoded, then compensated for the dot gain of the media. Subclasses
+    may override convert() for other transforms; profiles must stay
+    hashable, as their colour tables are cached by value.
+    """
+
+    name: str = "sRGB"
+
+    # Row-major 3x3 matrix applied to linear RGB
+    matrix: tuple = (1.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 1.0)
+
+    # Per channel output exponent, applied after re-encoding
+    gamma: tuple = (1.0, 1.0, 1.0)
+
+    def convert(self, r, g, b, mtid=MTID.PLAIN):
+        """Convert one colour, with channels in 0..1"""
+        m = self.matrix
+        r, g, b = _srgb_decode(r), _srgb_decode(g), _srgb_decode(b)
+        out = (
+            m[0] * r + m[1] * g + m[2] * b,
+            m[3] * r + m[4] * g + m[5] * b,
+            m[6] * r + m[7] * g + m[8] * b,
+        )
+
+        gain = MediaGain.get(mtid, 1.0)
+        return tuple(
+            _srgb_encode(min(1.0, max(0.0, v))) ** (gamma / gain)
+            for v, gamma in zip(out, self.gamma)
+        )
+
+
+# Converted colours kept between bands, by all tables together
+MemoBudget = 1 << 17
+
+# Live tables, whose memos share the budget
+_tables = weakref.WeakSet()
+_memo_lock = threading.Lock()
+
+
+def _trim_memos():
+    """Clear the largest memos until all of them fit in MemoBudget"""
+    with _memo_lock:
+        memos = [table._memo for table in _tables]
+        total = sum(map(len, memos))
+        while total > MemoBudget:
+            largest = max(memos, key=len)
+            total -= len(largest)
+            largest.clear()
+
+
+class Lut3D(object):
+    """RGB to RGB lookup table with tetrahedral interpolation"""
+
+    def __init__(self, convert, points=17):
+        """
+        @param convert : Function of (r, g, b) in 0..1 returning (r, g, b)
+        @param points  : Grid points per channel
+        """
+        self.points = points
+
+        step = points - 1
+        grid = []
+        for r in range(points):
+            for g in range(points):
+                for b in range(points):
+                    out = convert(r / step, g / step, b / step)
+                    grid.append(tuple(255.0 * min(1.0, max(0.0, v)) for v in out))
+        self.grid = grid
+
+        # Grid cell and position inside the cell of each 8-bit value
+        self._cell = []
+        self._frac = []
+        for value in range(256):
+            pos = value * step / 255
+            cell = min(int(pos), step - 1)
+            self._cell.append(cell)
+            self._frac.append(pos - cell)
+
+        self._memo = _Memo(self._interpolate)
+        with _memo_lock:
+            _tables.add(self)
+
+    def _interpolate(self, rgb):
+        r, g, b = rgb
+        cell, frac = self._cell, self._frac
+        points = self.points
+        grid = self.grid
+
+        base = (cell[r] * points + cell[g]) * points + cell[b]
+        fr, fg, fb = frac[r], frac[g], frac[b]
+        sr, sg, sb = points * points, points, 1
+
+        # Walk from the cell's origin to its far corner along the
+        # tetrahedron containing the point
+        if fr >= fg:
+            if fg >= fb:
+                order = ((fr, sr), (fg, sg), (fb, sb))
+            elif fr >= fb:
+                order = ((fr, sr), (fb, sb), (fg, sg))
+            else:
+                order = ((fb, sb), (fr, sr), (fg, sg))
+        elif fb >= fg:
+            order = ((fb, sb), (fg, sg), (fr, sr))
+        elif fb >= fr:
+            order = ((fg, sg), (fb, sb), (fr, sr))
+        else:
+            order = ((fg, sg), (fr, sr), (fb, sb))
+
+        (f1, s1), (f2, s2), (f3, s3) = order
+        c0 = grid[base]
+        c1 = grid[base + s1]
+        c2 = grid[base + s1 + s2]
+        c3 = grid[base + s1 + s2 + s3]
+        w0, w1, w2, w3 = 1.0 - f1, f1 - f2, f2 - f3, f3
+
+        return bytes(
+            int(w0 * a + w1 * b + w2 * c + w3 * d + 0.5)
+            for a, b, c, d in zip(c0, c1, c2, c3)
+        )
+
+    def apply(self, data):
+        """Convert a buffer of RGB 24-bit pixels"""
+        _trim_memos()
+        memo = self._memo
+        return b"".join(map(memo.__getitem__, zip(data[0::3], data[1::3], data[2::3])))
+
+
+class _Memo(dict):
+    """Dictionary computing missing entries"""
+
+    def __init__(self, compute):
+        super(_Memo, self).__init__()
+        self.compute = compute
+
+    def __missing__(self, key):
+        value = self.compute(key)
+        self[key] = value
+        return value
+
+
+@functools.lru_cache(maxsize=16)
+def lut_for(profile: Profile, mtid=MTID.PLAIN, points=17) -> Lut3D:
+    """Colour table of a profile on a media type, built once per process"""
+    return Lut3D(lambda r, g, b: profile.convert(r, g, b, mtid), points)
+
+
+class ColorTransform(Image):
+    """Image adapter applying a colour profile
+
+    Source rows are converted a band at a time; each distinct colour is
+    interpolated once and then reused, which keeps the cost of flat and
+    synthetic pages close to a table lookup. Bitmaps pass through unchanged.
+    """
+
+    # Rows per converted band
+    Band = 64
+
+    def __init__(self, source: Image, profile: Profile, mtid=MTID.PLAIN):
+        """
+        @param source  : Source Image
+        @param profile : Colour Profile
+        @param mtid    : Media type the table is built for
+        """
+        super(ColorTransform, self).__init__(size=tuple(source.size))
+        self.source = source
+        self.profile = profile
+        self.mtid = mtid
+        self.lut = lut_for(profile, mtid)
+
+        self._band = None
+        self._rows = None
+
+    def _convert(self, band):
+        start = band * self.Band
+        end = min(self.size[1], start + self.Band)
+        blank = b"\xff\xff\xff" * self.size[0]
+
+        lines = [self.source.line(y) or blank for y in range(start, end)]
+        data = self.lut.apply(b"".join(lines))
+
+        stride = self.size[0] * 3
+        self._rows = [data[i : i + stride] for i in range(0, len(data), stride)]
+        self._band = band
+
+    def line(self, y=0):
+        """Retrieve a colour converted RGB 24-bit line"""
+        if y >= self.size[1]:
+            return None
+        band = y // self.Band
+        if band != self._band:
+            self._convert(band)
+        return self._rows[y - band * self.Band]
+
+    def bitline(self, y=0, ci=CI.BLACK, bpp=1) -> Optional[bytes]:
+        return self.source.bitline(y=y, ci=ci, bpp=bpp)
+
+    def bbox(self, planes=None, bpp=1):
+        if planes is None and self.lut.apply(b"\xff\xff\xff") != b"\xff\xff\xff":
+            # White paper is converted to a colour
+            return (0, 0, self.size[0], self.size[1])
+        return self.source.bbox(planes, bpp)
+
+    def digest(self, planes=None, bpp=1, parallel=False) -> bytes:
+        """Content hash, derived from the source's digest"""
+        h = hashlib.blake2b(digest_size=16)
+        h.update(self.source.digest(planes=planes, bpp=bpp, parallel=parallel))
+        h.update(repr((self.profile, self.mtid)).encode())
+        return h.digest()
+
+
+def transform(source: Image, profile: Optional[Profile], mtid=MTID.PLAIN):
+    """Apply profile to source, or return source without a profile"""
+    if profile is None:
+        return source
+    return ColorTransform(source, profile, mtid)
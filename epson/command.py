@@ -0,0 +1,235 @@
+#
+#  Copyright (C) 2016, Jason S. McMullan <jason.mcmullan@gmail.com>
+#  All rights reserved.
+#
+#  Licensed under the MIT License:
+#
+#  Permission is hereby granted, free of charge, to any person obtaining
+#  a copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import struct
+
+_LENGTH = struct.Struct("<H")
+_RASTER_LENGTH = struct.Struct("<L")
+
+
+class Layout(object):
+    """Fixed-size parameter block of a command
+
+    The struct is compiled once; pack() and unpack() are used by both the
+    encoders (epson.escp, epson.escpr) and epson.decode.
+    """
+
+    def __init__(self, fmt, fields=()):
+        """
+        @param fmt    : struct format of the parameters
+        @param fields : Name of each value; None for reserved values
+        """
+        self.struct = struct.Struct(fmt)
+        self.size = self.struct.size
+        self.fields = tuple(fields)
+
+    def params(self, *values) -> bytes:
+        return self.struct.pack(*values)
+
+    def unpack(self, data, offset=0) -> dict:
+        values = self.struct.unpack_from(data, offset)
+        return {
+            name: value for name, value in zip(self.fields, values) if name is not None
+        }
+
+
+class Command(Layout):
+    """ESC/P command: ESC, code and parameters
+
+    Extended 'ESC (' commands carry their parameter size, which is part of
+    the precomputed prefix.
+    """
+
+    def __init__(self, code, fmt, fields=()):
+        """
+        @param code   : Bytes following ESC, e.g. b"(V"
+        @param fmt    : struct format of the parameters
+        @param fields : Name of each value; None for reserved values
+        """
+        super(Command, self).__init__(fmt, fields)
+        self.code = code
+        self.extended = code[0:1] == b"("
+        self.prefix = b"\x1b" + code
+        if self.extended:
+            self.prefix += _LENGTH.pack(self.size)
+
+    def pack(self, *values) -> bytes:
+        return self.prefix + self.struct.pack(*values)
+
+
+class RasterCommand(Layout):
+    """ESC/P-R command: ESC, class, length, code, parameters and data"""
+
+    def __init__(self, rclass, code, fmt=">", fields=()):
+        """
+        @param rclass : Command class, e.g. b"d"
+        @param code   : Four byte command code, e.g. b"dsnd"
+        @param fmt    : struct format of the fixed parameters
+        @param fields : Name of each value; None for reserved values
+        """
+        super(RasterCommand, self).__init__(fmt, fields)
+        self.rclass = rclass
+        self.code = code
+        self.prefix = b"\x1b" + rclass
+
+    def pack(self, *values, data=b"") -> bytes:
+        return b"".join(
+            (
+                self.prefix,
+                _RASTER_LENGTH.pack(self.size + len(data)),
+                self.code,
+                self.struct.pack(*values),
+                data,
+            )
+        )
+
+
+# ESC/P commands, by (name, version)
+ESCP = {}
+
+# ESC/P commands with fixed parameters, by code, for decoding
+SIMPLE = {}
+
+# Extended commands, by (code, parameter size), for decoding
+EXTENDED = {}
+
+# Codes of the extended commands in EXTENDED
+EXTENDED_CODES = set()
+
+# ESC/P-R commands, by code
+ESCPR = {}
+
+# REMOTE1 parameter layouts, by code
+REMOTE1 = {}
+
+# REMOTE1 mode framing
+REMOTE1_ENTER = b"\x1b(R\x08\x00\x00REMOTE1"
+REMOTE1_EXIT = b"\x1b\x00\x00\x00"
+
+
+def lookup(name, version=2) -> Command:
+    """ESC/P command 'name' in the given command set version"""
+    command = ESCP.get((name, version))
+    if command is None:
+        raise Exception(f"Unknown version '{version}'.")
+    return command
+
+
+def remote1(code, data=b"", response=0) -> bytes:
+    """REMOTE1 command: code, parameter size, response flag and data"""
+    return code + _LENGTH.pack(len(data) + 1) + bytes((response,)) + data
+
+
+def remote1_mode(*commands) -> bytes:
+    """REMOTE1 commands, framed by entering and leaving REMOTE1 mode"""
+    return REMOTE1_ENTER + b"".join(commands) + REMOTE1_EXIT
+
+
+def _escp(name, code, fmt, fields, versions=(1, 2)):
+    command = Command(code, fmt, fields)
+    for version in versions:
+        ESCP[(name, version)] = command
+    if command.extended:
+        EXTENDED[(code[1:2], command.size)] = command
+        EXTENDED_CODES.add(code[1:2])
+    else:
+        SIMPLE[code] = command
+    return command
+
+
+def _escpr(rclass, code, fmt=">", fields=()):
+    command = RasterCommand(rclass, code, fmt, fields)
+    ESCPR[code] = command
+    return command
+
+
+# ESC/P; version 1 uses 16-bit and version 2 32-bit (extended) parameters
+_escp("direction", b"U", "B", ("unidirectional_mode",))
+_escp("raster", b"i", "<BBBHH", ("color", "compress", "bpp", "bwidth", "height"))
+_escp("left_margin", b"l", "B", ("columns",))
+_escp("right_margin", b"Q", "B", ("columns",))
+_escp("typeface", b"k", "B", ("typeface",))
+_escp("quality", b"x", "B", ("quality",))
+_escp("line_spacing", b"3", "B", ("spacing",))
+_escp("character_table", b"t", "B", ("table",))
+_escp("pitch_10", b"P", "", ())
+_escp("pitch_12", b"M", "", ())
+_escp("pitch_15", b"g", "", ())
+_escp("graphics_mode", b"(G", "B", ("mode",))
+_escp("microweave", b"(i", "B", ("mode",))
+_escp("color_mode", b"(K", "BB", (None, "color_mode"))
+_escp("image_resolution", b"(D", "<HBB", ("r", "v", "h"))
+_escp("dot_size", b"(e", "BB", (None, "dot_size"))
+_escp("print_method", b"(m", "B", ("print_method",))
+_escp("paper_dimension", b"(S", "<LL", ("w", "l"))
+
+_escp("color", b"r", "B", ("color",), versions=(1,))
+_escp("color", b"(r", "BB", (None, "color"), versions=(2,))
+_escp("unit", b"(U", "B", ("unit",), versions=(1,))
+_escp("unit", b"(U", "<BBBH", ("p", "v", "h", "m"), versions=(2,))
+_escp("page_format", b"(c", "<HH", ("t", "b"), versions=(1,))
+_escp("page_format", b"(c", "<LL", ("t", "b"), versions=(2,))
+_escp("page_length", b"(C", "<H", ("length",), versions=(1,))
+_escp("page_length", b"(C", "<L", ("length",), versions=(2,))
+_escp("vertical_position", b"(V", "<H", ("position",), versions=(1,))
+_escp("vertical_position", b"(V", "<L", ("position",), versions=(2,))
+_escp("vertical_increment", b"(v", "<H", ("offset",), versions=(1,))
+_escp("vertical_increment", b"(v", "<L", ("offset",), versions=(2,))
+_escp("horizontal_position", b"$", "<H", ("position",), versions=(1,))
+_escp("horizontal_position", b"($", "<L", ("position",), versions=(2,))
+_escp("horizontal_increment", b"\\", "<h", ("offset",), versions=(1,))
+_escp("horizontal_increment", b"(/", "<L", ("offset",), versions=(2,))
+
+# ESC/P-R
+_escpr(
+    b"j",
+    b"setj",
+    ">LLHHLLBB",
+    ("width", "height", "top", "left", "rwidth", "rheight", "ir", "pd"),
+)
+_escpr(b"j", b"sets", ">BBBBB", ("size", "layout", "cddim_id", "cddim_od", "pd"))
+_escpr(b"j", b"endj")
+_escpr(
+    b"q",
+    b"setq",
+    ">BBBbbbBH",
+    ("mtid", "mqid", "cm", "brightness", "contrast", "saturation", "cp", "plen"),
+)
+_escpr(b"a", b"seta", ">BBbB", ("cm", "act", "sharpness", "rde"))
+_escpr(b"c", b"setc", ">B", ("copies",))
+_escpr(b"p", b"sttp")
+_escpr(b"p", b"setn", ">B", ("pageno",))
+_escpr(b"p", b"endp", ">B", ("pages_remaining",))
+_escpr(b"d", b"dsnd", ">HHBH", ("x", "y", "compress", "dlen"))
+_escpr(b"d", b"jsnd", ">H", ("size",))
+
+# REMOTE1
+REMOTE1[b"TI"] = Layout(">HBBBBB", ("year", "month", "day", "hour", "min", "sec"))
+REMOTE1[b"JH"] = Layout(">BL", ("job_type", "job_id"))
+REMOTE1[b"st"] = Layout("", ())
@@ -28,6 +28,7 @@ from __future__ import division
 from __future__ import print_function
 
 from enum import Enum, StrEnum
+import re
 import ctypes
 
 
@@ -57,8 +58,8 @@ def run_length_encode(line: bytes, bytes_per_pixel=3):
 
         if repeat == 1:
             # Unique data
-            unique = 2
-            while next_pixel < len(line) and repeat < 0x80 and npix != tpix:
+            unique = 1
+            while next_pixel < len(line) and unique < 0x80 and npix != tpix:
                 next_pixel += bytes_per_pixel
                 unique += 1
                 npix = line[next_pixel : next_pixel + bytes_per_pixel]
@@ -73,6 +74,48 @@ def run_length_encode(line: bytes, bytes_per_pixel=3):
     return out
 
 
+_RUNS = re.compile(rb"(.)\1*", re.S)
+
+
+def run_length_encode_gray(line: bytes, bytes_per_pixel=3):
+    """Run length encode 8-bit gray samples as pixels with equal channels
+
+    Decodes to the same pixels as run_length_encode() of the expanded
+    pixels, although runs may be split differently. Runs are found on one
+    byte per pixel, and each sample is only repeated to bytes_per_pixel
+    bytes on output.
+    """
+    out = bytearray()
+    literal = bytearray()
+
+    def flush():
+        while literal:
+            chunk = literal[:0x80]
+            del literal[:0x80]
+            out.append(len(chunk) - 1)
+            for sample in chunk:
+                out.extend(bytes((sample,)) * bytes_per_pixel)
+
+    for run in _RUNS.finditer(line):
+        start, end = run.span()
+        count = end - start
+        if count == 1:
+            literal.append(line[start])
+            continue
+        flush()
+        pixel = bytes((line[start],)) * bytes_per_pixel
+        while count > 1:
+            repeat = min(count, 0x81)
+            out.append(257 - repeat)
+            out.extend(pixel)
+            count -= repeat
+        if count:
+            literal.append(line[start])
+
+    flush()
+    return bytes(out)
+
+
 class ValueEnum(Enum):
     def __index__(self):
         return self.value
@@ -0,0 +1,468 @@
+#
+#  Copyright (C) 2016, Jason S. McMullan <jason.mcmullan@gmail.com>
+#  All rights reserved.
+#
+#  Licensed under the MIT License:
+#
+#  Permission is hereby granted, free of charge, to any person obtaining
+#  a copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import time
+import struct
+import threading
+
+import epson.io
+
+# Sent in plain mode to switch the printer into IEEE 1284.4 packet mode
+# (see also epson.escp.Interface.ExitPacketMode)
+Enter = b"\x00\x00\x00\x1b\x01@EJL 1284.4\n@EJL     \n"
+
+# Packet header: PSID, SSID, length (including the header), credit, control
+Header = struct.Struct(">BBHBB")
+
+# Transaction channel commands; replies have bit 7 set
+INIT = 0x00
+OPEN_CHANNEL = 0x01
+CLOSE_CHANNEL = 0x02
+CREDIT = 0x03
+CREDIT_REQUEST = 0x04
+EXIT = 0x08
+GET_SOCKET_ID = 0x09
+ERROR = 0x7F
+REPLY = 0x80
+
+REVISION = 0x10
+
+# Services of EPSON printers
+CONTROL = "EPSON-CTRL"
+DATA = "EPSON-DATA"
+
+
+def packet(psid, ssid, payload=b"", credit=0, control=0):
+    """Frame a D4 packet"""
+    return (
+        Header.pack(psid, ssid, Header.size + len(payload), credit, control) + payload
+    )
+
+
+class _Parser(object):
+    """Split a byte stream into (psid, ssid, credit, control, payload) packets"""
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        if data:
+            self.buffer += data
+        packets = []
+        buffer = self.buffer
+        while len(buffer) >= Header.size:
+            psid, ssid, length, credit, control = Header.unpack_from(buffer)
+            if length < Header.size:
+                raise Exception(f"Invalid D4 packet length '{length}'.")
+            if len(buffer) < length:
+                break
+            packets.append(
+                (psid, ssid, credit, control, bytes(buffer[Header.size : length]))
+            )
+            del buffer[:length]
+        return packets
+
+
+class Channel(epson.io.Io):
+    """One D4 channel, usable as an epson.io transport"""
+
+    def __init__(self, link, name, sid, pts_size, stp_size, credit):
+        """
+        @param link     : Link the channel belongs to
+        @param name     : Service name
+        @param sid      : Socket ID (used as both PSID and SSID)
+        @param pts_size : Largest packet, host to printer
+        @param stp_size : Largest packet, printer to host
+        @param credit   : Packets the printer initially accepts
+        """
+        self.link = link
+        self.name = name
+        self.sid = sid
+        self.pts_size = pts_size
+        self.stp_size = stp_size
+
+        # Packets we may still send, and credit requested but not granted
+        self.credit = credit
+        self.requested = False
+
+        # Received data, and packets received but not yet credited back
+        self.inbox = bytearray()
+        self.owed = 0
+
+        self.sent = 0
+        self.waits = 0
+
+    def close(self):
+        self.link.close_channel(self)
+
+    def send(self, data=None):
+        link = self.link
+        size = self.pts_size - Header.size
+        view = memoryview(data)
+
+        for pos in range(0, len(view), size):
+            piece = view[pos : pos + size]
+            with link.lock:
+                if self.credit <= link.low_water:
+                    # Pick up credit already granted, and ask for more
+                    # before running out, to keep the pipe full
+                    link.pump()
+                    if self.credit <= link.low_water and not self.requested:
+                        link.request_credit(self)
+                if self.credit == 0:
+                    self.waits += 1
+                    link.wait(lambda: self.credit > 0, "credit")
+
+                # Return the credit we owe the printer with the packet
+                grant = min(self.owed, 0xFF)
+                self.owed -= grant
+                self.credit -= 1
+                link.io.send(packet(self.sid, self.sid, piece, grant))
+                self.sent += len(piece)
+
+    def recv(self, expected=None, timeout=0.0):
+        link = self.link
+        with link.lock:
+            if not self.inbox:
+                link.pump(timeout)
+            if self.owed:
+                link.grant_credit(self)
+            if not self.inbox:
+                return None
+            count = expected or len(self.inbox)
+            data = bytes(self.inbox[:count])
+            del self.inbox[:count]
+            return data
+
+
+class Link(object):
+    """IEEE 1284.4 (D4) packet mode over an epson.io transport
+
+    Channels to printer services multiplex the transport: each is an
+    epson.io transport of its own, so status can be polled on EPSON-CTRL
+    while a job streams on EPSON-DATA. Sending a packet uses up one credit
+    granted by the printer; more is requested ahead of time, below
+    'low_water' credits, so that the link never idles waiting for it.
+    """
+
+    def __init__(self, io: epson.io.Io, timeout=10.0, low_water=2, credit=8):
+        """
+        @param io        : Underlying transport
+        @param timeout   : Seconds to wait for a reply or for credit
+        @param low_water : Request more credit at or below this
+        @param credit    : Packets the printer may send us per channel
+        """
+        self.io = io
+        self.timeout = timeout
+        self.low_water = low_water
+        self.host_credit = credit
+
+        self.lock = threading.RLock()
+        self.parser = _Parser()
+        self.channels = {}
+        self.replies = {}
+
+    """ Link management """
+
+    def open(self):
+        self.io.open()
+        with self.lock:
+            self.io.send(Enter)
+            result, revision = self.transact(INIT, struct.pack("B", REVISION), "BB")
+            if result != 0:
+                raise Exception(f"D4 Init failed ({result}).")
+
+    def close(self):
+        with self.lock:
+            for channel in list(self.channels.values()):
+                self.close_channel(channel)
+            self.transact(EXIT, b"", "B")
+        self.io.close()
+
+    def channel(self, name=DATA, pts_size=0x1000, stp_size=0x1000):
+        """Open a channel to a service"""
+        with self.lock:
+            result, sid = self.transact(GET_SOCKET_ID, name.encode(), "BB")
+            if result != 0:
+                raise Exception(f"D4 service '{name}' not found ({result}).")
+
+            data = struct.pack(">BBHHH", sid, sid, pts_size, stp_size, 0)
+            reply = self.transact(OPEN_CHANNEL, data, ">BBBHHHH")
+            result, _, _, pts_size, stp_size, _, credit = reply
+            if result != 0:
+                raise Exception(f"D4 OpenChannel '{name}' failed ({result}).")
+
+            channel = Channel(self, name, sid, pts_size, stp_size, credit)
+            self.channels[sid] = channel
+            channel.owed = self.host_credit
+            self.grant_credit(channel)
+            return channel
+
+    def close_channel(self, channel):
+        with self.lock:
+            if self.channels.pop(channel.sid, None) is None:
+                return
+            self.transact(
+                CLOSE_CHANNEL, struct.pack("BB", channel.sid, channel.sid), "B"
+            )
+
+    """ Credit """
+
+    def request_credit(self, channel):
+        """Ask the printer for credit; the reply is handled by pump()"""
+        channel.requested = True
+        self._command(
+            CREDIT_REQUEST, struct.pack(">BBH", channel.sid, channel.sid, 0xFFFF)
+        )
+
+    def grant_credit(self, channel):
+        """Let the printer send as many packets as it has sent us"""
+        grant = min(channel.owed, 0xFFFF)
+        channel.owed -= grant
+        self._command(CREDIT, struct.pack(">BBH", channel.sid, channel.sid, grant))
+
+    """ Transaction channel """
+
+    def _command(self, command, data=b""):
+        self.io.send(packet(0, 0, bytes((command,)) + data, credit=1))
+
+    def transact(self, command, data, fmt):
+        """Send a transaction command and wait for its reply"""
+        with self.lock:
+            self.replies.pop(command | REPLY, None)
+            self._command(command, data)
+            self.wait(lambda: command | REPLY in self.replies, f"reply {command:#x}")
+            payload = self.replies.pop(command | REPLY)
+            return struct.unpack_from(fmt, payload)
+
+    def wait(self, ready, what="data"):
+        deadline = time.monotonic() + self.timeout
+        while not ready():
+            left = deadline - time.monotonic()
+            if left <= 0:
+                raise Exception(f"D4 timeout waiting for {what}.")
+            self.pump(min(left, 0.05))
+
+    def pump(self, timeout=0.0):
+        """Process the packets received from the printer"""
+        with self.lock:
+            data = self.io.recv(timeout=timeout)
+            for psid, ssid, credit, control, payload in self.parser.feed(data):
+                if psid == 0 and ssid == 0:
+                    self._transaction(payload)
+                    continue
+
+                channel = self.channels.get(psid)
+                if channel is None:
+                    continue
+                channel.credit += credit
+                if payload:
+                    channel.inbox += payload
+                    channel.owed += 1
+
+    def _transaction(self, payload):
+        command = payload[0]
+        body = payload[1:]
+
+        if command == CREDIT:
+            # The printer grants credit
+            psid, ssid, credit = struct.unpack_from(">BBH", body)
+            channel = self.channels.get(psid)
+            if channel is not None:
+                channel.credit += credit
+            self.io.send(packet(0, 0, bytes((CREDIT | REPLY, 0, psid, ssid)), credit=1))
+        elif command == CREDIT_REQUEST | REPLY:
+            result, psid, ssid, credit = struct.unpack_from(">BBBH", body)
+            channel = self.channels.get(psid)
+            if channel is not None:
+                channel.credit += credit
+                channel.requested = False
+        elif command == CREDIT | REPLY:
+            pass
+        elif command == ERROR:
+            raise Exception(f"D4 error reply {body.hex()}.")
+        else:
+            self.replies[command] = body
+
+
+class Peer(object):
+    """Printer side of a D4 link, for loopback tests and emulation
+
+    Each service is a function called with the data received on its
+    channel, returning the bytes to send back (or None). Credit is returned
+    to the host every 'credit' // 2 packets consumed.
+    """
+
+    def __init__(self, services=None, credit=8, packet_size=0x1000):
+        """
+        @param services    : Handler functions, by service name
+        @param credit      : Packets the host may send ahead, per channel
+        @param packet_size : Largest packet accepted
+        """
+        if services is None:
+            services = {CONTROL: None, DATA: None}
+        self.services = {}
+        self.sockets = {}
+        for sid, (name, handler) in enumerate(services.items(), start=0x40):
+            self.services[name] = sid
+            self.sockets[sid] = handler
+
+        self.credit = credit
+        self.packet_size = packet_size
+        self.output = None
+
+        self.packet_mode = False
+        self.pending = b""
+        self.parser = _Parser()
+
+        # Per socket: credit owed to the host, credit to send, queued replies
+        self.consumed = {}
+        self.host_credit = {}
+        self.outbox = {}
+        self.received = {}
+
+    def _send(self, data):
+        self.output(data)
+
+    def _reply(self, command, data=b""):
+        self._send(packet(0, 0, bytes((command | REPLY,)) + data, credit=1))
+
+    def feed(self, data):
+        if not self.packet_mode:
+            data = self.pending + data
+            start = data.find(Enter[4:])
+            if start < 0:
+                self.pending = data[-len(Enter) :]
+                return
+            self.packet_mode = True
+            data = data[start + len(Enter) - 4 :]
+
+        for psid, ssid, credit, control, payload in self.parser.feed(data):
+            if psid == 0 and ssid == 0:
+                self._transaction(payload)
+                continue
+            if psid not in self.sockets:
+                continue
+
+            self.host_credit[psid] = self.host_credit.get(psid, 0) + credit
+            if payload:
+                self.received[psid] = self.received.get(psid, 0) + len(payload)
+                self.consumed[psid] = self.consumed.get(psid, 0) + 1
+                handler = self.sockets[psid]
+                if handler is not None:
+                    reply = handler(payload)
+                    if reply:
+                        self.outbox[psid] = self.outbox.get(psid, b"") + reply
+
+            if self.consumed.get(psid, 0) >= max(1, self.credit // 2):
+                self._grant(psid)
+            self._flush(psid)
+
+    def _grant(self, sid):
+        credit = self.consumed.get(sid, 0)
+        self.consumed[sid] = 0
+        data = bytes((CREDIT,)) + struct.pack(">BBH", sid, sid, credit)
+        self._send(packet(0, 0, data, credit=1))
+
+    def _flush(self, sid):
+        """Send queued replies as far as the host's credit allows"""
+        data = self.outbox.get(sid, b"")
+        size = self.packet_size - Header.size
+        while data and self.host_credit.get(sid, 0) > 0:
+            self.host_credit[sid] -= 1
+            self._send(packet(sid, sid, data[:size]))
+            data = data[size:]
+        self.outbox[sid] = data
+
+    def _transaction(self, payload):
+        command = payload[0]
+        body = payload[1:]
+
+        if command == INIT:
+            self._reply(INIT, bytes((0, REVISION)))
+        elif command == GET_SOCKET_ID:
+            sid = self.services.get(body.decode(errors="replace"))
+            if sid is None:
+                self._reply(GET_SOCKET_ID, bytes((1, 0)) + body)
+            else:
+                self._reply(GET_SOCKET_ID, bytes((0, sid)) + body)
+        elif command == OPEN_CHANNEL:
+            psid, ssid, pts, stp, _ = struct.unpack_from(">BBHHH", body)
+            result = 0 if psid in self.sockets else 1
+            pts = min(pts, self.packet_size)
+            self.consumed[psid] = 0
+            self.host_credit[psid] = 0
+            self._reply(
+                OPEN_CHANNEL,
+                struct.pack(">BBBHHHH", result, psid, ssid, pts, stp, 0, self.credit),
+            )
+        elif command == CLOSE_CHANNEL:
+            psid, ssid = struct.unpack_from("BB", body)
+            self.host_credit.pop(psid, None)
+            self._reply(CLOSE_CHANNEL, bytes((0, psid, ssid)))
+        elif command == CREDIT:
+            psid, ssid, credit = struct.unpack_from(">BBH", body)
+            self.host_credit[psid] = self.host_credit.get(psid, 0) + credit
+            self._reply(CREDIT, bytes((0, psid, ssid)))
+            self._flush(psid)
+        elif command == CREDIT_REQUEST:
+            psid, ssid, _ = struct.unpack_from(">BBH", body)
+            credit = self.consumed.get(psid, 0)
+            self.consumed[psid] = 0
+            self._reply(CREDIT_REQUEST, struct.pack(">BBBH", 0, psid, ssid, credit))
+        elif command == EXIT:
+            self.packet_mode = False
+            self._reply(EXIT, bytes((0,)))
+        elif command & REPLY:
+            pass
+        else:
+            self._send(packet(0, 0, bytes((ERROR, command)), credit=1))
+
+
+class Loopback(epson.io.Io):
+    """In-process transport connected to a Peer"""
+
+    def __init__(self, peer: Peer):
+        """
+        @param peer : Printer side of the link
+        """
+        self.peer = peer
+        self.inbox = bytearray()
+        peer.output = self.inbox.extend
+
+    def send(self, data=None):
+        self.peer.feed(bytes(data))
+
+    def recv(self, expected=None, timeout=0.0):
+        if not self.inbox:
+            return None
+        count = expected or len(self.inbox)
+        data = bytes(self.inbox[:count])
+        del self.inbox[:count]
+        return data
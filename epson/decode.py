@@ -0,0 +1,590 @@
+#
+#  Copyright (C) 2016, Jason S. McMullan <jason.mcmullan@gmail.com>
+#  All rights reserved.
+#
+#  Licensed under the MIT License:
+#
+#  Permission is hereby granted, free of charge, to any person obtaining
+#  a copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import struct
+from collections import Counter
+
+from epson import command
+
+ESCPR_DPI = {0: 360, 1: 720, 2: 300, 3: 600}
+
+
+def rle_decode(data: bytes, bytes_per_pixel=1) -> bytes:
+    """Expand a run-length encoded buffer (see constant.run_length_encode)"""
+    out = []
+    pos = 0
+    end = len(data)
+    while pos < end:
+        c = data[pos]
+        pos += 1
+        if c < 0x80:
+            size = (c + 1) * bytes_per_pixel
+            out.append(data[pos : pos + size])
+            pos += size
+        else:
+            out.append(data[pos : pos + bytes_per_pixel] * (257 - c))
+            pos += bytes_per_pixel
+
+    return b"".join(out)
+
+
+def _printable(code):
+    return "".join(chr(c) if 0x20 <= c < 0x7F else "\\x%02x" % c for c in code)
+
+
+def command_name(escp):
+    """Short human-readable name of a decoded command"""
+    kind = escp["type"]
+    if kind == "special":
+        return escp["name"]
+    if kind == "char":
+        return "char"
+    if kind == "escpr" or kind == "remote1":
+        return _printable(escp["code"])
+    if "extended" in escp:
+        return "ESC (" + _printable(escp["extended"])
+    return "ESC " + _printable(escp["code"])
+
+
+class Decoder(object):
+    """Streaming ESC/P, REMOTE1 and ESC/P-R command decoder"""
+
+    def __init__(self, fin=None):
+        """
+        @param fin : Binary file-like object to decode from
+        """
+        self.fin = fin
+        self.protocol = "escp"
+        # Number of commands decoded, by command name
+        self.commands = Counter()
+
+    def __iter__(self):
+        while True:
+            escp = self.read()
+            if escp is None:
+                break
+            self.commands[command_name(escp)] += 1
+            yield escp
+
+    def rle_read(self, blen=0, cmode=False, bytes_per_pixel=1):
+        if not cmode:
+            return self.fin.read(blen)
+
+        data = []
+        while blen > 0:
+            c = ord(self.fin.read(1))
+            if c < 0x80:
+                size = (c + 1) * bytes_per_pixel
+                data.append(self.fin.read(size))
+            else:
+                size = (257 - c) * bytes_per_pixel
+                data.append(self.fin.read(bytes_per_pixel) * (257 - c))
+            blen -= size
+
+        return b"".join(data)
+
+    def read(self):
+        """Decode the next command, or return None at the end of the stream"""
+        fin = self.fin
+
+        if self.protocol == "remote1":
+            code = fin.read(2)
+            if len(code) < 2:
+                return None
+
+            (clen,) = struct.unpack("<H", fin.read(2))
+            if code == b"\x1b\x00" and clen == 0:
+                self.protocol = "escp"
+                return {"type": self.protocol, "code": b"\x00", "data": b"\x00\x00"}
+
+            (cres,) = struct.unpack("<B", fin.read(1))
+            data = fin.read(clen - 1)
+            escp = {"type": self.protocol, "code": code, "response": cres}
+            if code == b"TI":
+                date = command.REMOTE1[code].struct.unpack(data)
+                escp["date"] = "%d-%d-%d,%d:%02d:%02d" % date
+            else:
+                escp["data"] = data
+
+            return escp
+
+        ch = fin.read(1)
+        if len(ch) < 1:
+            return None
+
+        if ch == b"\x0a":
+            return {"type": "special", "name": "Line Feed"}
+
+        if ch == b"\x0c":
+            return {"type": "special", "name": "Form Feed"}
+
+        if ch == b"\x0d":
+            return {"type": "special", "name": "Carriage Return"}
+
+        if ch != b"\x1b":
+            return {"type": "char", "char": ch}
+
+        if self.protocol == "escpr":
+            return self._read_escpr()
+
+        return self._read_escp()
+
+    def _read_escpr(self):
+        fin = self.fin
+
+        rclass = fin.read(1)
+        (rlen,) = struct.unpack("<L", fin.read(4))
+        rcode = fin.read(4)
+        rdata = fin.read(rlen)
+
+        escpr = {"type": "escpr", "class": rclass, "code": rcode}
+
+        layout = command.ESCPR.get(rcode)
+        if layout is not None and layout.rclass == rclass:
+            special = self._escpr_special.get(rcode)
+            if special is not None:
+                rdata = special(self, escpr, layout.unpack(rdata), rdata[layout.size :])
+            elif layout.size > 0:
+                escpr.update(layout.unpack(rdata))
+                rdata = rdata[layout.size :]
+
+        if rdata is not None and len(rdata) > 0:
+            escpr["data"] = rdata
+
+        return escpr
+
+    def _escpr_dsnd(self, escpr, values, rdata):
+        rdata = rdata[0 : values["dlen"]]
+        escpr["compress"] = values["compress"]
+        escpr["x"] = values["x"]
+        escpr["y"] = values["y"]
+        if values["compress"]:
+            escpr["raster"] = rle_decode(rdata, 3)
+        else:
+            escpr["raster"] = rdata
+        return None
+
+    def _escpr_endj(self, escpr, values, rdata):
+        self.protocol = "escp"
+        return rdata
+
+    def _escpr_setj(self, escpr, values, rdata):
+        width, height = values["width"], values["height"]
+        left, top = values["left"], values["top"]
+        rwidth, rheight = values["rwidth"], values["rheight"]
+        escpr["paper"] = (width, height)
+        escpr["margin"] = (
+            left,
+            top,
+            (width - left - rwidth),
+            (height - top - rheight),
+        )
+        escpr["size"] = (rwidth, rheight)
+        escpr["dpi"] = ESCPR_DPI.get(values["ir"], 360)
+        escpr["pd"] = values["pd"]
+        return None
+
+    def _escpr_setq(self, escpr, values, rdata):
+        del values["plen"]
+        escpr.update(values)
+        escpr["palette"] = rdata if len(rdata) > 0 else None
+        return None
+
+    # ESC/P-R commands needing more than their parameter layout, by code
+    _escpr_special = {
+        b"dsnd": _escpr_dsnd,
+        b"endj": _escpr_endj,
+        b"setj": _escpr_setj,
+        b"setq": _escpr_setq,
+    }
+
+    def _read_escp(self):
+        fin = self.fin
+
+        code = fin.read(1)
+        escp = {"type": self.protocol, "code": code}
+
+        special = self._escp_special.get(code)
+        if special is not None:
+            special(self, escp)
+        else:
+            layout = command.SIMPLE.get(code)
+            if layout is not None:
+                escp.update(layout.unpack(fin.read(layout.size)))
+
+        return escp
+
+    def _escp_exit_packet_mode(self, escp):
+        fin = self.fin
+        data = b""
+        nl = 0
+        while True:
+            ch = fin.read(1)
+            if len(ch) < 1:
+                break
+            data += ch
+            if ch == b"\n":
+                nl = nl + 1
+                if nl == 2:
+                    break
+        escp["data"] = data
+
+    def _escp_raster(self, escp):
+        # Raster data.
+        layout = command.SIMPLE[b"i"]
+        escp.update(layout.unpack(self.fin.read(layout.size)))
+        bwidth, lines = escp["bwidth"], escp["height"]
+        escp["width"] = int(bwidth / escp["bpp"] * 8)
+        escp["raster"] = self.rle_read(bwidth * lines, escp["compress"])
+
+    def _escp_dot_raster(self, escp):
+        # Raster data.
+        fin = self.fin
+        (escp["c"],) = struct.unpack("B", fin.read(1))
+        (escp["v"],) = struct.unpack("B", fin.read(1))
+        (escp["h"],) = struct.unpack("B", fin.read(1))
+        (escp["m"],) = struct.unpack("B", fin.read(1))
+        (escp["nL"],) = struct.unpack("B", fin.read(1))
+        (escp["nH"],) = struct.unpack("B", fin.read(1))
+
+        k = escp["m"] * int((escp["nH"] * 256 + escp["nL"] + 7) / 8)
+
+        if escp["c"] == 0:
+            escp["d"] = fin.read(k)
+
+        elif escp["c"] == 1:
+            escp["d"] = self.rle_read(k, True)
+
+        else:
+            raise Exception()
+
+    def _escp_extended(self, escp):
+        fin = self.fin
+        ecode = fin.read(1)
+        (elen,) = struct.unpack("<H", fin.read(2))
+        data = fin.read(elen)
+        escp["extended"] = ecode
+        self._read_extended(escp, ecode, elen, data)
+
+    # ESC/P commands not described by a fixed layout, by code
+    _escp_special = {
+        b"\x01": _escp_exit_packet_mode,
+        b"@": lambda self, escp: None,
+        b"i": _escp_raster,
+        b".": _escp_dot_raster,
+        b"(": _escp_extended,
+    }
+
+    def _read_extended(self, escp, ecode, elen, data):
+        special = self._extended_special.get(ecode)
+        if special is not None:
+            special(self, escp, elen, data)
+            return
+
+        layout = command.EXTENDED.get((ecode, elen))
+        if layout is not None:
+            escp.update(layout.unpack(data))
+        elif ecode in command.EXTENDED_CODES:
+            raise ValueError(f"Incorrect parameters size '{elen}'.")
+        else:
+            escp["data"] = data
+
+    def _extended_remote(self, escp, elen, data):
+        escp["response"] = data[0]
+        data = data[1:]
+        escp["protocol"] = data
+        if data == b"REMOTE1":
+            self.protocol = "remote1"
+        elif data == b"ESCPR" or data == b"ESCPRJ":
+            self.protocol = "escpr"
+
+    def _extended_resolution(self, escp, elen, data):
+        # Set raster resolution.
+        layout = command.EXTENDED.get((b"D", elen))
+        if layout is None:
+            raise ValueError(f"Incorrect parameters size '{elen}'.")
+        escp.update(layout.unpack(data))
+        escp["resolution"] = f"{escp['r']//escp['v']}x{escp['r']//escp['h']} DPI"
+
+    def _extended_color_mode(self, escp, elen, data):
+        # Set Color Mode.
+        # 0: Default, 1: Monochrome, 2: Color.
+        # NOTE: For some reason the parameter count is defined as 1, but the
+        # command actually has two bytes of data.
+        if elen == 1:
+            assert data == b"\x00"
+            self.fin.read(1)
+            data += self.fin.read(1)
+        escp.update(command.EXTENDED[(b"K", 2)].unpack(data))
+
+    # Extended commands needing more than their parameter layout, by code
+    _extended_special = {
+        b"R": _extended_remote,
+        b"D": _extended_resolution,
+        b"K": _extended_color_mode,
+    }
+
+    """ Raster reconstruction """
+
+    def rows(self):
+        """Yield every raster row of the stream, decompressed and placed
+
+        Rows are yielded in page and y order, one per (page, y, plane).
+        ESC/P-R rows are full printable-width RGB lines (white where nothing
+        was sent), with plane None. ESC/P rows are full paper-width bitmaps
+        for a single color plane (the ESC i color code).
+        """
+        for item in self._raster():
+            if isinstance(item, Row):
+                yield item
+
+    def _raster(self):
+        """Yield the rows of the stream, and a _PageEnd after each page"""
+        page = 1
+        width = 0
+        height = 0
+        # ESC/P page format bottom, used when no paper dimension is given
+        bottom = 0
+        x = 0
+        y = 0
+        # Segments of the rows being assembled: (y, plane) -> [(x, bpp, data)]
+        pending = {}
+
+        for escp in self:
+            kind = escp["type"]
+
+            if kind == "escpr":
+                code = escp["code"]
+                if code == b"dsnd":
+                    if pending and (escp["y"], None) not in pending:
+                        yield from _flush(page, width, pending)
+                    segs = pending.setdefault((escp["y"], None), [])
+                    segs.append((escp["x"], 24, escp["raster"]))
+                elif code == b"setj":
+                    width, height = escp["size"]
+                elif code == b"endp":
+                    yield from _flush(page, width, pending)
+                    yield _PageEnd(page, height)
+                    page += 1
+                continue
+
+            if kind == "special":
+                if escp["name"] == "Carriage Return":
+                    x = 0
+                elif escp["name"] == "Form Feed":
+                    yield from _flush(page, width, pending)
+                    yield _PageEnd(page, height or bottom)
+                    page += 1
+                    x = 0
+                    y = 0
+                continue
+
+            if kind != "escp":
+                continue
+
+            code = escp["code"]
+            if code == b"i":
+                bwidth = escp["bwidth"]
+                for n in range(escp["height"]):
+                    segs = pending.setdefault((y + n, escp["color"]), [])
+                    data = escp["raster"][n * bwidth : (n + 1) * bwidth]
+                    segs.append((x, escp["bpp"], data))
+                x += escp["width"]
+            elif code == b"$":
+                x = escp["position"]
+            elif code == b"\\":
+                x += escp["offset"]
+            elif code == b"(":
+                ecode = escp["extended"]
+                if ecode == b"S":
+                    width, height = escp["w"], escp["l"]
+                elif ecode == b"c":
+                    bottom = escp["b"]
+                elif ecode == b"$":
+                    x = escp["position"]
+                elif ecode == b"/":
+                    x += escp["offset"]
+                elif ecode == b"V":
+                    yield from _flush(page, width, pending)
+                    y = escp["position"]
+                elif ecode == b"v":
+                    yield from _flush(page, width, pending)
+                    y += escp["offset"]
+
+        if pending:
+            yield from _flush(page, width, pending)
+            yield _PageEnd(page, height or bottom)
+
+    def pages(self):
+        """Yield each page of the stream as a Page
+
+        A Page is yielded for every ESC/P-R end of page or ESC/P form feed,
+        even without rows, sized by the page geometry of the stream (the
+        ESC/P-R printable area, or the ESC/P paper dimension).
+        """
+        current = Page(number=1)
+        for item in self._raster():
+            if isinstance(item, Row):
+                current.add(item)
+            else:
+                yield current.finish(item.height)
+                current = Page(number=item.page + 1)
+
+
+class _PageEnd(object):
+    """End of a page in Decoder._raster()"""
+
+    __slots__ = ("page", "height")
+
+    def __init__(self, page=1, height=0):
+        self.page = page
+        self.height = height
+
+
+class Row(object):
+    """A single decompressed raster row"""
+
+    __slots__ = ("page", "y", "plane", "data")
+
+    def __init__(self, page=1, y=0, plane=None, data=b""):
+        self.page = page
+        self.y = y
+        self.plane = plane
+        self.data = data
+
+    def __repr__(self):
+        return "Row(page=%d, y=%d, plane=%r, %d bytes)" % (
+            self.page,
+            self.y,
+            self.plane,
+            len(self.data),
+        )
+
+
+class Page(object):
+    """A reconstructed page
+
+    ESC/P-R pages have a single plane (None) of 24-bit RGB rows. ESC/P pages
+    have one bitmap plane per ESC i color code. Each plane is a single
+    contiguous buffer of height * stride bytes; missing rows are blank
+    (white for RGB, no ink for bitmaps).
+    """
+
+    def __init__(self, number=1):
+        self.number = number
+        self.height = 0
+        self.stride = {}
+        self.planes = {}
+        self._rows = []
+
+    def add(self, row):
+        self._rows.append(row)
+        self.height = max(self.height, row.y + 1)
+        self.stride[row.plane] = max(self.stride.get(row.plane, 0), len(row.data))
+
+    def finish(self, height=0):
+        """Assemble the rows, on a page at least 'height' rows high"""
+        self.height = max(self.height, height)
+        for plane, stride in self.stride.items():
+            blank = b"\xff" if plane is None else b"\x00"
+            self.planes[plane] = bytearray(blank * (stride * self.height))
+
+        for row in self._rows:
+            stride = self.stride[row.plane]
+            offset = row.y * stride
+            self.planes[row.plane][offset : offset + len(row.data)] = row.data
+
+        self._rows = []
+        return self
+
+    def row(self, y=0, plane=None):
+        """Retrieve a row of a plane"""
+        stride = self.stride[plane]
+        return bytes(self.planes[plane][y * stride : (y + 1) * stride])
+
+    def _blank(self, plane):
+        """Whether a plane has no content; planes without rows are blank"""
+        data = self.planes.get(plane)
+        if data is None:
+            return True
+        return not data.strip(b"\xff" if plane is None else b"\x00")
+
+    def __eq__(self, other):
+        """Pages are equal when they print the same dots
+
+        A plane missing from one page equals a blank plane of the other.
+        """
+        if not isinstance(other, Page):
+            return NotImplemented
+        if self.height != other.height:
+            return False
+        for plane in set(self.planes) | set(other.planes):
+            if plane not in self.planes or plane not in other.planes:
+                if not (self._blank(plane) and other._blank(plane)):
+                    return False
+            elif (
+                self.stride[plane] != other.stride[plane]
+                or self.planes[plane] != other.planes[plane]
+            ):
+                return False
+        return True
+
+
+def _flush(page, width, pending):
+    """Assemble and yield the pending row segments, then clear them"""
+    for y, plane in sorted(pending, key=lambda key: (key[0], key[1] or 0)):
+        segs = pending[(y, plane)]
+        if plane is None:
+            yield Row(page=page, y=y, plane=plane, data=_rgb_line(width, segs))
+        else:
+            yield Row(page=page, y=y, plane=plane, data=_bit_line(width, segs))
+    pending.clear()
+
+
+def _rgb_line(width, segs):
+    x, bpp, data = segs[0]
+    if len(segs) == 1 and x == 0 and len(data) == width * 3:
+        return data
+
+    extent = max([width] + [x + len(data) // 3 for x, bpp, data in segs])
+    line = bytearray(b"\xff" * (extent * 3))
+    for x, bpp, data in segs:
+        line[x * 3 : x * 3 + len(data)] = data
+    return bytes(line)
+
+
+def _bit_line(width, segs):
+    bpp = segs[0][1]
+    bits = max([width * bpp] + [x * bpp + len(data) * 8 for x, bpp, data in segs])
+    bits = (bits + 7) & ~7
+    line = 0
+    for x, bpp, data in segs:
+        shift = bits - x * bpp - len(data) * 8
+        line |= int.from_bytes(data, "big") << shift
+    return line.to_bytes(bits // 8, "big")
@@ -0,0 +1,193 @@
+#
+#  Copyright (C) 2016, Jason S. McMullan <jason.mcmullan@gmail.com>
+#  All rights reserved.
+#
+#  Licensed under the MIT License:
+#
+#  Permission is hereby granted, free of charge, to any person obtaining
+#  a copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from epson.decode import Decoder
+
+
+class _CountingReader(object):
+    """Wrap a binary file, counting the bytes read from it"""
+
+    def __init__(self, fin):
+        self.fin = fin
+        self.count = 0
+
+    def read(self, size=-1):
+        data = self.fin.read(size)
+        self.count += len(data)
+        return data
+
+
+def _key(row):
+    return (row.page, row.y, -1 if row.plane is None else row.plane)
+
+
+def _blank(row):
+    return b"\xff" if row.plane is None else b"\x00"
+
+
+def _divergence(a, b, fill):
+    """Return the first differing byte offset of two rows, or None"""
+    if len(a) < len(b):
+        a = a + fill * (len(b) - len(a))
+    elif len(b) < len(a):
+        b = b + fill * (len(a) - len(b))
+
+    if a == b:
+        return None
+
+    # Bisect for the first mismatch, comparing slices at C speed.
+    lo, hi = 0, len(a)
+    while hi - lo > 64:
+        mid = (lo + hi) // 2
+        if a[lo:mid] != b[lo:mid]:
+            hi = mid
+        else:
+            lo = mid
+    for offset in range(lo, hi):
+        if a[offset] != b[offset]:
+            return offset
+    return None
+
+
+class Report(object):
+    """Result of a semantic comparison of two command streams"""
+
+    def __init__(self):
+        # First divergent row: dict of page, y, plane and byte offset
+        self.first = None
+        # Number of rows that differ
+        self.rows_differ = 0
+        # Number of rows compared
+        self.rows = 0
+        # Stream sizes in bytes
+        self.size = (0, 0)
+        # Command counts, by command name
+        self.commands = ({}, {})
+
+    @property
+    def identical(self):
+        return self.first is None
+
+    def command_delta(self):
+        """Per-command count difference (b - a), omitting equal counts"""
+        a, b = self.commands
+        delta = {}
+        for name in sorted(set(a) | set(b)):
+            diff = b.get(name, 0) - a.get(name, 0)
+            if diff != 0:
+                delta[name] = diff
+        return delta
+
+    def as_dict(self):
+        return {
+            "identical": self.identical,
+            "first": self.first,
+            "rows": self.rows,
+            "rows_differ": self.rows_differ,
+            "size": list(self.size),
+            "size_delta": self.size[1] - self.size[0],
+            "commands": [dict(self.commands[0]), dict(self.commands[1])],
+            "command_delta": self.command_delta(),
+        }
+
+    def __str__(self):
+        lines = []
+        if self.first is None:
+            lines.append("Rasters are identical (%d rows)" % (self.rows))
+        else:
+            first = self.first
+            lines.append(
+                "First difference: page %d, line %d, plane %s, byte %d"
+                % (first["page"], first["y"], first["plane"], first["offset"])
+            )
+            lines.append("%d of %d rows differ" % (self.rows_differ, self.rows))
+        lines.append(
+            "Size: %d -> %d bytes (%+d)"
+            % (self.size[0], self.size[1], self.size[1] - self.size[0])
+        )
+        for name, diff in self.command_delta().items():
+            lines.append(
+                "Command %s: %d -> %d (%+d)"
+                % (
+                    name,
+                    self.commands[0].get(name, 0),
+                    self.commands[1].get(name, 0),
+                    diff,
+                )
+            )
+        return "\n".join(lines)
+
+
+def diff(fin_a, fin_b):
+    """Compare the decoded rasters of two command streams
+
+    Both streams are decoded row by row, so memory use is bounded by a
+    single row of each stream regardless of the input size. Rows missing
+    from one stream (blank line skipping) compare as blank.
+    """
+    reader_a = _CountingReader(fin_a)
+    reader_b = _CountingReader(fin_b)
+    decoder_a = Decoder(reader_a)
+    decoder_b = Decoder(reader_b)
+    rows_a = decoder_a.rows()
+    rows_b = decoder_b.rows()
+
+    report = Report()
+
+    row_a = next(rows_a, None)
+    row_b = next(rows_b, None)
+    while row_a is not None or row_b is not None:
+        if row_b is None or (row_a is not None and _key(row_a) < _key(row_b)):
+            row, data_a, data_b = row_a, row_a.data, b""
+            row_a = next(rows_a, None)
+        elif row_a is None or _key(row_b) < _key(row_a):
+            row, data_a, data_b = row_b, b"", row_b.data
+            row_b = next(rows_b, None)
+        else:
+            row, data_a, data_b = row_a, row_a.data, row_b.data
+            row_a = next(rows_a, None)
+            row_b = next(rows_b, None)
+
+        report.rows += 1
+        offset = _divergence(data_a, data_b, _blank(row))
+        if offset is None:
+            continue
+
+        report.rows_differ += 1
+        if report.first is None:
+            report.first = {
+                "page": row.page,
+                "y": row.y,
+                "plane": row.plane,
+                "offset": offset,
+            }
+
+    report.size = (reader_a.count, reader_b.count)
+    report.commands = (dict(decoder_a.commands), dict(decoder_b.commands))
+    return report
@@ -0,0 +1,398 @@
+#
+#  Copyright (C) 2016, Jason S. McMullan <jason.mcmullan@gmail.com>
+#  All rights reserved.
+#
+#  Licensed under the MIT License:
+#
+#  Permission is hereby granted, free of charge, to any person obtaining
+#  a copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import time
+import struct
+import socket
+import threading
+
+import epson.io
+import epson.status
+from epson.decode import Decoder
+
+
+class _Buffer(object):
+    """Finite receive buffer between the connection and the print engine
+
+    put() blocks while the buffer is full, so a TCP sender sees the same
+    back-pressure as with a real printer; read() blocks until data arrives
+    and is paced at the consumption rate. A read larger than the capacity
+    lets the buffer grow to the size read, so that it cannot deadlock.
+    """
+
+    def __init__(self, capacity=1 << 20, rate=None):
+        self.capacity = capacity
+        self.rate = rate
+        self.data = bytearray()
+        self.closed = False
+        self.condition = threading.Condition()
+        self.consumed = 0
+        self._due = None
+        # Bytes a blocked read() is waiting for
+        self.wanted = 0
+
+    def put(self, data):
+        with self.condition:
+            while len(self.data) >= max(self.capacity, self.wanted) and not self.closed:
+                self.condition.wait()
+            self.data += data
+            self.condition.notify_all()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def __len__(self):
+        return len(self.data)
+
+    def read(self, count=-1):
+        with self.condition:
+            while len(self.data) < max(count, 1) and not self.closed:
+                self.wanted = count
+                self.condition.notify_all()
+                self.condition.wait()
+            self.wanted = 0
+            if count < 0:
+                count = len(self.data)
+            data = bytes(self.data[:count])
+            del self.data[:count]
+            self.condition.notify_all()
+
+        self.consumed += len(data)
+        if self.rate:
+            pace(self, len(data) / self.rate)
+        return data
+
+
+def pace(owner, seconds):
+    """Sleep so that successive calls add up to real time"""
+    now = time.monotonic()
+    due = max(owner._due or now, now) + seconds
+    owner._due = due
+    if due > now:
+        time.sleep(due - now)
+
+
+class Session(object):
+    """One spool received by the emulator, with its per-page timing"""
+
+    def __init__(self):
+        self.start = time.monotonic()
+        self.end = None
+        self.bytes = 0
+        self.dots = 0
+        self.pages = []
+        self.queries = 0
+        self.commands = None
+        self.error = None
+        self.done = threading.Event()
+
+        self._page_start = None
+        self._page_dots = 0
+        self._page_bytes = 0
+
+    def page_data(self, dots, consumed):
+        if self._page_start is None:
+            self._page_start = time.monotonic()
+            self._page_bytes = consumed
+        self._page_dots += dots
+
+    def page_end(self, consumed):
+        now = time.monotonic()
+        start = now
+        if self._page_start is not None:
+            start = self._page_start
+        else:
+            self._page_bytes = consumed
+        self.pages.append(
+            {
+                "page": len(self.pages) + 1,
+                "start": start - self.start,
+                "end": now - self.start,
+                "seconds": now - start,
+                "dots": self._page_dots,
+                "bytes": consumed - self._page_bytes,
+            }
+        )
+        self._page_start = None
+        self._page_dots = 0
+
+    def as_dict(self):
+        end = self.end if self.end is not None else time.monotonic()
+        seconds = end - self.start
+        return {
+            "seconds": seconds,
+            "bytes": self.bytes,
+            "dots": self.dots,
+            "mb_per_s": self.bytes / seconds / 1e6 if seconds > 0 else 0.0,
+            "queries": self.queries,
+            "error": self.error,
+            "first_page": self.pages[0]["end"] if self.pages else None,
+            "pages": self.pages,
+            "commands": dict(self.commands or {}),
+        }
+
+
+class Emulator(object):
+    """Emulated port 9100 EPSON printer
+
+    Spools are decoded with epson.decode and consumed at a limited rate:
+    'rate' bytes per second through a 'buffer' sized receive buffer, and
+    'dot_rate' printed dots per second. REMOTE1 status queries are answered
+    with ST2 replies when 'status' is set. Each spool is recorded as a
+    Session with per-page timing.
+    """
+
+    def __init__(self, rate=None, dot_rate=None, buffer=1 << 20, status=True):
+        """
+        @param rate     : Bytes consumed per second, or None for no limit
+        @param dot_rate : Dots printed per second, or None for no limit
+        @param buffer   : Receive buffer size, in bytes
+        @param status   : Answer status queries
+        """
+        self.rate = rate
+        self.dot_rate = dot_rate
+        self.buffer = buffer
+        self.status = status
+
+        self.sessions = []
+        self.port = None
+        self._server = None
+        self._thread = None
+
+    """ Print engine """
+
+    def consume(self, fin, reply=None, session=None):
+        """Decode and 'print' a spool read from the file-like fin"""
+        if session is None:
+            session = Session()
+        self.sessions.append(session)
+
+        decoder = Decoder(fin)
+        consumed = getattr(fin, "consumed", None)
+        engine = _Engine(self, session, reply)
+
+        try:
+            for escp in decoder:
+                position = fin.consumed if consumed is not None else 0
+                engine.command(escp, position)
+        except (struct.error, ValueError, TypeError, AssertionError) as e:
+            # Truncated or malformed spool
+            session.error = f"{type(e).__name__}: {e}"
+
+        session.end = time.monotonic()
+        session.commands = decoder.commands
+        if consumed is not None:
+            session.bytes = fin.consumed
+        session.done.set()
+        return session
+
+    def consume_file(self, filename):
+        with open(filename, "rb") as fin:
+            stream = _Buffer(capacity=1 << 62, rate=self.rate)
+            stream.put(fin.read())
+            stream.close()
+            return self.consume(stream)
+
+    def wait(self, count=1, timeout=None):
+        """Wait until 'count' spools have been consumed; returns the Sessions"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            sessions = self.sessions[:count]
+            if len(sessions) == count:
+                break
+            if deadline is not None and time.monotonic() > deadline:
+                return None
+            time.sleep(0.01)
+        for session in sessions:
+            left = None if deadline is None else max(0, deadline - time.monotonic())
+            if not session.done.wait(left):
+                return None
+        return sessions
+
+    def connect(self):
+        """In-process connection; each one is consumed concurrently"""
+        return Port(self)
+
+    """ TCP server """
+
+    def start(self, host="127.0.0.1", port=9100):
+        """Listen for spools in a background thread; returns the port"""
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind((host, port))
+        server.listen(1)
+        self._server = server
+        self.port = server.getsockname()[1]
+
+        self._thread = threading.Thread(target=self.serve, daemon=True)
+        self._thread.start()
+        return self.port
+
+    def stop(self):
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+
+    def serve(self):
+        """Accept connections one at a time, like a printer"""
+        while self._server is not None:
+            try:
+                conn, _ = self._server.accept()
+            except OSError:
+                break
+            with conn:
+                self.handle(conn)
+
+    def handle(self, conn):
+        stream = _Buffer(capacity=self.buffer, rate=self.rate)
+        session = Session()
+        lock = threading.Lock()
+
+        def reply(data):
+            with lock:
+                try:
+                    conn.sendall(data)
+                except OSError:
+                    pass
+
+        engine = threading.Thread(
+            target=self.consume, args=(stream, reply, session), daemon=True
+        )
+        engine.start()
+
+        # Receive only while the buffer has room: TCP back-pressure
+        while True:
+            try:
+                data = conn.recv(1 << 16)
+            except OSError:
+                break
+            if not data:
+                break
+            stream.put(data)
+        stream.close()
+        engine.join()
+
+
+class _Engine(object):
+    """Per-command behaviour of the emulated printer"""
+
+    def __init__(self, emulator, session, reply):
+        self.emulator = emulator
+        self.session = session
+        self.reply = reply
+        self._due = None
+
+    def _print(self, dots, position):
+        self.session.dots += dots
+        self.session.page_data(dots, position)
+        if self.emulator.dot_rate:
+            pace(self, dots / self.emulator.dot_rate)
+
+    def command(self, escp, position):
+        kind = escp["type"]
+        code = escp.get("code")
+
+        if kind == "escpr":
+            if code == b"dsnd":
+                self._print(len(escp["raster"]) // 3, position)
+            elif code == b"endp":
+                self.session.page_end(position)
+        elif kind == "remote1":
+            if code == b"st":
+                self.session.queries += 1
+                if self.emulator.status and self.reply is not None:
+                    self.reply(self._status())
+        elif kind == "special":
+            if escp["name"] == "Form Feed":
+                self.session.page_end(position)
+        elif code == b"i" and "raster" in escp:
+            self._print(escp["width"] * escp["height"], position)
+
+    def _status(self):
+        # Busy while the print engine is behind
+        state = 0x03
+        if self._due is not None and self._due > time.monotonic():
+            state = 0x02
+        return epson.status.encode_st2({epson.status.FIELD_STATE: bytes((state,))})
+
+
+class Port(epson.io.Io):
+    """In-process transport to an Emulator, with its own print engine"""
+
+    def __init__(self, emulator: Emulator):
+        """
+        @param emulator : Emulator consuming the data sent
+        """
+        self.emulator = emulator
+        self.session = None
+        self.replies = bytearray()
+        self._lock = threading.Lock()
+        self._stream = None
+        self._engine = None
+
+    def open(self):
+        emulator = self.emulator
+        self._stream = _Buffer(capacity=emulator.buffer, rate=emulator.rate)
+        self.session = Session()
+        self._engine = threading.Thread(
+            target=emulator.consume,
+            args=(self._stream, self._reply, self.session),
+            daemon=True,
+        )
+        self._engine.start()
+
+    def close(self):
+        if self._stream is not None:
+            self._stream.close()
+            self._engine.join()
+            self._stream = None
+
+    def _reply(self, data):
+        with self._lock:
+            self.replies += data
+
+    def send(self, data=None):
+        if self._stream is None:
+            self.open()
+        self._stream.put(bytes(data))
+
+    def recv(self, expected=None, timeout=0.0):
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                if self.replies:
+                    count = expected or len(self.replies)
+                    data = bytes(self.replies[:count])
+                    del self.replies[:count]
+                    return data
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(0.005)
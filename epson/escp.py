@@ -29,9 +29,18 @@ from __future__ import print_function
 
 import time
 import struct
+import threading
+import contextlib
 from typing import Optional
 from epson.constant import *
 from epson.raster import Image
+from epson import command
+import epson.io
+import epson.status
+from epson.settings import JobSettings, settings_properties
+import epson.resample
+import epson.impose
+import epson.rotate
 
 
 class Interface(object):
@@ -44,8 +53,8 @@ class Interface(object):
 
     # REMOTE1 protocol commands
     # Enter remote mode
-    EnterRemoteMode = b"\x1b(R\x08\x00\x00REMOTE1"
-    ExitRemoteMode = b"\x1b\x00\x00\x00"
+    EnterRemoteMode = command.REMOTE1_ENTER
+    ExitRemoteMode = command.REMOTE1_EXIT
 
     # Initialize time of day.
     # data = YYYY(be16), MM(8), DD(8), hh(8), mm(8), ss(8)
@@ -77,16 +86,127 @@ class Interface(object):
     # Job End
     RemoteJobEnd = b"JE"
 
+    # Status request; the printer replies with an ST2 block (see epson.status)
+    RemoteStatus = b"st"
+
+    # Command sequences built by _cached_sequence(), by key.
+    # Shared by all instances and threads, under _sequence_lock; bounded
+    # to SequenceCacheSize entries.
+    _sequence_cache = {}
+    _sequence_lock = threading.Lock()
+    SequenceCacheSize = 256
+
     def __init__(self, io=None):
         """Initialize class"""
         self.io = io
         self.last_job = 0
 
+        # Optional epson.stats.Stats instrumentation
+        self.stats = None
+        # Set while _capture() redirects commands into memory
+        self._capturing = False
+
     def _send(self, msg):
-        self.io.send(msg)
+        stats = self.stats
+        if stats is None or self._capturing:
+            self.io.send(msg)
+            return
 
-    def _recv(self, expected=0):
-        return self.io.recv(expected=expected)
+        stats.enter("send")
+        self.io.send(msg)
+        stats.leave()
+        stats.sent(len(msg))
+
+    def _recv(self, expected=0, timeout=0.0):
+        return self.io.recv(expected=expected, timeout=timeout)
+
+    @contextlib.contextmanager
+    def _capture(self):
+        """Redirect all commands sent in the block into an epson.io.Memory
+
+        Stats still record the raster, encode and frame stages; the bytes
+        are only accounted as sent when the captured buffer is sent.
+        """
+        io, capturing = self.io, self._capturing
+        self.io = epson.io.Memory()
+        self._capturing = True
+        try:
+            yield self.io
+        finally:
+            self.io, self._capturing = io, capturing
+
+    def _cached_sequence(self, key, emit):
+        """Send the command sequence emitted by emit(), building it once per key
+
+        key must be hashable and capture everything the sequence depends on.
+        The REMOTE1 time (TI) and job id (JH) fields are the only parts that
+        change between jobs; they are patched into a copy of the cached bytes,
+        so the whole sequence goes out in a single send.
+
+        Returns the value returned by emit() when the sequence was built.
+        """
+        cache = self._sequence_cache
+        job_id = self.last_job
+
+        with self._sequence_lock:
+            entry = cache.get(key)
+        if entry is None:
+            with self._capture() as buffer:
+                result = emit()
+            data = buffer.getvalue()
+            offsets = self._remote1_offsets(data)
+            entry = (
+                data,
+                offsets.get(self.RemoteTimeInit),
+                offsets.get(self.RemoteJobHeader),
+                result,
+            )
+            with self._sequence_lock:
+                while len(cache) >= self.SequenceCacheSize:
+                    del cache[next(iter(cache))]
+                cache[key] = entry
+
+        data, ti, jh, result = entry
+        if ti is not None or jh is not None:
+            data = bytearray(data)
+            if ti is not None:
+                now = time.localtime()
+                command.REMOTE1[self.RemoteTimeInit].struct.pack_into(
+                    data,
+                    ti,
+                    now.tm_year,
+                    now.tm_mon,
+                    now.tm_mday,
+                    now.tm_hour,
+                    now.tm_min,
+                    now.tm_sec,
+                )
+            if jh is not None:
+                # Skip the job type byte
+                struct.pack_into(">L", data, jh + 1, job_id)
+                self.last_job = job_id + 1
+
+        self._send(data)
+        return result
+
+    def _remote1_offsets(self, data):
+        """Map REMOTE1 command codes to the offset of their data in 'data'"""
+        offsets = {}
+        start = data.find(self.EnterRemoteMode)
+        if start < 0:
+            return offsets
+
+        pos = start + len(self.EnterRemoteMode)
+        while pos + 4 <= len(data):
+            code = data[pos : pos + 2]
+            (clen,) = struct.unpack_from("<H", data, pos + 2)
+            if code == self.ExitRemoteMode[0:2] and clen == 0:
+                break
+            # Skip code, length and response byte
+            offsets.setdefault(code, pos + 5)
+            pos += 4 + clen
+
+        return offsets
 
     """ Low-level command wrapper functions """
 
@@ -112,7 +232,7 @@ class Interface(object):
         self._send(self.EnterRemoteMode)
 
     def _remote1_cmd(self, cmd, data=b"", response=0):
-        self._send(cmd + struct.pack("<H", len(data) + 1) + byte(response) + data)
+        self._send(command.remote1(cmd, data, response))
 
     def _remote1_exit(self):
         self._send(self.ExitRemoteMode)
@@ -121,8 +241,7 @@ class Interface(object):
 
     def _time_init(self):
         now = time.localtime()
-        data = struct.pack(
-            ">HBBBBB",
+        data = command.REMOTE1[self.RemoteTimeInit].params(
             now.tm_year,
             now.tm_mon,
             now.tm_mday,
@@ -145,7 +264,8 @@ class Interface(object):
     def _job_header(self, job_type=0, job_name="ESCPPRLib", job_id=None):
         if job_id == None:
             job_id = self.last_job
-        data = byte(job_type) + struct.pack(">L", job_id) + job_name.encode()
+        data = command.REMOTE1[self.RemoteJobHeader].params(job_type, job_id)
+        data += job_name.encode()
         self._remote1_cmd(self.RemoteJobHeader, data)
         self.last_job = job_id + 1
 
@@ -195,44 +315,60 @@ class Interface(object):
     def _load_defaults(self):
         self._remote1_cmd(self.RemoteLoadDefault)
 
+    def _status_query(self):
+        self._send(epson.status.QUERY)
+
+    def status(self, timeout=2.0):
+        """Query the printer status; returns an epson.status.Status, or None
+
+        Must not be called while a page is being sent.
+        """
+        reader = epson.status.StatusReader()
+        self._status_query()
+        deadline = time.monotonic() + timeout
+        while True:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                return None
+            replies = reader.feed(self._recv(timeout=min(left, 0.1)))
+            if replies:
+                return replies[-1]
+
     """ Printing method control """
 
     def _direction(self, pd=PD.BIDIREC):
-        self._send(b"\x1bU" + byte(pd))
+        self._send(command.lookup("direction").pack(pd))
 
     def _send_ext(self, code, data=None):
         self._send(b"\x1b(" + code + struct.pack("<H", len(data)) + data)
 
     def _graphics_mode(self, mode: int = 1):
-        self._send_ext(b"G", struct.pack("B", mode))
+        self._send(command.lookup("graphics_mode").pack(mode))
 
     def _color_mode(self, cm=CM.COLOR):
-        self._send_ext(b"K", struct.pack("BB", 0, cm))
+        self._send(command.lookup("color_mode").pack(0, cm))
 
     def _set_microweave(self, mode: int = 1):
-        self._send_ext(b"i", struct.pack("B", mode))
+        self._send(command.lookup("microweave").pack(mode))
 
     def _image_resolution(self, h_dpi=360, v_dpi=120):
         base = 1440
         v = base // h_dpi
         h = base // v_dpi
 
-        data = struct.pack("<HBB", base, v, h)
-        self._send_ext(b"D", data)
+        self._send(command.lookup("image_resolution").pack(base, v, h))
 
     def _set_unit(self, p_dpi=360, h_dpi=360, v_dpi=360):
         base = max([p_dpi, h_dpi, v_dpi])
         if base == min([p_dpi, h_dpi, v_dpi]):
             # Use the non-extended version (since all DPIs are the same)
-            data = struct.pack("B", 3600 // p_dpi)
-            self._send_ext(b"U", data)
+            self._send(command.lookup("unit", 1).pack(3600 // p_dpi))
         else:
             # Use the extended version (for differing DPIs)
             p = base // p_dpi
             v = base // v_dpi
             h = base // h_dpi
-            data = struct.pack("<BBBH", p, v, h, base)
-            self._send_ext(b"U", data)
+            self._send(command.lookup("unit", 2).pack(p, v, h, base))
 
     def _page_format(
         self,
@@ -245,83 +381,49 @@ class Interface(object):
         y_top = int(margin[1] * mm2in * dpi)
         y_bottom = int((msid[1] - margin[3]) * mm2in * dpi)
         x_left = int(margin[0] * mm2in * dpi)
-        x_right = int(margin[2] * mm2in * dpi)
+        x_right = int((msid[0] - margin[2]) * mm2in * dpi)
 
-        if version == 1:
-            self._send_ext(b"c", struct.pack("<HH", y_top, y_bottom))
-        elif version == 2:
-            self._send_ext(b"c", struct.pack("<LL", y_top, y_bottom))
-        else:
-            raise Exception(f"Unknown version '{version}'.")
+        self._send(command.lookup("page_format", version).pack(y_top, y_bottom))
 
         return (x_right - x_left, y_bottom - y_top)
 
     def _dot_size(self, dot_size):
-        self._send_ext(b"e", struct.pack("BB", 0, dot_size))
+        self._send(command.lookup("dot_size").pack(0, dot_size))
 
     def _vertical_position(self, y: int = 0, version: int = 2):
         """Set absolute vertical print position."""
-        if version == 1:
-            self._send_ext(b"V", struct.pack("<H", y))
-        elif version == 2:
-            self._send_ext(b"V", struct.pack("<L", y))
-        else:
-            raise Exception(f"Unknown version '{version}'.")
+        self._send(command.lookup("vertical_position", version).pack(y))
 
     def _vertical_increment(self, y: int = 0, version: int = 2):
         """Set relative vertical print position."""
-        if version == 1:
-            self._send_ext(b"v", struct.pack("<H", y))
-        elif version == 2:
-            self._send_ext(b"v", struct.pack("<L", y))
-        else:
-            raise Exception(f"Unknown version '{version}'.")
+        self._send(command.lookup("vertical_increment", version).pack(y))
 
     def _horizontal_position(self, x: int = 0, version: int = 2):
         """Set absolute horizontal print position."""
-        if version == 1:
-            self._send(b"\x1b$" + struct.pack("<H", x))
-        elif version == 2:
-            self._send_ext(b"$", struct.pack("<L", x))
-        else:
-            raise Exception(f"Unknown version '{version}'.")
+        self._send(command.lookup("horizontal_position", version).pack(x))
 
     def _horizontal_increment(self, x: int = 0, version: int = 2):
         """Set relative horizontal print position."""
-        if version == 1:
-            self._send(b"\x1b\\" + struct.pack("<H", x))
-        elif version == 2:
-            self._send_ext(b"/", struct.pack("<L", x))
-        else:
-            raise Exception(f"Unknown version '{version}'.")
+        self._send(command.lookup("horizontal_increment", version).pack(x))
 
     def _set_page_length(self, length: int = 0, version: int = 2):
-        if version == 1:
-            self._send_ext(b"C", struct.pack("<H", length))
-        elif version == 2:
-            self._send_ext(b"C", struct.pack("<L", length))
-        else:
-            raise Exception(f"Unknown version '{version}'.")
+        self._send(command.lookup("page_length", version).pack(length))
 
     def _paper_dimension(self, msid=(0, 0), dpi=360):
         mm2in = 1.0 / 25.4
         width = int(round(msid[0] * mm2in * dpi))
         height = int(round(msid[1] * mm2in * dpi))
 
-        data = struct.pack("<LL", width, height)
-        self._send_ext(b"S", data)
+        self._send(command.lookup("paper_dimension").pack(width, height))
 
     def _print_method(self, method=0x12):
-        self._send_ext(b"m", struct.pack("B", method))
+        self._send(command.lookup("print_method").pack(method))
 
     def _set_color(self, color=0x00, version: int = 2):
         if version == 1:
-            self._send(b"\x1br" + struct.pack("B", color))
-        elif version == 2:
-            m = 0
-            self._send_ext(b"r", struct.pack("BB", m, color))
+            self._send(command.lookup("color", 1).pack(color))
         else:
-            raise Exception(f"Unknown version '{version}'.")
+            self._send(command.lookup("color", version).pack(0, color))
 
     # TODO: Add ESC . and ESC . 2 raster modes.
 
@@ -335,72 +437,67 @@ class Interface(object):
         if line is None or len(line) == 0:
             return
 
+        stats = self.stats
+        if stats is not None:
+            stats.enter("frame")
+
         if compressed:
             cmode = 1
         else:
             cmode = 0
 
-        data = struct.pack("<BBBHH", color, cmode, bpp, len(line), 1)
+        data = command.lookup("raster").pack(color, cmode, bpp, len(line), 1)
         if compressed:
-            data += run_length_encode(line, bytes_per_pixel=1)
+            if stats is not None:
+                stats.enter("encode")
+            encoded = run_length_encode(line, bytes_per_pixel=1)
+            if stats is not None:
+                stats.leave()
+            data += encoded
         else:
+            encoded = line
             data += line
 
-        self._send(b"\x1bi" + data)
-
+        if stats is not None:
+            stats.encoded(len(line), len(encoded))
 
-class Job(Interface):
-    """EPSON ESC/P 'ESC ( D' Job Wrapper"""
-
-    def __init__(self, io=None, name="ESCPLib"):
-        super(Job, self).__init__(io=io)
+        self._send(data)
 
-        # Job name
-        self.name = name
+        if stats is not None:
+            stats.leave()
 
-        # Output selection
-        self.dpi = 360
-        self.pd = PD.BIDIREC
 
-        # Paper path
-        self.mpid = MPID.AUTO
-        self.duplex = False
+@settings_properties
+class Job(Interface):
+    """EPSON ESC/P 'ESC ( D' Job Wrapper"""
 
-        self.cm = CM.COLOR
+    def __init__(self, io=None, name="ESCPLib", settings=None):
+        """
+        @param io       : Transport (see epson.io)
+        @param name     : Job name, when no settings are given
+        @param settings : epson.settings.JobSettings
 
-        # JPEG auto photo fix
-        self.act = ACT.NOTHING
-        self.sharpness = 0
-        self.rde = RDE.NOTHING
+        Each settings field is also available as a job attribute; assigning
+        one replaces self.settings with an updated copy.
+        """
+        super(Job, self).__init__(io=io)
 
-        # Quality settings
-        self.mqid = MQID.DRAFT
-        self.cm = CM.COLOR
-        self.brightness = 0
-        self.contrast = 0
-        self.saturation = 0
-        self.cp = CP.FULLCOLOR
-        self.palette = None
+        if settings is None:
+            settings = JobSettings(name=name, mpid=MPID.AUTO, mqid=MQID.DRAFT)
+        self.settings = settings
 
-        # Size parameters
-        self.mtid = MTID.PLAIN
-        self.msid = MSID.LETTER
-        self.mlid = MLID.BORDERS
-        self.margin = (3, 3, 3, 3)  # 3mm borders
+        # Optional epson.cache.PageCache of encoded pages
+        self.page_cache = None
 
-        # CD Label size
-        self.cddim_id = None
-        self.cddim_od = None
+    def _settings_key(self, copies=1):
+        return (type(self), self.settings, copies)
 
     def _start(self, copies=1):
-        if (
-            self.mtid == MTID.CDDVD
-            or self.mtid == MTID.CDDVDHIGH
-            or self.mtid == MTID.CDDVDGLOSSY
-        ):
-            self.mpid = MPID.CDTRAY
-            self.mlid = MLID.CDLABEL
+        return self._cached_sequence(
+            self._settings_key(copies), lambda: self._preamble(copies)
+        )
 
+    def _remote_preamble(self):
         self._exit_packet_mode()
 
         # REMOTE commands
@@ -415,6 +512,9 @@ class Job(Interface):
 
         self._remote1_exit()
 
+    def _preamble(self, copies=1):
+        self._remote_preamble()
+
         # ESC/P setup commands
         self._init_printer()  # ESC @
         # TODO: ESC (A ?
@@ -445,6 +545,9 @@ class Job(Interface):
         return size
 
     def _end(self):
+        self._cached_sequence((type(self), "end"), self._postamble)
+
+    def _postamble(self):
         self._init_printer()
 
         self._remote1_enter()
@@ -454,34 +557,234 @@ class Job(Interface):
 
         self._remote1_exit()
 
-    def print_pages(self, rasters: list[Image], bpp: int = 1):
-        size = self._start()
+    def _planes(self):
+        """Colour planes queried from the rasters, black only for host_gray"""
+        if self.host_gray and self.cm == CM.MONOCHROME:
+            return [0]
+        # 0: K, 1: M, 2: C, 3: ?, 4: Y.
+        return [0, 1, 2, 4]
+
+    def _send_page_lines(self, raster, size, bpp=1):
         mm2in = 1.0 / 25.4
 
         delta_x = int(self.margin[0] * mm2in * self.dpi)
         delta_y = int(self.margin[1] * mm2in * self.dpi)
 
-        for raster in rasters:
-
-            self._vertical_position(y=delta_y)
-            for y in range(0, min(size[1], raster.size[1])):
-                # 0: K, 1: M, 2: C, 3: ?, 4: Y.
-                for color in [0, 1, 2, 4]:
+        stats = self.stats
+        if stats is not None:
+            stats.page_start()
+
+        planes = self._planes()
+        rows = min(size[1], raster.size[1])
+
+        # Rows holding each plane's content
+        boxes = dict((color, (0, rows)) for color in planes)
+        if self.crop:
+            for color in planes:
+                box = raster.bbox([color], bpp)
+                if box is None:
+                    del boxes[color]
+                else:
+                    boxes[color] = (box[1], box[3])
+        y0 = min([box[0] for box in boxes.values()] + [rows])
+        y1 = min(rows, max([box[1] for box in boxes.values()] + [y0]))
+
+        self._vertical_position(y=delta_y + y0)
+        for y in range(y0, y1):
+            for color in planes:
+                box = boxes.get(color)
+                if box is None or not box[0] <= y < box[1]:
+                    continue
+
+                if stats is None:
+                    line = raster.bitline(y=y, ci=color, bpp=bpp)
+                else:
+                    stats.enter("raster")
                     line = raster.bitline(y=y, ci=color, bpp=bpp)
-                    if line is None:
+                    stats.leave()
+                if line is None:
+                    continue
+
+                x = delta_x
+                if self.crop:
+                    # Trim the blank bytes at both ends, and skip blank rows
+                    left = len(line) - len(line.lstrip(b"\0"))
+                    if left == len(line):
                         continue
+                    line = line[left:].rstrip(b"\0")
+                    x += left * 8 // bpp
+
+                self._horizontal_position(x=x)
+
+                self._send_line(
+                    color=color,
+                    line=line,
+                    bpp=bpp,
+                    compressed=False,
+                )
+
+            self._vertical_increment(y=1)
+
+        if stats is not None:
+            stats.page_end()
+
+    def _page_data(self, raster, size, bpp=1):
+        """Encoded commands of a page, from the page cache if possible"""
+        cache = self.page_cache
+        key = cache.key(
+            type(self),
+            self.settings,
+            size,
+            bpp,
+            raster.digest(self._planes(), bpp, parallel=True),
+        )
+        data = cache.get(key)
+        if data is None:
+            with self._capture() as buffer:
+                self._send_page_lines(raster, size, bpp)
+            data = buffer.getvalue()
+            cache.put(key, data)
+        return data
+
+    def print_pages(self, rasters: list[Image], bpp: int = 1):
+        size = self._start()
 
-                    self._horizontal_position(x=delta_x)
+        rasters = epson.impose.impose(rasters, size, nup=self.nup, method=self.resample)
 
-                    self._send_line(
-                        color=color,
-                        line=line,
-                        bpp=bpp,
-                        compressed=False,
-                    )
+        for raster in rasters:
+            with epson.rotate.oriented(raster, size, self.rotate) as raster:
+                if self.resample is not None:
+                    raster = epson.resample.fit(raster, size, self.resample, self.fit)
 
-                self._vertical_increment(y=1)
+                if self.page_cache is None:
+                    self._send_page_lines(raster, size, bpp)
+                else:
+                    self._send(self._page_data(raster, size, bpp))
 
             self._form_feed()
 
         self._end()
+
+
+class TextJob(Job):
+    """EPSON ESC/P text job, printed with the printer's resident fonts
+
+    Lines of text are sent as characters instead of rasters, a few bytes
+    per line instead of thousands. Lines longer than the printable width
+    are wrapped, tabs are expanded, and pages are broken when the
+    printable height is full or on form feed characters.
+    """
+
+    # Pitch commands, by characters per inch
+    Pitches = {10: "pitch_10", 12: "pitch_12", 15: "pitch_15"}
+
+    def __init__(
+        self,
+        io=None,
+        name="ESCPLib",
+        settings=None,
+        cpi=10,
+        lpi=6,
+        typeface=0,
+        encoding="cp437",
+    ):
+        """
+        @param io       : Transport (see epson.io)
+        @param name     : Job name, when no settings are given
+        @param settings : epson.settings.JobSettings
+        @param cpi      : Characters per inch: 10, 12 or 15
+        @param lpi      : Lines per inch
+        @param typeface : Printer typeface (0: Roman, 1: Sans serif)
+        @param encoding : Character table of the printer
+        """
+        super(TextJob, self).__init__(io=io, name=name, settings=settings)
+        if cpi not in self.Pitches:
+            raise ValueError(f"Unsupported pitch '{cpi}' cpi.")
+        self.cpi = cpi
+        self.lpi = lpi
+        self.typeface = typeface
+        self.encoding = encoding
+
+    def _settings_key(self, copies=1):
+        return (type(self), self.settings, self.cpi, self.lpi, self.typeface)
+
+    def _preamble(self, copies=1):
+        self._remote_preamble()
+
+        self._init_printer()  # ESC @
+        self._set_unit(self.dpi, self.dpi, self.dpi)  # ESC (U
+        size = self._page_format(
+            msid=self.msid, margin=self.margin, dpi=self.dpi
+        )  # ESC (c
+
+        self._send(command.lookup("quality").pack(1))  # ESC x: LQ
+        self._send(command.lookup("typeface").pack(self.typeface))  # ESC k
+        self._send(command.lookup(self.Pitches[self.cpi]).pack())  # ESC P/M/g
+        spacing = max(1, min(255, round(180 / self.lpi)))
+        self._send(command.lookup("line_spacing").pack(spacing))  # ESC 3
+
+        mm2in = 1.0 / 25.4
+        left = int(self.margin[0] * mm2in * self.cpi)
+        self._send(command.lookup("left_margin").pack(min(left, 255)))  # ESC l
+
+        return size
+
+    def geometry(self, size):
+        """(lines per page, columns per line) of a printable size in dots"""
+        rows = max(1, int(size[1] * self.lpi / self.dpi))
+        columns = max(1, int(size[0] * self.cpi / self.dpi))
+        return (rows, columns)
+
+    def _wrap(self, text, columns):
+        text = text.expandtabs(8).translate(_CONTROL)
+        if not text:
+            return [text]
+        return [text[pos : pos + columns] for pos in range(0, len(text), columns)]
+
+    def print_text(self, lines) -> int:
+        """Print an iterable of lines of text; returns the number of pages"""
+        rows, columns = self.geometry(self._start())
+
+        encoding = self.encoding
+        pending = []
+        row = 0
+        pages = 0
+
+        def flush():
+            if pending:
+                self._send(b"".join(pending))
+                del pending[:]
+
+        for text in lines:
+            text = text.rstrip("\r\n")
+            segments = text.split("\f")
+            for part, segment in enumerate(segments):
+                if part > 0:
+                    pending.append(b"\x0c")
+                    pages += 1
+                    row = 0
+                if not segment and len(segments) > 1:
+                    continue
+
+                for piece in self._wrap(segment, columns):
+                    if row == rows:
+                        pending.append(b"\x0c")
+                        pages += 1
+                        row = 0
+                    pending.append(piece.encode(encoding, "replace") + b"\r\n")
+                    row += 1
+
+            if len(pending) >= 256:
+                flush()
+
+        if row > 0 or pages == 0:
+            pending.append(b"\x0c")
+            pages += 1
+        flush()
+
+        self._end()
+        return pages
+
+
+# Control characters dropped from text
+_CONTROL = dict.fromkeys(list(range(0x20)) + [0x7F])
@@ -27,14 +27,31 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-import math
 import struct
+import contextlib
 import epson
 import epson.escp
+from epson import command
+import epson.color
+import epson.resample
+import epson.impose
+import epson.rotate
+from epson.settings import (
+    JobSettings,
+    cd_dimensions,
+    cd_label_spans,
+    raster_geometry,
+    settings_properties,
+)
 
 from epson.constant import *
 
 
+def _adjust(value):
+    """Clamp a signed -50..50 adjustment"""
+    return max(-50, min(value, 50))
+
+
 class Interface(epson.escp.Interface):
     """Base class for accessing EPSON ESC/P Raster printers"""
 
@@ -76,18 +93,19 @@ class Interface(epson.escp.Interface):
         if palette is None:
             palette = b""
 
-        data = (
-            byte(mtid)
-            + byte(mqid)
-            + byte(cm)
-            + byte(clamp(-50, brightness, 50))
-            + byte(clamp(-50, contrast, 50))
-            + byte(clamp(-50, saturation, 50))
-            + byte(cp)
-            + struct.pack(">H", len(palette))
-            + palette
+        self._send(
+            command.ESCPR[b"setq"].pack(
+                mtid,
+                mqid,
+                cm,
+                _adjust(brightness),
+                _adjust(contrast),
+                _adjust(saturation),
+                cp,
+                len(palette),
+                data=palette,
+            )
         )
-        self._raster_cmd(b"q", b"setq", data)
 
     def _raster_check(self):
         # Only needed on 'version 3' or higher printers?
@@ -102,55 +120,31 @@ class Interface(epson.escp.Interface):
         dpi=720,
         pd=PD.BIDIREC,
     ):
-        ir = 0
-        if dpi == 720:
-            ir = 1
-        elif dpi == 300:
-            ir = 2
-        elif dpi == 600:
-            ir = 3
-        elif dpi == 360:
-            ir = 0
-        else:
-            dpi = 360
-            ir = 0
-
-        if mlid == MLID.BORDERLESS:
-            margin = (0, 0, 0, 0)
-
-        mm2in = 1.0 / 25.4
-        paperWidth = math.ceil(paper[0] * mm2in * dpi)
-        paperHeight = math.ceil(paper[1] * mm2in * dpi)
-        marginLeft = math.floor(margin[0] * mm2in * dpi)
-        marginTop = math.floor(margin[1] * mm2in * dpi)
-        marginRight = math.floor(margin[2] * mm2in * dpi)
-        marginBottom = math.floor(margin[3] * mm2in * dpi)
-        printableWidth = paperWidth - marginLeft - marginRight
-        printableHeight = paperHeight - marginTop - marginBottom
-        data = struct.pack(
-            ">LLHHLLBB",
-            paperWidth,
-            paperHeight,
-            marginTop,
-            marginLeft,
-            printableWidth,
-            printableHeight,
-            ir,
-            pd,
+        paper, margins, printable, ir = raster_geometry(paper, mlid, tuple(margin), dpi)
+        paperWidth, paperHeight = paper
+        marginLeft, marginTop, marginRight, marginBottom = margins
+        printableWidth, printableHeight = printable
+        self._send(
+            command.ESCPR[b"setj"].pack(
+                paperWidth,
+                paperHeight,
+                marginTop,
+                marginLeft,
+                printableWidth,
+                printableHeight,
+                ir,
+                pd,
+            )
         )
-
-        self._raster_cmd(b"j", b"setj", data)
         return (printableWidth, printableHeight)
 
     def _jpeg_auto_photo_fix(
         self, cm=CM.COLOR, act=ACT.NOTHING, sharpness=0, rde=RDE.NOTHING
     ):
-        data = byte(cm) + byte(act) + byte(clamp(-50, sharpness, 50)) + byte(rde)
-        self._raster_cmd(b"a", b"seta", data)
+        self._send(command.ESCPR[b"seta"].pack(cm, act, _adjust(sharpness), rde))
 
     def _jpeg_copies(self, copies=1):
-        data = byte(clamp(1, copies, 255))
-        self._raster_cmd(b"c", b"setc", data)
+        self._send(command.ESCPR[b"setc"].pack(clamp(1, copies, 255)))
 
     def _jpeg_job(self):
         # TODO: Add JPEG page size support
@@ -159,114 +153,108 @@ class Interface(epson.escp.Interface):
     def _jpeg_size(
         self, mlid=MLID.BORDERLESS, pd=PD.BIDIREC, cddim_id=None, cddim_od=None
     ):
-        data = byte(99)  # Custom size - always send _raster_job before this!
+        size = 99  # Custom size - always send _raster_job before this!
 
         # Media layout
         if mlid == MLID.BORDERLESS:
-            data += byte(0x01)
+            layout = 0x01
         elif mlid == MLID.CDLABEL:
-            data += byte(0x09)
+            layout = 0x09
         elif mlid == MLID.DIVIDE16:
-            data += byte(0x90)
+            layout = 0x90
         else:
-            data += byte(0)
+            layout = 0
 
-        if cddim_id is None:
-            cddim_id = 43
+        cddim_id, cddim_od = cd_dimensions(cddim_id, cddim_od)
 
-        if cddim_od is None:
-            cddim_od = 116
-
-        data += byte(clamp(18, cddim_id, 46))
-        data += byte(clamp(114, cddim_od, 120))
-        data += byte(pd)
-
-        self._raster_cmd(b"j", b"sets", data)
+        self._send(command.ESCPR[b"sets"].pack(size, layout, cddim_id, cddim_od, pd))
 
     def _raster_start_page(self):
-        self._raster_cmd(b"p", b"sttp")
+        self._send(command.ESCPR[b"sttp"].pack())
 
     def _raster_printnum2(self, pageno=1):
-        self._raster_cmd(b"p", b"setn", byte(pageno))
+        self._send(command.ESCPR[b"setn"].pack(pageno))
 
     def _send_jpeg(self, chunk):
         while len(chunk) > 0:
             size = len(chunk)
             if size > 0xFFFF:
                 size = 0xFFFF
-            self._raster_cmd(b"d", b"jsnd", struct.pack(">H", size) + chunk[0:size])
+            self._send(command.ESCPR[b"jsnd"].pack(size, data=chunk[0:size]))
             chunk = chunk[size:]
 
-    def _send_line(self, line=None, offset=(0, 0), compress=False):
+    def _send_line(self, line=None, offset=(0, 0), compress=False, gray=False):
+        """Send a RGB line, or with 'gray' an 8-bit gray line as RGB"""
+        stats = self.stats
+        if stats is not None:
+            stats.enter("frame")
+            raw = len(line)
+
         if compress:
-            line = epson.escpr.run_length_encode(line, 3)
+            if stats is not None:
+                stats.enter("encode")
+            if gray:
+                line = epson.escpr.run_length_encode_gray(line, 3)
+            else:
+                line = epson.escpr.run_length_encode(line, 3)
+            if stats is not None:
+                stats.leave()
             cmode = 1
         else:
+            if gray:
+                line = bytes(value for value in line for _ in range(3))
             cmode = 0
 
-        data = struct.pack(">HHBH", offset[0], offset[1], cmode, len(line))
+        if stats is not None:
+            stats.encoded(raw, len(line))
 
-        self._raster_cmd(b"d", b"dsnd", data + line)
+        self._send(
+            command.ESCPR[b"dsnd"].pack(
+                offset[0], offset[1], cmode, len(line), data=line
+            )
+        )
+
+        if stats is not None:
+            stats.leave()
 
     def _raster_endpage(self, pages_remaining=0):
-        self._raster_cmd(b"p", b"endp", byte(pages_remaining))
+        self._send(command.ESCPR[b"endp"].pack(pages_remaining))
 
     def _raster_endjob(self):
-        self._raster_cmd(b"j", b"endj")
+        self._send(command.ESCPR[b"endj"].pack())
 
 
+@settings_properties
 class Job(Interface):
     """EPSON ESC/P Raster Job Wrapper"""
 
-    def __init__(self, io=None, name="ESCPRLib"):
-        super(Job, self).__init__(io=io)
+    def __init__(self, io=None, name="ESCPRLib", settings=None):
+        """
+        @param io       : Transport (see epson.io)
+        @param name     : Job name, when no settings are given
+        @param settings : epson.settings.JobSettings
 
-        # Job name
-        self.name = name
-
-        # Output selection
-        self.dpi = 360
-        self.pd = PD.BIDIREC
-
-        # Paper path
-        self.mpid = MPID.REAR
-        self.duplex = False
-
-        self.cm = CM.COLOR
-
-        # JPEG auto photo fix
-        self.act = ACT.NOTHING
-        self.sharpness = 0
-        self.rde = RDE.NOTHING
+        Each settings field is also available as a job attribute; assigning
+        one replaces self.settings with an updated copy.
+        """
+        super(Job, self).__init__(io=io)
 
-        # Quality settings
-        self.mqid = MQID.HIGH
-        self.cm = CM.COLOR
-        self.brightness = 0
-        self.contrast = 0
-        self.saturation = 0
-        self.cp = CP.FULLCOLOR
-        self.palette = None
+        if settings is None:
+            settings = JobSettings(name=name)
+        self.settings = settings
 
-        # Size parameters
-        self.mtid = MTID.PLAIN
-        self.msid = MSID.LETTER
-        self.mlid = MLID.BORDERS
-        self.margin = (3, 3, 3, 3)  # 3mm borders
+        # Optional epson.cache.PageCache of encoded pages
+        self.page_cache = None
 
-        # CD Label size
-        self.cddim_id = None
-        self.cddim_od = None
+    def _settings_key(self, copies=1):
+        return (type(self), self.settings, copies)
 
     def _start(self, copies=1):
-        if (
-            self.mtid == MTID.CDDVD
-            or self.mtid == MTID.CDDVDHIGH
-            or self.mtid == MTID.CDDVDGLOSSY
-        ):
-            self.mpid = MPID.CDTRAY
-            self.mlid = MLID.CDLABEL
+        return self._cached_sequence(
+            self._settings_key(copies), lambda: self._preamble(copies)
+        )
 
+    def _preamble(self, copies=1):
         self._exit_packet_mode()
         self._init_printer()
 
@@ -332,6 +320,9 @@ class Job(Interface):
         return size
 
     def _end(self):
+        self._cached_sequence((type(self), "end"), self._postamble)
+
+    def _postamble(self):
         self._raster_endjob()
 
         self._init_printer()
@@ -343,25 +334,176 @@ class Job(Interface):
 
         self._remote1_exit()
 
-    def print_pages(self, rasters=None, copies=1):
+    def _send_page_lines(self, raster, size):
+        stats = self.stats
+        if stats is not None:
+            stats.page_start()
+
+        # Monochrome pages converted on the host are encoded from gray
+        # lines: one byte per pixel
+        gray = self.host_gray and self.cm == CM.MONOCHROME
+        pixel = 1 if gray else 3
+        white = b"\xff"
+
+        width, height = min(size[0], raster.size[0]), min(size[1], raster.size[1])
+        x0, y0, x1, y1 = 0, 0, width, height
+        if self.crop:
+            box = raster.bbox()
+            if box is None:
+                box = (0, 0, 0, 0)
+            x0, y0 = max(x0, box[0]), max(y0, box[1])
+            x1, y1 = min(x1, box[2]), min(y1, box[3])
+            if x0 >= x1:
+                y1 = y0
+
+        # CD labels only print the ring: rows are masked to its spans
+        rings = None
+        if self.mlid == MLID.CDLABEL:
+            rings = cd_label_spans(
+                self.settings.paper_size,
+                self.settings.margins,
+                self.dpi,
+                self.cddim_id,
+                self.cddim_od,
+            )
 
+        for y in range(y0, y1):
+            if rings is None:
+                spans = ((x0, x1),)
+            else:
+                spans = tuple(
+                    (max(x0, start), min(x1, end))
+                    for start, end in rings[y]
+                    if start < x1 and end > x0
+                )
+                if not spans:
+                    continue
+
+            if stats is not None:
+                stats.enter("raster")
+            if gray:
+                row = raster.grayline(y)
+                if rings is None and not self.crop:
+                    lines = (row,)
+                else:
+                    lines = tuple(row[start:end] for start, end in spans)
+            elif rings is None and not self.crop:
+                lines = (raster.line(y),)
+            else:
+                lines = tuple(raster.linespan(y, start, end) for start, end in spans)
+            if stats is not None:
+                stats.leave()
+
+            for (start, end), line in zip(spans, lines):
+                x = 0
+                if self.crop:
+                    # Trim the blank pixels at both ends, and skip blank rows
+                    left = len(line) - len(line.lstrip(white))
+                    if left == len(line):
+                        continue
+                    left -= left % pixel
+                    right = len(line.rstrip(white))
+                    right += -right % pixel
+                    line = line[left:right]
+                    x = start + left // pixel
+                elif rings is not None:
+                    x = start
+
+                self._send_line(line=line, offset=(x, y), compress=True, gray=gray)
+
+        if stats is not None:
+            stats.page_end()
+
+    def _encode_page(self, raster, size):
+        """Encode the raster lines of a page once, for replaying"""
+        with self._capture() as buffer:
+            self._send_page_lines(raster, size)
+        return buffer.getvalue()
+
+    def _page_data(self, raster, size):
+        """Encoded raster lines of a page, from the page cache if possible"""
+        cache = self.page_cache
+        if cache is None:
+            return self._encode_page(raster, size)
+
+        key = cache.key(type(self), self.settings, size, raster.digest(parallel=True))
+        data = cache.get(key)
+        if data is None:
+            data = self._encode_page(raster, size)
+            cache.put(key, data)
+        return data
+
+    def _start_sheet(self, sheet=1):
+        self._raster_start_page()
+        self._raster_printnum2(min(sheet, 99))
+
+    def _end_sheet(self, sheet=1, sheets=1):
+        self._raster_endpage(pages_remaining=min(sheets - sheet, 99))
+
+    @contextlib.contextmanager
+    def _page(self, raster, size):
+        """A page's raster, rotated, resampled and colour corrected
+
+        Rotation scratch space is released at the end of the block.
+        """
+        with epson.rotate.oriented(raster, size, self.rotate) as raster:
+            if self.resample is not None:
+                raster = epson.resample.fit(raster, size, self.resample, self.fit)
+            if self.color_profile is not None:
+                raster = epson.color.transform(raster, self.color_profile, self.mtid)
+            yield raster
+
+    def print_pages(self, rasters=None, copies=1, collate=True):
+        """Print a list of epson.raster.Image pages
+
+        Raster jobs with several copies encode each page once and replay the
+        encoded lines for every copy, renumbering the sheets. Collated copies
+        (1, 2, 3, 1, 2, 3) keep the whole encoded document in memory;
+        uncollated copies (1, 1, 2, 2, 3, 3) only one page at a time.
+        JPEG jobs pass the copy count to the printer instead.
+        """
         size = self._start(copies=copies)
 
-        for page in range(1, len(rasters) + 1):
-            raster = rasters[page - 1]
+        replays = copies
+        if self.cp == CP.JPEG:
+            replays = 1
 
-            self._raster_start_page()
-            if page < 99:
-                self._raster_printnum2(page)
-            else:
-                self._raster_printnum2(99)
+        if self.cp != CP.JPEG:
+            rasters = epson.impose.impose(
+                rasters, size, self.mlid, self.nup, self.resample
+            )
 
-            for y in range(0, min(size[1], raster.size[1])):
-                self._send_line(line=raster.line(y), offset=(0, y), compress=True)
+        sheets = len(rasters) * replays
+        sheet = 0
+
+        if replays <= 1 and self.page_cache is None:
+            for raster in rasters:
+                sheet += 1
+                self._start_sheet(sheet)
+                with self._page(raster, size) as page:
+                    self._send_page_lines(page, size)
+                self._end_sheet(sheet, sheets)
+
+        elif collate and replays > 1:
+            pages = []
+            for raster in rasters:
+                with self._page(raster, size) as page:
+                    pages.append(self._page_data(page, size))
+            for copy in range(replays):
+                for page in pages:
+                    sheet += 1
+                    self._start_sheet(sheet)
+                    self._send(page)
+                    self._end_sheet(sheet, sheets)
 
-            rpage = len(rasters) - page
-            if rpage > 99:
-                rpage = 99
-            self._raster_endpage(pages_remaining=rpage)
+        else:
+            for raster in rasters:
+                with self._page(raster, size) as page:
+                    page = self._page_data(page, size)
+                for copy in range(replays):
+                    sheet += 1
+                    self._start_sheet(sheet)
+                    self._send(page)
+                    self._end_sheet(sheet, sheets)
 
         self._end()
@@ -0,0 +1,222 @@
+#
+#  Copyright (C) 2016, Jason S. McMullan <jason.mcmullan@gmail.com>
+#  All rights reserved.
+#
+#  Licensed under the MIT License:
+#
+#  Permission is hereby granted, free of charge, to any person obtaining
+#  a copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import struct
+import hashlib
+from bisect import bisect_right
+from typing import Optional
+
+from epson.constant import *
+from epson.raster import Image
+import epson.resample
+
+
+class Sheet(Image):
+    """Image composed of smaller Image tiles placed on a blank sheet
+
+    Rows are composed on demand from the tiles they cross, so a sheet is
+    never held in memory. The tiles crossing each band of rows are looked
+    up once per band; rows should be requested in increasing order, as
+    print_pages() does.
+    """
+
+    # Rows per tile lookup band
+    Band = 64
+
+    def __init__(self, size=(0, 0), tiles=(), background=b"\xff\xff\xff"):
+        """
+        @param size       : Sheet (width, height) in dots
+        @param tiles      : (Image, (x, y)) placements, which must not overlap
+        @param background : RGB pixel outside the tiles
+        """
+        super(Sheet, self).__init__(size=tuple(size))
+        self.background = background
+        self._blank = background * self.size[0]
+
+        # Visible part of each tile: (image, x, y, x0, x1) with x0..x1 the
+        # visible columns of the tile, sorted by top row
+        width = self.size[0]
+        self.tiles = []
+        for image, (x, y) in tiles:
+            x0, x1 = max(0, -x), min(image.size[0], width - x)
+            if x0 < x1 and y < self.size[1] and y + image.size[1] > 0:
+                self.tiles.append((image, x, y, x0, x1))
+        self.tiles.sort(key=lambda tile: tile[2])
+        self._tops = [tile[2] for tile in self.tiles]
+
+        self._band = None
+        self._active = ()
+
+    def _tiles(self, y):
+        """Tiles crossing row y"""
+        band = y // self.Band
+        if band != self._band:
+            top = band * self.Band
+            last = bisect_right(self._tops, top + self.Band - 1)
+            self._active = [
+                tile for tile in self.tiles[:last] if tile[2] + tile[0].size[1] > top
+            ]
+            self._band = band
+        return [tile for tile in self._active if 0 <= y - tile[2] < tile[0].size[1]]
+
+    def line(self, y=0):
+        """Retrieve a RGB 24-bit line of the sheet"""
+        tiles = self._tiles(y)
+        if not tiles:
+            return self._blank
+
+        out = bytearray(self._blank)
+        for image, x, ty, x0, x1 in tiles:
+            line = image.linespan(y - ty, x0, x1)
+            if line:
+                out[(x + x0) * 3 : (x + x1) * 3] = line
+        return bytes(out)
+
+    def bitline(self, y=0, ci=CI.BLACK, bpp=1) -> Optional[bytes]:
+        """Retrieve a bitmap line of the sheet in a single color"""
+        tiles = self._tiles(y)
+        if not tiles:
+            return None
+
+        width = self.size[0] * bpp
+        length = (width + 7) // 8
+        bits = 0
+        for image, x, ty, x0, x1 in tiles:
+            line = image.bitline(y=y - ty, ci=ci, bpp=bpp)
+            if not line:
+                continue
+            value = int.from_bytes(line, "big")
+            # Drop the padding and the columns that are off the sheet
+            value >>= len(line) * 8 - x1 * bpp
+            value &= (1 << (x1 - x0) * bpp) - 1
+            bits |= value << (width - (x + x1) * bpp)
+
+        if bits == 0:
+            return None
+        return (bits << (length * 8 - width)).to_bytes(length, "big")
+
+    def bbox(self, planes=None, bpp=1):
+        """Union of the tiles' content boxes"""
+        if planes is None and self.background != b"\xff\xff\xff":
+            return (0, 0, self.size[0], self.size[1])
+
+        boxes = []
+        for image, x, y, x0, x1 in self.tiles:
+            box = image.bbox(planes, bpp)
+            if box is None:
+                continue
+            boxes.append(
+                (
+                    x + max(x0, box[0]),
+                    max(0, y + box[1]),
+                    x + min(x1, box[2]),
+                    min(self.size[1], y + box[3]),
+                )
+            )
+        boxes = [box for box in boxes if box[0] < box[2] and box[1] < box[3]]
+        if not boxes:
+            return None
+        return (
+            min(box[0] for box in boxes),
+            min(box[1] for box in boxes),
+            max(box[2] for box in boxes),
+            max(box[3] for box in boxes),
+        )
+
+    def digest(self, planes=None, bpp=1, parallel=False) -> bytes:
+        """Content hash, derived from the tiles' digests and placements"""
+        h = hashlib.blake2b(digest_size=16)
+        h.update(struct.pack("<LL", self.size[0], self.size[1]))
+        h.update(self.background)
+        for image, x, y, x0, x1 in self.tiles:
+            h.update(struct.pack("<llLL", x, y, x0, x1))
+            h.update(image.digest(planes=planes, bpp=bpp, parallel=parallel))
+        return h.digest()
+
+
+def grid(
+    sources,
+    size=(0, 0),
+    columns=2,
+    rows=2,
+    gutter=0,
+    method=epson.resample.BILINEAR,
+    mode=epson.resample.FIT,
+):
+    """Impose sources N-up, columns x rows per sheet, in reading order
+
+    Each source is resampled to its cell (see epson.resample.fit) and
+    the cells share the sheet equally, 'gutter' dots apart. Returns the
+    list of Sheet pages; the last one may be partly empty.
+    """
+    if columns < 1 or rows < 1:
+        raise ValueError(f"Invalid grid {columns}x{rows}.")
+
+    width, height = size
+    cell = (
+        (width - gutter * (columns - 1)) // columns,
+        (height - gutter * (rows - 1)) // rows,
+    )
+    if cell[0] < 1 or cell[1] < 1:
+        raise ValueError(f"Grid {columns}x{rows} does not fit in {width}x{height}.")
+
+    sources = list(sources)
+    count = columns * rows
+    sheets = []
+    for first in range(0, len(sources), count):
+        tiles = []
+        for index, source in enumerate(sources[first : first + count]):
+            column, row = index % columns, index // columns
+            tile = epson.resample.fit(source, cell, method, mode)
+            tiles.append(
+                (tile, (column * (cell[0] + gutter), row * (cell[1] + gutter)))
+            )
+        sheets.append(Sheet(size, tiles))
+    return sheets
+
+
+def divide16(sources, size=(0, 0), method=epson.resample.BILINEAR):
+    """Impose sources 16-up (MLID.DIVIDE16), 4x4 per sheet"""
+    return grid(sources, size, 4, 4, method=method)
+
+
+def impose(sources, size=(0, 0), mlid=MLID.BORDERS, nup=None, method=None):
+    """Impose pages as a job's settings ask, or return them unchanged
+
+    @param mlid   : MLID.DIVIDE16 imposes 16-up
+    @param nup    : (columns, rows) grid, or None
+    @param method : Resampling method (see epson.resample), default bilinear
+    """
+    if method is None:
+        method = epson.resample.BILINEAR
+    if nup is not None:
+        return grid(sources, size, nup[0], nup[1], method=method)
+    if mlid == MLID.DIVIDE16:
+        return divide16(sources, size, method=method)
+    return sources
@@ -29,9 +29,14 @@ from __future__ import print_function
 
 import io
 import sys
+import select
 from socket import socket as Socket, AF_INET, SOCK_STREAM
 
-import usb.core
+try:
+    import usb.core
+    import usb.util
+except ImportError:  # pyusb is only needed by the Usb transport
+    usb = None
 
 
 class Io(object):
@@ -49,7 +54,8 @@ class Io(object):
     def send(self, data=None):
         pass
 
-    def recv(self, expected=None):
+    def recv(self, expected=None, timeout=0.0):
+        """Read back-channel data, or None when there is none"""
         return None
 
 
@@ -73,6 +79,50 @@ class File(Io):
             self.fd.write(data)
 
 
+class Memory(Io):
+    """EPSON In-Memory Transport
+
+    Data is appended to a growable bytearray. send() is bound directly to
+    bytearray.extend, so each send costs a single C call.
+
+    Note that the buffer cannot grow while a memoryview from getbuffer() is
+    still alive; release it before sending more data.
+    """
+
+    def __init__(self, buffer=None):
+        """
+        @param buffer : bytearray to append to (a new one by default)
+        """
+        if buffer is None:
+            buffer = bytearray()
+        self.buffer = buffer
+        self.send = buffer.extend
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def getbuffer(self):
+        """Zero-copy view of the data sent so far"""
+        return memoryview(self.buffer)
+
+    def getvalue(self):
+        """Copy of the data sent so far"""
+        return bytes(self.buffer)
+
+    def clear(self):
+        del self.buffer[:]
+
+
+class Null(Io):
+    """EPSON Discard Transport, which only counts the bytes sent"""
+
+    def __init__(self):
+        self.count = 0
+
+    def send(self, data):
+        self.count += len(data)
+
+
 def Usb(Io):
     """EPSON USB Transport"""
 
@@ -144,5 +194,19 @@ class Network:
     def send(self, data=None):
         self._socket.sendall(data)
 
-    def recv(self, expected=None):
-        return None
+    def fileno(self):
+        return self._socket.fileno()
+
+    def recv(self, expected=None, timeout=0.0):
+        """Read back-channel data without blocking the data path
+
+        Returns the bytes available within 'timeout' seconds (at most
+        'expected', or 4096), or None when there are none.
+        """
+        readable, _, _ = select.select([self._socket], [], [], timeout)
+        if not readable:
+            return None
+        data = self._socket.recv(expected or 4096)
+        if not data:
+            return None
+        return data
@@ -27,14 +27,63 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import io
+import functools
+import os
+import mmap
+import random
 import struct
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
 from epson.constant import *
 
+try:
+    import xxhash
+except ImportError:  # Optional; blake2b is used instead
+    xxhash = None
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _hasher():
+    """Fast 128-bit hash: xxh3 when available, else blake2b"""
+    if xxhash is not None:
+        return xxhash.xxh3_128()
+    return hashlib.blake2b(digest_size=16)
+
+
+def _digest_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            workers = min(8, os.cpu_count() or 1)
+            _executor = ThreadPoolExecutor(max_workers=workers)
+        return _executor
+
+
+# Rec. 601 luma weights, in 1/256ths
+_LUMA_R = [77 * value for value in range(256)]
+_LUMA_G = [150 * value for value in range(256)]
+_LUMA_B = [29 * value for value in range(256)]
+
 
 class Image(object):
     """Base raster class"""
 
+    # Rows per digest band (see digest())
+    DigestBand = 64
+
+    # Keep band digests between digest() calls. Only for images whose
+    # content never changes, or that call invalidate() when it does.
+    DigestCache = False
+
+    # line() and bitline() may be called from several threads at once,
+    # so digest() can hash bands in parallel
+    ThreadSafe = False
+
     def __init__(self, size=(0, 0)):
         self.size = size[:]
 
@@ -46,10 +95,177 @@ class Image(object):
         """Retrieve a RGB 24-bit line from the bitmap"""
         return ""
 
+    def linespan(self, y=0, x0=0, x1=None):
+        """Retrieve the RGB 24-bit pixels x0 to x1 (exclusive) of a line
+
+        Lazy images may override it to only generate the requested pixels.
+        """
+        line = self.line(y)
+        if not line:
+            return line
+        if x1 is None:
+            x1 = self.size[0]
+        return line[x0 * 3 : x1 * 3]
+
+    def bbox(self, planes=None, bpp=1):
+        """Box (x0, y0, x1, y1) holding all of the content, or None if blank
+
+        Content is non-white RGB pixels, or with 'planes' set bits of those
+        colors. The box may be larger than the content: by default it is the
+        whole image, so that nothing is scanned twice. Images that know
+        where their content is should override it, and images held in
+        memory can use scan_bbox().
+        """
+        return (0, 0, self.size[0], self.size[1])
+
+    def scan_bbox(self, planes=None, bpp=1, rows=None):
+        """Exact bounding box, found by scanning the rows
+
+        @param rows : Line numbers to scan, all by default
+        """
+        width, height = self.size
+        if rows is None:
+            rows = range(height)
+
+        x0, x1 = width, 0
+        y0, y1 = None, None
+        for y in rows:
+            if planes is None:
+                lines = [(self.line(y), b"\xff", 3)]
+            else:
+                lines = [(self.bitline(y=y, ci=ci, bpp=bpp), b"\0", 0) for ci in planes]
+
+            found = False
+            for line, blank, pixel in lines:
+                if not line:
+                    continue
+                left = len(line) - len(line.lstrip(blank))
+                if left == len(line):
+                    continue
+                right = len(line.rstrip(blank))
+                if pixel:
+                    left, right = left // pixel, (right + pixel - 1) // pixel
+                else:
+                    left, right = left * 8 // bpp, min(width, right * 8 // bpp)
+                x0, x1 = min(x0, left), max(x1, right)
+                found = True
+
+            if found:
+                y0 = y if y0 is None else min(y0, y)
+                y1 = y + 1 if y1 is None else max(y1, y + 1)
+
+        if y0 is None:
+            return None
+        return (x0, y0, x1, y1)
+
+    def grayline(self, y=0):
+        """Retrieve an 8-bit gray line, for monochrome jobs
+
+        Derived from line(); images with gray or bilevel content should
+        override it to skip the RGB expansion.
+        """
+        line = self.line(y)
+        if not line:
+            return line
+        r, g, b = line[0::3], line[1::3], line[2::3]
+        if r == g == b:
+            return r
+        return bytes(
+            (_LUMA_R[r] + _LUMA_G[g] + _LUMA_B[b]) >> 8 for r, g, b in zip(r, g, b)
+        )
+
+    def digest(self, planes=None, bpp=1, parallel=False) -> bytes:
+        """Content hash of the image
+
+        Hashes every RGB line, or with 'planes' every bitline of those
+        colors. The image is hashed in bands of DigestBand rows, and the band
+        hashes are combined into the page hash. With 'parallel', ThreadSafe
+        images are hashed on a thread pool (hashing releases the GIL).
+
+        With DigestCache, band hashes are kept between calls: the image
+        must call invalidate() for the rows it modifies, and only those
+        bands are hashed again.
+
+        Images that can identify their content more cheaply (files,
+        generated patterns) should override this, so that cache lookups do
+        not have to rasterise the page.
+        """
+        if planes is not None:
+            planes = tuple(planes)
+
+        width, height = self.size
+        count = (height + self.DigestBand - 1) // self.DigestBand
+
+        key = (planes, bpp)
+        if self.DigestCache:
+            digests = getattr(self, "_digests", None)
+            if digests is None or digests[0] != (width, height):
+                digests = ((width, height), {})
+                self._digests = digests
+
+            bands = digests[1].get(key)
+            if bands is None:
+                bands = [None] * count
+                digests[1][key] = bands
+        else:
+            bands = [None] * count
+
+        dirty = [band for band in range(count) if bands[band] is None]
+        if parallel and self.ThreadSafe and len(dirty) > 1:
+            hashed = _digest_executor().map(
+                lambda band: self._band_digest(band, planes, bpp), dirty
+            )
+        else:
+            hashed = [self._band_digest(band, planes, bpp) for band in dirty]
+        for band, value in zip(dirty, hashed):
+            bands[band] = value
+
+        h = _hasher()
+        h.update(struct.pack("<LLL", width, height, self.DigestBand))
+        h.update(repr(key).encode())
+        for value in bands:
+            h.update(value)
+        return h.digest()
+
+    def invalidate(self, y0=0, y1=None):
+        """Mark rows y0 to y1 (exclusive) as modified, for digest()"""
+        digests = getattr(self, "_digests", None)
+        if digests is None:
+            return
+
+        if y1 is None:
+            y1 = self.size[1]
+        first = y0 // self.DigestBand
+        last = (y1 + self.DigestBand - 1) // self.DigestBand
+        for bands in digests[1].values():
+            for band in range(first, min(last, len(bands))):
+                bands[band] = None
+
+    def _band_digest(self, band, planes=None, bpp=1):
+        h = _hasher()
+        y0 = band * self.DigestBand
+        y1 = min(y0 + self.DigestBand, self.size[1])
+        for y in range(y0, y1):
+            if planes is None:
+                lines = [self.line(y)]
+            else:
+                lines = [self.bitline(y=y, ci=ci, bpp=bpp) for ci in planes]
+            for line in lines:
+                if line is None:
+                    h.update(b"\0")
+                else:
+                    h.update(b"\1")
+                    h.update(struct.pack("<L", len(line)))
+                    h.update(line)
+        return h.digest()
+
 
 class TestImage(Image):
     """Test Image"""
 
+    DigestCache = True
+    ThreadSafe = True
+
     def bitline(self, y=0, ci=CI.BLACK, bpp=1) -> Optional[bytes]:
         """Retrieve a bitmap of a line in a single color"""
 
@@ -96,3 +312,527 @@ class TestImage(Image):
             rgb += struct.pack("BBB", r_grad, g_grad, b_grad)
 
         return rgb
+
+
+class Pattern(Image):
+    """Parameterisable synthetic page, for tests, benchmarks and soak runs
+
+    Successor of TestImage. Kinds:
+      'bands'    : TestImage's gradients, changing colour every 'band' rows
+      'gradient' : horizontal gray ramp
+      'text'     : black glyph-like blocks in lines of text
+      'noise'    : random pixels
+      'blank'    : white page
+
+    Only 'rows' distinct rows are generated (for 'bands', one per colour),
+    with whole-row bytes operations, and cached; bitlines are derived
+    from them with integer bit operations. digest() identifies the content
+    from the parameters, without rasterising.
+    """
+
+    KINDS = ("bands", "gradient", "text", "noise", "blank")
+
+    def __init__(self, size=(0, 0), kind="bands", rows=64, band=60, seed=0):
+        """
+        @param size : (width, height) in dots
+        @param kind : One of Pattern.KINDS
+        @param rows : Distinct rows, repeated down the page
+        @param band : Rows per colour band, for 'bands'
+        @param seed : Random seed, for 'text' and 'noise'
+        """
+        super(Pattern, self).__init__(size=tuple(size))
+        if kind not in self.KINDS:
+            raise ValueError(f"Unknown pattern '{kind}'.")
+        self.kind = kind
+        self.rows = max(1, rows)
+        self.band = band
+        self.seed = seed
+
+        self._lines = {}
+        self._bits = {}
+
+    def _row(self, y):
+        """Index of the distinct row shown on line y"""
+        if self.kind == "bands":
+            return (y // self.band) % 7
+        if self.kind == "blank":
+            return 0
+        return y % self.rows
+
+    def _generate(self, row):
+        width = self.size[0]
+        if self.kind == "blank":
+            return b"\xff\xff\xff" * width
+
+        if self.kind == "noise":
+            return random.Random(self.seed * 1000003 + row).randbytes(width * 3)
+
+        if self.kind == "text":
+            rnd = random.Random(self.seed * 1000003 + row)
+            line = bytearray(b"\xff\xff\xff" * width)
+            # Two thirds of each 48 row text line carry glyphs
+            if row % 48 < 32:
+                x = width // 20
+                while x < width - width // 20:
+                    glyph = rnd.randint(8, 24)
+                    if rnd.random() < 0.8:
+                        for dx in range(0, glyph, rnd.randint(2, 6)):
+                            line[(x + dx) * 3 : (x + dx + 2) * 3] = b"\x00" * 6
+                    x += glyph + 6
+            return bytes(line[: width * 3])
+
+        ramp = bytes(256 * x // width for x in range(width))
+        if self.kind == "gradient":
+            return _gray_to_rgb(ramp)
+
+        # bands: each channel ramps up or down, by colour
+        down = ramp.translate(_INVERT)
+        rgb = bytearray(width * 3)
+        for c in range(3):
+            rgb[c::3] = ramp if (row >> c) & 1 else down
+        return bytes(rgb)
+
+    def line(self, y=0):
+        """Retrieve a RGB 24-bit line"""
+        if y >= self.size[1]:
+            return None
+        row = self._row(y)
+        line = self._lines.get(row)
+        if line is None:
+            line = self._generate(row)
+            self._lines[row] = line
+        return line
+
+    def _planes(self, row):
+        """Naive CMYK bitplanes of a row, as integers (most significant first)"""
+        line = self.line(self._row_y(row))
+        width = self.size[0]
+
+        def bits(channel, threshold):
+            table = _THRESHOLD[threshold]
+            return int(channel.translate(table), 2) if width else 0
+
+        r, g, b = line[0::3], line[1::3], line[2::3]
+        k = bits(r, 64) & bits(g, 64) & bits(b, 64)
+        planes = {
+            CI.BLACK.value: k,
+            CI.CYAN.value: bits(r, 128) & ~k,
+            CI.MAGENTA.value: bits(g, 128) & ~k,
+            4: bits(b, 128) & ~k,
+        }
+        return planes
+
+    def _row_y(self, row):
+        if self.kind == "bands":
+            return row * self.band
+        return row
+
+    def bitline(self, y=0, ci=CI.BLACK, bpp=1) -> Optional[bytes]:
+        """Retrieve a bitmap of a line in a single color"""
+        if y >= self.size[1]:
+            return None
+
+        if self.kind == "bands":
+            # As TestImage: one full plane per band, cycling over 5 colours
+            if (y // self.band) % 5 != ci:
+                return None
+            return b"\xff" * ((self.size[0] + 7) // 8) * bpp
+
+        row = self._row(y)
+        key = (row, int(ci), bpp)
+        if key in self._bits:
+            return self._bits[key]
+
+        planes = self._bits.get(row)
+        if planes is None:
+            planes = self._planes(row)
+            self._bits[row] = planes
+
+        value = planes.get(int(ci), 0)
+        data = None
+        if value:
+            width = self.size[0]
+            pad = -width % 8
+            data = (value << pad).to_bytes((width + pad) // 8, "big")
+            if bpp != 1:
+                table = _bit_table(bpp)
+                data = b"".join(map(table.__getitem__, data))
+        self._bits[key] = data
+        return data
+
+    def bbox(self, planes=None, bpp=1):
+        """Exact bounding box, from the distinct rows only"""
+        if self.kind == "blank":
+            return None
+        height = self.size[1]
+        if self.kind == "bands":
+            rows = range(0, min(height, self.band * 35), self.band)
+        else:
+            rows = range(min(height, self.rows))
+        box = self.scan_bbox(planes, bpp, rows)
+        if box is None:
+            return None
+        # Distinct rows repeat down the page
+        return (box[0], 0, box[2], height)
+
+    def digest(self, planes=None, bpp=1, parallel=False) -> bytes:
+        """Content hash, from the pattern parameters"""
+        h = _hasher()
+        h.update(b"Pattern")
+        h.update(
+            repr(
+                (
+                    tuple(self.size),
+                    self.kind,
+                    self.rows,
+                    self.band,
+                    self.seed,
+                    None if planes is None else tuple(planes),
+                    bpp,
+                )
+            ).encode()
+        )
+        return h.digest()
+
+
+# Channel byte to '1' below a threshold, else '0'
+_THRESHOLD = {
+    threshold: bytes(ord("1") if v < threshold else ord("0") for v in range(256))
+    for threshold in (64, 128)
+}
+
+
+def _gray_to_rgb(gray):
+    """Expand 8-bit gray samples to 24-bit RGB"""
+    rgb = bytearray(len(gray) * 3)
+    rgb[0::3] = gray
+    rgb[1::3] = gray
+    rgb[2::3] = gray
+    return bytes(rgb)
+
+
+@functools.lru_cache(maxsize=None)
+def _bit_table(bpp=1):
+    """Map each byte of a 1-bit bitmap to its bpp-bits-per-dot expansion"""
+    table = []
+    ones = (1 << bpp) - 1
+    for value in range(256):
+        out = 0
+        for bit in range(7, -1, -1):
+            out = (out << bpp) | (ones if (value >> bit) & 1 else 0)
+        table.append(out.to_bytes(bpp, "big"))
+    return table
+
+
+# 1-bit ink bitmap byte to 8 RGB pixels (set bits are black)
+_BIT_RGB = [
+    b"".join(
+        b"\x00\x00\x00" if (value >> bit) & 1 else b"\xff\xff\xff"
+        for bit in range(7, -1, -1)
+    )
+    for value in range(256)
+]
+
+# 1-bit white bitmap byte to 8 gray samples
+_BIT_GRAY = [
+    bytes(0xFF if (value >> bit) & 1 else 0 for bit in range(7, -1, -1))
+    for value in range(256)
+]
+
+# Invert all bits of a byte
+_INVERT = bytes(255 - value for value in range(256))
+
+
+class PNMImage(Image):
+    """Lazily decoded binary PNM (P5 gray PGM, P6 RGB PPM) file
+
+    The file is memory mapped; rows are sliced out of the mapping on demand,
+    so memory use does not depend on the file size.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._fd = io.open(filename, "rb")
+        self._map = mmap.mmap(self._fd.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, width, height, maxval, offset = self._header()
+        if magic not in (b"P5", b"P6"):
+            raise ValueError(f"Unsupported PNM type '{magic.decode()}'.")
+        if maxval > 65535 or maxval < 1:
+            raise ValueError(f"Unsupported PNM maxval '{maxval}'.")
+
+        super(PNMImage, self).__init__(size=(width, height))
+        self.channels = 3 if magic == b"P6" else 1
+        self.sample_size = 1 if maxval < 256 else 2
+        self.maxval = maxval
+        self.offset = offset
+        self.stride = width * self.channels * self.sample_size
+
+    def _header(self):
+        data = self._map
+        size = len(data)
+        fields = []
+        pos = 0
+        while len(fields) < 4:
+            while data[pos : pos + 1].isspace():
+                pos += 1
+            if data[pos : pos + 1] == b"#":
+                pos = data.find(b"\n", pos) + 1
+                if pos == 0:
+                    break
+                continue
+            end = pos
+            while end < size and not data[end : end + 1].isspace():
+                end += 1
+            if end >= size:
+                break
+            fields.append(data[pos:end])
+            pos = end
+        if len(fields) < 4:
+            raise ValueError(f"Truncated PNM header in '{self.filename}'.")
+        # Exactly one whitespace byte separates the header from the samples
+        return (fields[0], int(fields[1]), int(fields[2]), int(fields[3]), pos + 1)
+
+    def close(self):
+        self._map.close()
+        self._fd.close()
+
+    def view(self, y=0):
+        """Zero-copy view of the raw samples of a row"""
+        start = self.offset + y * self.stride
+        return memoryview(self._map)[start : start + self.stride]
+
+    def _samples(self, y):
+        start = self.offset + y * self.stride
+        data = self._map[start : start + self.stride]
+        if self.sample_size == 2:
+            # Keep the most significant byte of big-endian 16-bit samples
+            data = data[0::2]
+        if self.maxval not in (255, 65535):
+            scale = 255.0 / (self.maxval >> (8 * (self.sample_size - 1)))
+            data = data.translate(
+                bytes(min(255, int(v * scale + 0.5)) for v in range(256))
+            )
+        return data
+
+    def line(self, y=0):
+        """Retrieve a RGB 24-bit line from the file"""
+        if y >= self.size[1]:
+            return None
+        data = self._samples(y)
+        if self.channels == 1:
+            return _gray_to_rgb(data)
+        return data
+
+    def grayline(self, y=0):
+        if self.channels != 1:
+            return super(PNMImage, self).grayline(y)
+        if y >= self.size[1]:
+            return None
+        return self._samples(y)
+
+    def digest(self, planes=None, bpp=1, parallel=False) -> bytes:
+        """Content hash of the file's samples, without decoding rows"""
+        h = _hasher()
+        h.update(
+            struct.pack("<LLLL", self.size[0], self.size[1], self.channels, self.maxval)
+        )
+        h.update(
+            memoryview(self._map)[
+                self.offset : self.offset + self.stride * self.size[1]
+            ]
+        )
+        return h.digest()
+
+
+class TIFFImage(Image):
+    """Lazily decoded strip-based TIFF file
+
+    Supports uncompressed and PackBits strips, chunky 8-bit gray or RGB(A)
+    and 1-bit bilevel images. Only the strip containing the requested row
+    is read and decoded, so memory use does not depend on the file size.
+    1-bit images also provide a black bitline() without going through RGB.
+    """
+
+    DigestCache = True
+    ThreadSafe = True
+
+    def __init__(self, filename, page=0):
+        self.filename = filename
+        self._fd = io.open(filename, "rb")
+        self._lock = threading.Lock()
+        self._cached = (None, None)
+
+        tags = self._read_ifd(page)
+
+        width = tags[256][0]
+        height = tags[257][0]
+        super(TIFFImage, self).__init__(size=(width, height))
+
+        self.bits = tags.get(258, [1])[0]
+        self.compression = tags.get(259, [1])[0]
+        self.photometric = tags.get(262, [1])[0]
+        self.channels = tags.get(277, [1])[0]
+        self.rows_per_strip = min(tags.get(278, [height])[0], height)
+        # Tiled files have TileOffsets instead
+        if 273 not in tags:
+            raise ValueError("unsupported TIFF: no strip offsets")
+        if 279 not in tags:
+            raise ValueError("unsupported TIFF: no strip byte counts")
+        self.strip_offsets = tags[273]
+        self.strip_counts = tags[279]
+
+        if tags.get(284, [1])[0] != 1:
+            raise ValueError("Planar TIFF files are not supported.")
+        if self.compression not in (1, 32773):
+            raise ValueError(f"Unsupported TIFF compression '{self.compression}'.")
+        if (self.bits, self.channels) not in ((1, 1), (8, 1), (8, 3), (8, 4)):
+            raise ValueError(
+                f"Unsupported TIFF sample format {self.channels}x{self.bits}."
+            )
+
+        self.stride = (width * self.channels * self.bits + 7) // 8
+
+    def _read_ifd(self, page):
+        fd = self._fd
+        order = fd.read(2)
+        if order == b"II":
+            self._order = "<"
+        elif order == b"MM":
+            self._order = ">"
+        else:
+            raise ValueError("Not a TIFF file.")
+
+        magic, offset = struct.unpack(self._order + "HL", fd.read(6))
+        if magic != 42:
+            raise ValueError("Not a TIFF file.")
+
+        for _ in range(page):
+            fd.seek(offset)
+            (count,) = struct.unpack(self._order + "H", fd.read(2))
+            fd.seek(offset + 2 + count * 12)
+            (offset,) = struct.unpack(self._order + "L", fd.read(4))
+            if offset == 0:
+                raise IndexError(f"TIFF page {page} does not exist.")
+
+        fd.seek(offset)
+        (count,) = struct.unpack(self._order + "H", fd.read(2))
+        entries = fd.read(count * 12)
+
+        sizes = {1: "B", 3: "H", 4: "L", 16: "Q"}
+        tags = {}
+        for n in range(count):
+            tag, kind, items = struct.unpack_from(self._order + "HHL", entries, n * 12)
+            if kind not in sizes:
+                continue
+            fmt = self._order + sizes[kind] * items
+            length = struct.calcsize(fmt)
+            if length <= 4:
+                data = entries[n * 12 + 8 : n * 12 + 8 + length]
+            else:
+                (where,) = struct.unpack_from(self._order + "L", entries, n * 12 + 8)
+                fd.seek(where)
+                data = fd.read(length)
+            tags[tag] = list(struct.unpack(fmt, data))
+
+        return tags
+
+    def close(self):
+        self._fd.close()
+
+    def _load(self, strip):
+        cached = self._cached
+        if cached[0] == strip:
+            return cached[1]
+
+        with self._lock:
+            self._fd.seek(self.strip_offsets[strip])
+            data = self._fd.read(self.strip_counts[strip])
+        if self.compression == 32773:
+            data = _packbits_decode(data)
+
+        # Strip number and data are replaced together, for other threads
+        self._cached = (strip, data)
+        return data
+
+    def _row(self, y):
+        data = self._load(y // self.rows_per_strip)
+        start = (y % self.rows_per_strip) * self.stride
+        return data[start : start + self.stride]
+
+    def line(self, y=0):
+        """Retrieve a RGB 24-bit line from the file"""
+        if y >= self.size[1]:
+            return None
+
+        row = self._row(y)
+        if self.bits == 1:
+            if self.photometric == 1:
+                # BlackIsZero: set bits are white
+                row = row.translate(_INVERT)
+            return b"".join(map(_BIT_RGB.__getitem__, row))[: self.size[0] * 3]
+
+        if self.channels == 1:
+            if self.photometric == 0:
+                row = row.translate(_INVERT)
+            return _gray_to_rgb(row)
+
+        if self.channels == 4:
+            rgb = bytearray(self.size[0] * 3)
+            rgb[0::3] = row[0::4]
+            rgb[1::3] = row[1::4]
+            rgb[2::3] = row[2::4]
+            return bytes(rgb)
+
+        return row
+
+    def grayline(self, y=0):
+        if self.channels != 1:
+            return super(TIFFImage, self).grayline(y)
+        if y >= self.size[1]:
+            return None
+
+        row = self._row(y)
+        if self.bits == 1:
+            if self.photometric == 0:
+                row = row.translate(_INVERT)
+            return b"".join(map(_BIT_GRAY.__getitem__, row))[: self.size[0]]
+
+        if self.photometric == 0:
+            row = row.translate(_INVERT)
+        return row
+
+    def bitline(self, y=0, ci=CI.BLACK, bpp=1) -> Optional[bytes]:
+        """Retrieve the black bitmap of a 1-bit image"""
+        if self.bits != 1 or ci != CI.BLACK or y >= self.size[1]:
+            return None
+
+        row = self._row(y)
+        if self.photometric == 1:
+            row = row.translate(_INVERT)
+        # Clear the padding bits of the last byte
+        pad = -self.size[0] % 8
+        if pad:
+            row = row[:-1] + bytes((row[-1] & (0xFF << pad) & 0xFF,))
+        if row.count(0) == len(row):
+            return None
+        if bpp == 1:
+            return row
+        table = _bit_table(bpp)
+        return b"".join(map(table.__getitem__, row))
+
+
+def _packbits_decode(data):
+    out = []
+    pos = 0
+    end = len(data)
+    while pos < end:
+        n = data[pos]
+        pos += 1
+        if n < 128:
+            out.append(data[pos : pos + n + 1])
+            pos += n + 1
+        elif n > 128:
+            out.append(data[pos : pos + 1] * (257 - n))
+            pos += 1
+    return b"".join(out)
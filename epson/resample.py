@@ -0,0 +1,320 @@
+#
+#  Copyright (C) 2016, Jason S. McMullan <jason.mcmullan@gmail.com>
+#  All rights reserved.
+#
+#  Licensed under the MIT License:
+#
+#  Permission is hereby granted, free of charge, to any person obtaining
+#  a copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import math
+import struct
+import hashlib
+from itertools import accumulate
+from operator import itemgetter
+from typing import Optional
+
+from epson.constant import *
+from epson.raster import Image
+
+NEAREST = "nearest"
+BILINEAR = "bilinear"
+AREA = "area"
+
+FIT = "fit"
+"""Scale to fit inside the target, keeping the aspect ratio."""
+
+FILL = "fill"
+"""Scale to cover the target, keeping the aspect ratio and cropping."""
+
+CENTER = "center"
+"""Do not scale; centre on the target, cropping."""
+
+
+def _gather(data, index):
+    """bytes(data[i] for i in index), at C speed"""
+    if len(index) == 0:
+        return b""
+    if len(index) == 1:
+        return bytes((data[index[0]],))
+    return bytes(itemgetter(*index)(data))
+
+
+def _interleave(channels):
+    """Interleave equal-length channel byte strings into pixels"""
+    count = len(channels)
+    out = bytearray(len(channels[0]) * count)
+    for c in range(count):
+        out[c::count] = channels[c]
+    return bytes(out)
+
+
+class Resample(Image):
+    """Image adapter that resamples a source onto a target size
+
+    Rows are produced on demand: only the few source rows needed for the
+    current output row are kept (horizontally resampled), so a job can
+    stream a 720 dpi page without holding an upscaled copy in memory.
+    Output rows should be requested in increasing order for best
+    performance, as print_pages() does.
+
+    bitline() is always resampled with the nearest neighbour.
+    """
+
+    def __init__(
+        self,
+        source: Image,
+        size=(0, 0),
+        method=BILINEAR,
+        mode=FIT,
+        background=b"\xff\xff\xff",
+    ):
+        """
+        @param source     : Source Image
+        @param size       : Target (width, height) in dots
+        @param method     : NEAREST, BILINEAR or AREA
+        @param mode       : FIT, FILL or CENTER
+        @param background : RGB pixel outside the scaled source
+        """
+        super(Resample, self).__init__(size=tuple(size))
+        if method not in (NEAREST, BILINEAR, AREA):
+            raise ValueError(f"Unknown resampling method '{method}'.")
+        if mode not in (FIT, FILL, CENTER):
+            raise ValueError(f"Unknown fitting mode '{mode}'.")
+
+        self.source = source
+        self.method = method
+        self.mode = mode
+        self.background = background
+
+        sw, sh = source.size
+        tw, th = self.size
+        if mode == CENTER or sw == 0 or sh == 0:
+            scale = 1.0
+        elif mode == FIT:
+            scale = min(tw / sw, th / sh)
+        else:
+            scale = max(tw / sw, th / sh)
+        self.scale = scale
+
+        # Scaled source size, and its offset on the target
+        dw = max(1, int(round(sw * scale)))
+        dh = max(1, int(round(sh * scale)))
+        self.offset = ((tw - dw) // 2, (th - dh) // 2)
+        self.scaled = (dw, dh)
+
+        # Visible output columns
+        self.x0 = max(0, self.offset[0])
+        self.x1 = min(tw, self.offset[0] + dw)
+
+        self._blank = background * tw
+        self._rows = {}
+        self._bits = {}
+        self._columns()
+
+    def _columns(self):
+        """Precompute the horizontal source mapping of the visible columns"""
+        sw = self.source.size[0]
+        ox = self.offset[0]
+        scale = self.scale
+        xs = range(self.x0, self.x1)
+
+        self._near = [min(sw - 1, int((x - ox + 0.5) / scale)) for x in xs]
+
+        self._lo = []
+        self._hi = []
+        self._w = []
+        for x in xs:
+            u = min(max((x - ox + 0.5) / scale - 0.5, 0.0), sw - 1)
+            lo = int(u)
+            self._lo.append(lo)
+            self._hi.append(min(lo + 1, sw - 1))
+            self._w.append(int((u - lo) * 256))
+
+        self._start = []
+        self._end = []
+        for x in xs:
+            start = min(sw - 1, int((x - ox) / scale))
+            end = min(sw, max(start + 1, int((x - ox + 1) / scale)))
+            self._start.append(start)
+            self._end.append(end)
+
+    def _source_rows(self, y):
+        """Source rows and weights (fixed point, /256) for output row y"""
+        sh = self.source.size[1]
+        oy = self.offset[1]
+        scale = self.scale
+
+        if self.method == NEAREST:
+            return [(min(sh - 1, int((y - oy + 0.5) / scale)), 256)]
+
+        if self.method == BILINEAR:
+            v = min(max((y - oy + 0.5) / scale - 0.5, 0.0), sh - 1)
+            lo = int(v)
+            w = int((v - lo) * 256)
+            if w == 0 or lo + 1 >= sh:
+                return [(lo, 256)]
+            return [(lo, 256 - w), (lo + 1, w)]
+
+        start = min(sh - 1, int((y - oy) / scale))
+        end = min(sh, max(start + 1, int((y - oy + 1) / scale)))
+        return [(sy, 256) for sy in range(start, end)]
+
+    def _row(self, sy):
+        """Horizontally resampled source row, as RGB channels"""
+        row = self._rows.get(sy)
+        if row is not None:
+            return row
+
+        line = self.source.line(sy)
+        if not line:
+            line = b"\xff\xff\xff" * self.source.size[0]
+        channels = (line[0::3], line[1::3], line[2::3])
+
+        if self.method == NEAREST:
+            row = tuple(_gather(c, self._near) for c in channels)
+        elif self.method == BILINEAR:
+            row = []
+            for c in channels:
+                a = _gather(c, self._lo)
+                b = _gather(c, self._hi)
+                row.append(
+                    bytes(
+                        (p * (256 - w) + q * w) >> 8 for p, q, w in zip(a, b, self._w)
+                    )
+                )
+            row = tuple(row)
+        else:
+            row = []
+            for c in channels:
+                total = list(accumulate(c, initial=0))
+                row.append(
+                    bytes(
+                        (total[e] - total[s]) // (e - s)
+                        for s, e in zip(self._start, self._end)
+                    )
+                )
+            row = tuple(row)
+
+        # Keep only the rows that can still be needed by later output rows
+        if len(self._rows) > 2 + int(1 / self.scale):
+            for old in [k for k in self._rows if k < sy - 1 - int(1 / self.scale)]:
+                del self._rows[old]
+        self._rows[sy] = row
+        return row
+
+    def line(self, y=0):
+        """Retrieve a RGB 24-bit line of the resampled image"""
+        oy = self.offset[1]
+        if y < max(0, oy) or y >= min(self.size[1], oy + self.scaled[1]):
+            return self._blank
+
+        sources = self._source_rows(y)
+        if len(sources) == 1:
+            channels = self._row(sources[0][0])
+        elif self.method == BILINEAR:
+            (lo, wa), (hi, wb) = sources
+            a = self._row(lo)
+            b = self._row(hi)
+            channels = tuple(
+                bytes((p * wa + q * wb) >> 8 for p, q in zip(ca, cb))
+                for ca, cb in zip(a, b)
+            )
+        else:
+            rows = [self._row(sy) for sy in range(sources[0][0], sources[-1][0] + 1)]
+            count = len(rows)
+            channels = tuple(
+                bytes(sum(column) // count for column in zip(*[r[c] for r in rows]))
+                for c in range(3)
+            )
+
+        pixels = _interleave(channels)
+        if self.x0 == 0 and self.x1 == self.size[0]:
+            return pixels
+        return (
+            self.background * self.x0
+            + pixels
+            + self.background * (self.size[0] - self.x1)
+        )
+
+    def bitline(self, y=0, ci=CI.BLACK, bpp=1) -> Optional[bytes]:
+        """Retrieve a nearest-neighbour resampled bitmap line"""
+        oy = self.offset[1]
+        if y < max(0, oy) or y >= min(self.size[1], oy + self.scaled[1]):
+            return None
+
+        sh = self.source.size[1]
+        sy = min(sh - 1, int((y - oy + 0.5) / self.scale))
+
+        line = self.source.bitline(y=sy, ci=ci, bpp=bpp)
+        if line is None:
+            return None
+
+        sw = self.source.size[0]
+        bits = format(int.from_bytes(line, "big"), "0%db" % (len(line) * 8))
+        pixels = [bits[x * bpp : (x + 1) * bpp] for x in range(sw)]
+        if len(self._near) == 1:
+            gathered = pixels[self._near[0]]
+        else:
+            gathered = "".join(itemgetter(*self._near)(pixels)) if self._near else ""
+
+        width = self.size[0]
+        out = "0" * (self.x0 * bpp) + gathered + "0" * ((width - self.x1) * bpp)
+        out += "0" * (-len(out) % 8)
+        return int(out, 2).to_bytes(len(out) // 8, "big")
+
+    def bbox(self, planes=None, bpp=1):
+        """Source content box, mapped onto the target"""
+        width, height = self.size
+        if planes is None and self.background != b"\xff\xff\xff":
+            return (0, 0, width, height)
+
+        box = self.source.bbox(planes, bpp)
+        if box is None:
+            return None
+
+        # One extra pixel around the box for interpolation
+        ox, oy = self.offset
+        scale = self.scale
+        x0 = max(self.x0, int(box[0] * scale) + ox - 1)
+        x1 = min(self.x1, math.ceil(box[2] * scale) + ox + 1)
+        y0 = max(0, oy, int(box[1] * scale) + oy - 1)
+        y1 = min(height, oy + self.scaled[1], math.ceil(box[3] * scale) + oy + 1)
+        if x0 >= x1 or y0 >= y1:
+            return None
+        return (x0, y0, x1, y1)
+
+    def digest(self, planes=None, bpp=1, parallel=False) -> bytes:
+        """Content hash, derived from the source's digest"""
+        h = hashlib.blake2b(digest_size=16)
+        h.update(self.source.digest(planes=planes, bpp=bpp, parallel=parallel))
+        h.update(struct.pack("<LL", self.size[0], self.size[1]))
+        h.update(repr((self.method, self.mode, self.background)).encode())
+        return h.digest()
+
+
+def fit(source: Image, size=(0, 0), method=BILINEAR, mode=FIT):
+    """Resample source to size, unless it already has exactly that size"""
+    if tuple(source.size) == tuple(size):
+        return source
+    return Resample(source, size=size, method=method, mode=mode)
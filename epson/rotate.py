@@ -0,0 +1,293 @@
+#
+#  Copyright (C) 2016, Jason S. McMullan <jason.mcmullan@gmail.com>
+#  All rights reserved.
+#
+#  Licensed under the MIT License:
+#
+#  Permission is hereby granted, free of charge, to any person obtaining
+#  a copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import mmap
+import contextlib
+import struct
+import hashlib
+import tempfile
+from typing import Optional
+
+from epson.constant import *
+from epson.raster import Image
+from epson.resample import _interleave
+
+CLOCKWISE = "clockwise"
+COUNTERCLOCKWISE = "counterclockwise"
+
+MEMORY = "memory"
+"""Stage the source in a bytearray."""
+
+MMAP = "mmap"
+"""Stage the source in a memory mapped temporary file."""
+
+
+class Rotate(Image):
+    """Image adapter that turns a source by 90 degrees
+
+    Each output row is a source column. Output rows are produced a band at
+    a time: the pixels of 'band' source columns are gathered into one
+    block, and every row of the band is cut out of it with extended slices.
+    Only the current band is kept, so rows can be sent as soon as their
+    band is transposed; they should be requested in increasing order, as
+    print_pages() does.
+
+    By default the block of each band is read with source.linespan(),
+    which suits sources with cheap random row access such as PNMImage.
+    With 'scratch' set, the source is instead read once, row by row, into
+    a scratch buffer laid out band after band.
+    """
+
+    def __init__(self, source: Image, direction=CLOCKWISE, band=64, scratch=None):
+        """
+        @param source    : Source Image
+        @param direction : CLOCKWISE or COUNTERCLOCKWISE
+        @param band      : Source columns per band
+        @param scratch   : None, MEMORY or MMAP
+        """
+        sw, sh = source.size
+        super(Rotate, self).__init__(size=(sh, sw))
+        if direction not in (CLOCKWISE, COUNTERCLOCKWISE):
+            raise ValueError(f"Unknown rotation '{direction}'.")
+        if scratch not in (None, MEMORY, MMAP):
+            raise ValueError(f"Unknown scratch space '{scratch}'.")
+
+        self.source = source
+        self.direction = direction
+        self.band = max(1, band)
+        self.scratch = scratch
+
+        self._blank = b"\xff\xff\xff" * sw
+        self._file = None
+        self._buffer = None
+        self._rows = {}
+        self._bits = {}
+        self._bits_band = None
+
+    def close(self):
+        """Release the scratch buffer and the cached rows"""
+        if isinstance(self._buffer, mmap.mmap):
+            self._buffer.close()
+        if self._file is not None:
+            self._file.close()
+        self._file = None
+        self._buffer = None
+        self._rows = {}
+        self._bits = {}
+        self._bits_band = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _column(self, y):
+        """Source column of output row y"""
+        if self.direction == CLOCKWISE:
+            return y
+        return self.source.size[0] - 1 - y
+
+    def _span(self, sy, x0, x1):
+        line = self.source.linespan(sy, x0, x1)
+        if not line:
+            return self._blank[x0 * 3 : x1 * 3]
+        return line
+
+    def _stage(self):
+        """Copy the source, row by row, into band-major scratch space"""
+        sw, sh = self.source.size
+        size = sw * sh * 3
+        if self.scratch == MMAP:
+            self._file = tempfile.TemporaryFile()
+            self._file.truncate(max(1, size))
+            self._buffer = mmap.mmap(self._file.fileno(), max(1, size))
+        else:
+            self._buffer = bytearray(size)
+
+        band = self.band
+        buffer = self._buffer
+        for sy in range(sh):
+            line = self.source.line(sy)
+            if not line:
+                line = self._blank
+            for x0 in range(0, sw, band):
+                x1 = min(sw, x0 + band)
+                offset = (x0 * sh + sy * (x1 - x0)) * 3
+                buffer[offset : offset + (x1 - x0) * 3] = line[x0 * 3 : x1 * 3]
+
+    def _block(self, x0, x1):
+        """Pixels of source columns x0..x1 of every source row, row by row"""
+        sh = self.source.size[1]
+        if self.scratch is None:
+            return b"".join(self._span(sy, x0, x1) for sy in range(sh))
+
+        if self._buffer is None:
+            self._stage()
+        offset = x0 * sh * 3
+        return bytes(self._buffer[offset : offset + (x1 - x0) * sh * 3])
+
+    def _band_rows(self, x0):
+        """Output rows of the band starting at source column x0"""
+        rows = self._rows.get(x0)
+        if rows is None:
+            x1 = min(self.source.size[0], x0 + self.band)
+            block = self._block(x0, x1)
+            stride = (x1 - x0) * 3
+            step = -1 if self.direction == CLOCKWISE else 1
+            rows = [
+                _interleave([block[x * 3 + c :: stride][::step] for c in range(3)])
+                for x in range(x1 - x0)
+            ]
+            self._rows = {x0: rows}
+        return rows
+
+    def line(self, y=0):
+        """Retrieve a RGB 24-bit line of the rotated image"""
+        sx = self._column(y)
+        x0 = sx - sx % self.band
+        return self._band_rows(x0)[sx - x0]
+
+    def bands(self):
+        """Yield (y, rows) for each band of output rows, top to bottom"""
+        y = 0
+        height = self.size[1]
+        while y < height:
+            sx = self._column(y)
+            x0 = sx - sx % self.band
+            rows = self._band_rows(x0)
+            if self.direction == CLOCKWISE:
+                rows = rows[sx - x0 :]
+            else:
+                rows = rows[sx - x0 :: -1]
+            yield (y, rows)
+            y += len(rows)
+
+    def bitline(self, y=0, ci=CI.BLACK, bpp=1) -> Optional[bytes]:
+        """Retrieve a bitmap line of the rotated image in a single color"""
+        sx = self._column(y)
+        x0 = sx - sx % self.band
+        if x0 != self._bits_band:
+            # Keep the rows of every plane of the current band only
+            self._bits = {}
+            self._bits_band = x0
+        key = (ci, bpp)
+        rows = self._bits.get(key)
+        if rows is None:
+            rows = self._bit_band(x0, ci, bpp)
+            self._bits[key] = rows
+        return rows[sx - x0]
+
+    def _bit_band(self, x0, ci, bpp):
+        """Bitmap rows of the band starting at source column x0"""
+        sw, sh = self.source.size
+        x1 = min(sw, x0 + self.band)
+        width = (x1 - x0) * bpp
+        blank = "0" * width
+
+        # Bit strings of the band's columns, source row by source row
+        segments = []
+        for sy in range(sh):
+            line = self.source.bitline(y=sy, ci=ci, bpp=bpp)
+            if not line:
+                segments.append(blank)
+                continue
+            bits = format(int.from_bytes(line, "big"), "0%db" % (len(line) * 8))
+            segments.append(bits[x0 * bpp : x0 * bpp + width])
+        block = "".join(segments)
+
+        step = -1 if self.direction == CLOCKWISE else 1
+        pad = -sh * bpp % 8
+        rows = []
+        for x in range(x1 - x0):
+            planes = [block[x * bpp + b :: width][::step] for b in range(bpp)]
+            if bpp == 1:
+                bits = planes[0]
+            else:
+                bits = "".join(map("".join, zip(*planes)))
+            if "1" not in bits:
+                rows.append(None)
+                continue
+            value = int(bits, 2) << pad
+            rows.append(value.to_bytes((sh * bpp + pad) // 8, "big"))
+        return rows
+
+    def bbox(self, planes=None, bpp=1):
+        """Source content box, turned with the image"""
+        box = self.source.bbox(planes, bpp)
+        if box is None:
+            return None
+        sw, sh = self.source.size
+        x0, y0, x1, y1 = box
+        if self.direction == CLOCKWISE:
+            return (sh - y1, x0, sh - y0, x1)
+        return (y0, sw - x1, y1, sw - x0)
+
+    def digest(self, planes=None, bpp=1, parallel=False) -> bytes:
+        """Content hash, derived from the source's digest"""
+        h = hashlib.blake2b(digest_size=16)
+        h.update(self.source.digest(planes=planes, bpp=bpp, parallel=parallel))
+        h.update(struct.pack("<LL", self.size[0], self.size[1]))
+        h.update(self.direction.encode())
+        return h.digest()
+
+
+# Larger sources are staged in a memory mapped file
+MmapThreshold = 64 << 20
+
+
+def orient(source: Image, size=(0, 0), direction=CLOCKWISE):
+    """Rotate source when its orientation does not match size's
+
+    A portrait source on a landscape page (or the reverse) is turned by 90
+    degrees; square sizes and matching orientations are left alone.
+    """
+    sw, sh = source.size
+    if (sw > sh and size[0] < size[1]) or (sw < sh and size[0] > size[1]):
+        scratch = MMAP if sw * sh * 3 > MmapThreshold else MEMORY
+        return Rotate(source, direction, scratch=scratch)
+    return source
+
+
+@contextlib.contextmanager
+def oriented(source: Image, size=(0, 0), direction=CLOCKWISE):
+    """orient() for the duration of a block, releasing its scratch space
+
+    With no direction the source is used as it is.
+    """
+    if direction is None:
+        yield source
+        return
+
+    image = orient(source, size, direction)
+    try:
+        yield image
+    finally:
+        if image is not source:
+            image.close()
@@ -0,0 +1,247 @@
+#
+#  Copyright (C) 2016, Jason S. McMullan <jason.mcmullan@gmail.com>
+#  All rights reserved.
+#
+#  Licensed under the MIT License:
+#
+#  Permission is hereby granted, free of charge, to any person obtaining
+#  a copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import time
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import wait as wait_for
+
+import epson.io
+
+
+def render(job_class, rasters, settings=None, **kwargs):
+    """Encode a complete job into bytes
+
+    This is a module-level function so that it can run in a
+    ProcessPoolExecutor; JobSettings and the job class pickle cleanly.
+    """
+    io = epson.io.Memory()
+    job = job_class(io=io, settings=settings)
+    job.print_pages(rasters=rasters, **kwargs)
+    return io.getvalue()
+
+
+class Printer(object):
+    """One printer of a fleet, with its own send queue and thread"""
+
+    def __init__(self, scheduler, transport, name=None):
+        """
+        @param scheduler : Owning Scheduler
+        @param transport : Callable returning a new, unopened transport
+        @param name      : Name used in results and errors
+        """
+        self.scheduler = scheduler
+        self.transport = transport
+        self.name = name
+
+        # Bytes and jobs queued or being sent
+        self.pending = 0
+        self.jobs = 0
+        # Exponentially weighted send rate, in bytes per second
+        self.throughput = None
+        # Do not schedule onto this printer before this time
+        self.down_until = 0.0
+
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def available(self, now):
+        return now >= self.down_until
+
+    def backlog(self, size=0):
+        """Estimated time to drain the queue plus 'size' more bytes"""
+        if self.throughput:
+            return (self.pending + size) / self.throughput
+        # No measurement yet; prefer the shortest queue
+        return float(self.jobs)
+
+    def enqueue(self, work):
+        self.pending += len(work.data)
+        self.jobs += 1
+        self.queue.put(work)
+
+    def _run(self):
+        while True:
+            work = self.queue.get()
+            if work is None:
+                break
+
+            try:
+                elapsed = self._send(work.data)
+            except OSError as e:
+                self._done(work)
+                self.down_until = time.monotonic() + self.scheduler.cooldown
+                self.scheduler._failed(self, work, e)
+                continue
+            except Exception as e:
+                # Not a connection problem: fail the job, keep the printer
+                self._done(work)
+                work.future.set_exception(e)
+                continue
+
+            self._done(work)
+            if elapsed > 0:
+                rate = len(work.data) / elapsed
+                if self.throughput is None:
+                    self.throughput = rate
+                else:
+                    self.throughput += 0.25 * (rate - self.throughput)
+            work.future.set_result(self.name)
+
+    def _done(self, work):
+        with self.scheduler.lock:
+            self.pending -= len(work.data)
+            self.jobs -= 1
+
+    def _send(self, data):
+        chunk = self.scheduler.chunk
+        view = memoryview(data)
+        io = self.transport()
+        start = time.monotonic()
+        io.open()
+        try:
+            for offset in range(0, len(view), chunk):
+                io.send(view[offset : offset + chunk])
+        finally:
+            io.close()
+        return time.monotonic() - start
+
+
+class _Work(object):
+    __slots__ = ("data", "future", "tried")
+
+    def __init__(self, data, future):
+        self.data = data
+        self.future = future
+        self.tried = set()
+
+
+class Scheduler(object):
+    """Spread print jobs across a fleet of identical printers
+
+    Jobs are encoded ahead of time on an executor while the printers are
+    busy, then queued on the printer expected to finish soonest (queued
+    bytes over measured throughput, or queue depth until a throughput has
+    been measured). A job whose connection fails is retried on another
+    printer; the failed printer is skipped for 'cooldown' seconds.
+    """
+
+    def __init__(self, transports, encoder=None, cooldown=30.0, chunk=1 << 20):
+        """
+        @param transports : Callables returning a new transport per job,
+                            e.g. lambda: epson.io.Network("printer1")
+        @param encoder    : concurrent.futures.Executor for encoding
+        @param cooldown   : Seconds to avoid a printer after a failure
+        @param chunk      : Bytes per transport send
+        """
+        self.cooldown = cooldown
+        self.chunk = chunk
+        self.lock = threading.Lock()
+
+        self._own_encoder = encoder is None
+        if encoder is None:
+            encoder = ThreadPoolExecutor(max_workers=1)
+        self.encoder = encoder
+
+        # Futures of jobs not yet sent
+        self.outstanding = set()
+
+        self.printers = [
+            Printer(self, transport, name=n) for n, transport in enumerate(transports)
+        ]
+
+    def submit(self, job_class, rasters, settings=None, **kwargs):
+        """Queue a job; the returned Future yields the printer's name"""
+        future = self._future()
+        encoded = self.encoder.submit(
+            render, job_class, rasters, settings=settings, **kwargs
+        )
+        encoded.add_done_callback(lambda done: self._encoded(done, future))
+        return future
+
+    def submit_data(self, data):
+        """Queue an already encoded job"""
+        future = self._future()
+        self._dispatch(_Work(bytes(data), future))
+        return future
+
+    def _future(self):
+        future = Future()
+        with self.lock:
+            self.outstanding.add(future)
+        future.add_done_callback(self._finished)
+        return future
+
+    def _finished(self, future):
+        with self.lock:
+            self.outstanding.discard(future)
+
+    def _encoded(self, done, future):
+        try:
+            data = done.result()
+        except Exception as e:
+            future.set_exception(e)
+            return
+        self._dispatch(_Work(data, future))
+
+    def _dispatch(self, work, error=None):
+        now = time.monotonic()
+        with self.lock:
+            candidates = [p for p in self.printers if p.name not in work.tried]
+            printer = None
+            if candidates:
+                up = [p for p in candidates if p.available(now)]
+                if up:
+                    candidates = up
+                printer = min(candidates, key=lambda p: p.backlog(len(work.data)))
+                work.tried.add(printer.name)
+                printer.enqueue(work)
+
+        if printer is None:
+            work.future.set_exception(error or ConnectionError("No printer available"))
+
+    def _failed(self, printer, work, error):
+        self._dispatch(work, error)
+
+    def close(self, wait=True):
+        """Stop accepting jobs; optionally wait for queued jobs to be sent"""
+        if self._own_encoder:
+            self.encoder.shutdown(wait=wait)
+        if wait:
+            # Retries may still move jobs between printers until all are sent
+            with self.lock:
+                outstanding = list(self.outstanding)
+            wait_for(outstanding)
+        for printer in self.printers:
+            printer.queue.put(None)
+        if wait:
+            for printer in self.printers:
+                printer.thread.join()
@@ -0,0 +1,262 @@
+#
+#  Copyright (C) 2016, Jason S. McMullan <jason.mcmullan@gmail.com>
+#  All rights reserved.
+#
+#  Licensed under the MIT License:
+#
+#  Permission is hereby granted, free of charge, to any person obtaining
+#  a copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import math
+import dataclasses
+import functools
+from dataclasses import dataclass, field
+from typing import Optional
+
+from epson.constant import *
+from epson.color import Profile
+
+CDDVD = (MTID.CDDVD, MTID.CDDVDHIGH, MTID.CDDVDGLOSSY)
+
+
+def raster_resolution(dpi=360):
+    """ESC/P-R resolution code and effective resolution for a DPI"""
+    if dpi == 720:
+        return (1, 720)
+    elif dpi == 300:
+        return (2, 300)
+    elif dpi == 600:
+        return (3, 600)
+    return (0, 360)
+
+
+@functools.lru_cache(maxsize=256)
+def raster_geometry(
+    paper=MSID.LETTER, mlid=MLID.BORDERLESS, margin=(0, 0, 0, 0), dpi=360
+):
+    """ESC/P-R page geometry in dots
+
+    Returns (paper_size, margins, printable_size, ir) where paper_size and
+    printable_size are (width, height) and margins are
+    (left, top, right, bottom).
+    """
+    ir, dpi = raster_resolution(dpi)
+
+    if mlid == MLID.BORDERLESS:
+        margin = (0, 0, 0, 0)
+
+    mm2in = 1.0 / 25.4
+    paperWidth = math.ceil(paper[0] * mm2in * dpi)
+    paperHeight = math.ceil(paper[1] * mm2in * dpi)
+    marginLeft = math.floor(margin[0] * mm2in * dpi)
+    marginTop = math.floor(margin[1] * mm2in * dpi)
+    marginRight = math.floor(margin[2] * mm2in * dpi)
+    marginBottom = math.floor(margin[3] * mm2in * dpi)
+    printableWidth = paperWidth - marginLeft - marginRight
+    printableHeight = paperHeight - marginTop - marginBottom
+
+    return (
+        (paperWidth, paperHeight),
+        (marginLeft, marginTop, marginRight, marginBottom),
+        (printableWidth, printableHeight),
+        ir,
+    )
+
+
+def cd_dimensions(cddim_id=None, cddim_od=None):
+    """CD label inner and outer diameters in mm, defaulted and clamped"""
+    if cddim_id is None:
+        cddim_id = 43
+    if cddim_od is None:
+        cddim_od = 116
+    return (clamp(18, cddim_id, 46), clamp(114, cddim_od, 120))
+
+
+@functools.lru_cache(maxsize=64)
+def cd_label_spans(paper_size, margins, dpi=360, cddim_id=None, cddim_od=None):
+    """Printable spans of each row of a CD label, in dots
+
+    The label is a ring centred on the paper. Returns a tuple with, for
+    each row of the printable area, a tuple of (x0, x1) spans in printable
+    coordinates: none outside the ring, two where the row crosses the hub.
+    Pixels partially inside the ring are included.
+    """
+    dpi = raster_resolution(dpi)[1]
+    inner, outer = cd_dimensions(cddim_id, cddim_od)
+    inner = inner / 25.4 * dpi / 2
+    outer = outer / 25.4 * dpi / 2
+
+    left, top, right, bottom = margins
+    width = paper_size[0] - left - right
+    height = paper_size[1] - top - bottom
+    cx = paper_size[0] / 2 - left
+    cy = paper_size[1] / 2 - top
+
+    rows = []
+    for y in range(height):
+        dy = abs(y + 0.5 - cy)
+        near, far = max(0.0, dy - 0.5), dy + 0.5
+        if near >= outer:
+            rows.append(())
+            continue
+        half = math.sqrt(outer * outer - near * near)
+        x0 = max(0, math.floor(cx - half))
+        x1 = min(width, math.ceil(cx + half))
+        if far < inner:
+            # The pixels entirely inside the hole are skipped
+            hole = math.sqrt(inner * inner - far * far)
+            h0, h1 = math.ceil(cx - hole), math.floor(cx + hole)
+            if h0 < h1:
+                spans = ((x0, min(x1, h0)), (max(x0, h1), x1))
+                rows.append(tuple(span for span in spans if span[0] < span[1]))
+                continue
+        rows.append(((x0, x1),) if x0 < x1 else ())
+    return tuple(rows)
+
+
+@dataclass(frozen=True, slots=True)
+class JobSettings:
+    """Immutable, hashable print job settings
+
+    Derived geometry (ESC/P-R resolution code, paper, margin and printable
+    sizes in dots) is computed once at construction. Use replace() to derive
+    modified settings.
+
+    CD/DVD media types force the CD tray paper path and CD label layout.
+    """
+
+    # Job name
+    name: str = "ESCPRLib"
+
+    # Output selection
+    dpi: int = 360
+    pd: PD = PD.BIDIREC
+
+    # Paper path
+    mpid: MPID = MPID.REAR
+    duplex: bool = False
+
+    # JPEG auto photo fix
+    act: ACT = ACT.NOTHING
+    sharpness: int = 0
+    rde: RDE = RDE.NOTHING
+
+    # Quality settings
+    mqid: MQID = MQID.HIGH
+    cm: CM = CM.COLOR
+    brightness: int = 0
+    contrast: int = 0
+    saturation: int = 0
+    cp: CP = CP.FULLCOLOR
+    palette: Optional[bytes] = None
+
+    # Size parameters
+    mtid: MTID = MTID.PLAIN
+    msid: MSID = MSID.LETTER
+    mlid: MLID = MLID.BORDERS
+    margin: tuple = (3, 3, 3, 3)  # 3mm borders
+
+    # CD Label size
+    cddim_id: Optional[int] = None
+    cddim_od: Optional[int] = None
+
+    # Resample rasters that do not match the printable size
+    # (see epson.resample): method, or None to crop, and fitting mode
+    resample: Optional[str] = None
+    fit: str = "fit"
+
+    # Turn rasters whose orientation does not match the page's, such as
+    # portrait sources on _L media (see epson.rotate): direction, or None
+    rotate: Optional[str] = None
+
+    # Impose several pages per sheet (see epson.impose): (columns, rows),
+    # or None; MLID.DIVIDE16 imposes 16-up
+    nup: Optional[tuple] = None
+
+    # Only send the content of each page: skip blank rows and the blank
+    # margins of each row, within the rasters' bbox().  Off by default, as
+    # it changes the command stream; the printed page is the same
+    crop: bool = False
+
+    # With CM.MONOCHROME, convert pages to gray on the host: Rec. 601 luma
+    # for ESC/P-R, the black plane only for ESC/P. Off by default, as
+    # colour content then prints in different tones than the printer's
+    # own conversion
+    host_gray: bool = False
+
+    # Host-side colour correction of RGB rasters (see epson.color)
+    color_profile: Optional[Profile] = None
+
+    # Derived geometry, in dots
+    ir: int = field(init=False, repr=False, compare=False)
+    paper_size: tuple = field(init=False, repr=False, compare=False)
+    margins: tuple = field(init=False, repr=False, compare=False)
+    printable_size: tuple = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        assign = functools.partial(object.__setattr__, self)
+
+        assign("margin", tuple(self.margin))
+        if self.nup is not None:
+            assign("nup", tuple(self.nup))
+        if self.palette is not None:
+            assign("palette", bytes(self.palette))
+
+        if self.mtid in CDDVD:
+            assign("mpid", MPID.CDTRAY)
+            assign("mlid", MLID.CDLABEL)
+
+        paper, margins, printable, ir = raster_geometry(
+            self.msid, self.mlid, self.margin, self.dpi
+        )
+        assign("ir", ir)
+        assign("paper_size", paper)
+        assign("margins", margins)
+        assign("printable_size", printable)
+
+    def replace(self, **changes):
+        """Return a copy with the given settings changed"""
+        return dataclasses.replace(self, **changes)
+
+
+def settings_properties(cls):
+    """Class decorator exposing each JobSettings field as a job attribute
+
+    Reading job.dpi returns job.settings.dpi; assigning job.dpi = 720
+    replaces job.settings with an updated copy.
+    """
+
+    def make(name):
+        def get(self):
+            return getattr(self.settings, name)
+
+        def set(self, value):
+            self.settings = self.settings.replace(**{name: value})
+
+        return property(get, set)
+
+    for item in dataclasses.fields(JobSettings):
+        if item.init:
+            setattr(cls, item.name, make(item.name))
+
+    return cls
@@ -0,0 +1,187 @@
+#
+#  Copyright (C) 2016, Jason S. McMullan <jason.mcmullan@gmail.com>
+#  All rights reserved.
+#
+#  Licensed under the MIT License:
+#
+#  Permission is hereby granted, free of charge, to any person obtaining
+#  a copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import resource
+import threading
+
+perf_counter = time.perf_counter
+process_time = time.process_time
+
+
+def rss():
+    """Current resident set size of this process, in bytes"""
+    try:
+        with open("/proc/self/statm") as fin:
+            return int(fin.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # No /proc: fall back on the peak so far
+        usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return usage if sys.platform == "darwin" else usage * 1024
+
+
+class Sampler(object):
+    """Track the peak RSS of this process while a block runs"""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak = rss()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, rss())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, rss())
+
+
+class Stats(object):
+    """Per-stage timing and byte counters for a print job
+
+    Attach an instance to a job (job.stats = Stats()) before calling
+    print_pages(). When no Stats object is attached the jobs skip all
+    instrumentation, so the disabled cost is one attribute test per call.
+
+    Stages are timed exclusively: time spent in a nested stage (for example
+    'send' inside 'frame') is only accounted to the nested stage.
+
+    Stages:
+        raster : fetching lines from the Image (line() or bitline())
+        encode : run-length compression
+        frame  : building command headers and buffers
+        send   : the transport's send()
+    """
+
+    STAGES = ("raster", "encode", "frame", "send")
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.wall = dict.fromkeys(self.STAGES, 0.0)
+        self.cpu = dict.fromkeys(self.STAGES, 0.0)
+        self.calls = dict.fromkeys(self.STAGES, 0)
+
+        # Raw raster bytes handed to the encoder
+        self.bytes_in = 0
+        # Raster payload bytes after compression
+        self.bytes_encoded = 0
+        # Bytes handed to the transport
+        self.bytes_out = 0
+        # Number of transport send() calls
+        self.commands = 0
+
+        # Per page: {"bytes_in", "bytes_encoded", "ratio"}
+        self.pages = []
+
+        self._page_in = 0
+        self._page_encoded = 0
+        self._stack = []
+
+    def enter(self, stage):
+        """Start timing a stage"""
+        self._stack.append([stage, perf_counter(), process_time(), 0.0, 0.0])
+
+    def leave(self):
+        """Stop timing the innermost stage"""
+        stage, wall0, cpu0, child_wall, child_cpu = self._stack.pop()
+        wall = perf_counter() - wall0
+        cpu = process_time() - cpu0
+        self.wall[stage] = self.wall.get(stage, 0.0) + wall - child_wall
+        self.cpu[stage] = self.cpu.get(stage, 0.0) + cpu - child_cpu
+        self.calls[stage] = self.calls.get(stage, 0) + 1
+        if self._stack:
+            parent = self._stack[-1]
+            parent[3] += wall
+            parent[4] += cpu
+
+    def encoded(self, bytes_in, bytes_out):
+        """Account raster bytes before and after compression"""
+        self._page_in += bytes_in
+        self._page_encoded += bytes_out
+
+    def sent(self, count):
+        """Account one transport send() of count bytes"""
+        self.bytes_out += count
+        self.commands += 1
+
+    def page_start(self):
+        self._page_in = 0
+        self._page_encoded = 0
+
+    def page_end(self):
+        self.bytes_in += self._page_in
+        self.bytes_encoded += self._page_encoded
+        self.pages.append(
+            {
+                "bytes_in": self._page_in,
+                "bytes_encoded": self._page_encoded,
+                "ratio": _ratio(self._page_in, self._page_encoded),
+            }
+        )
+        self._page_in = 0
+        self._page_encoded = 0
+
+    @property
+    def ratio(self):
+        """Overall compression ratio (raw / encoded)"""
+        return _ratio(self.bytes_in, self.bytes_encoded)
+
+    def as_dict(self):
+        return {
+            "wall": dict(self.wall),
+            "cpu": dict(self.cpu),
+            "calls": dict(self.calls),
+            "bytes_in": self.bytes_in,
+            "bytes_encoded": self.bytes_encoded,
+            "bytes_out": self.bytes_out,
+            "commands": self.commands,
+            "ratio": self.ratio,
+            "pages": [dict(page) for page in self.pages],
+        }
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.as_dict(), **kwargs)
+
+
+def _ratio(raw, encoded):
+    if encoded == 0:
+        return None
+    return raw / encoded
@@ -0,0 +1,343 @@
+#
+#  Copyright (C) 2016, Jason S. McMullan <jason.mcmullan@gmail.com>
+#  All rights reserved.
+#
+#  Licensed under the MIT License:
+#
+#  Permission is hereby granted, free of charge, to any person obtaining
+#  a copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import time
+import struct
+
+import epson.io
+from epson import command
+
+# REMOTE1 'st' status request, framed so it can be sent between commands
+QUERY = command.remote1_mode(command.remote1(b"st", response=1))
+
+# Header of a status reply
+ST2 = b"@BDC ST2\r\n"
+
+# Printer states (ST2 field 0x01)
+STATES = {
+    0x00: "error",
+    0x01: "self-printing",
+    0x02: "busy",
+    0x03: "waiting",
+    0x04: "idle",
+    0x05: "paused",
+    0x07: "cleaning",
+    0x08: "factory",
+    0x0A: "shutdown",
+}
+
+# ST2 fields
+FIELD_STATE = 0x01
+FIELD_ERROR = 0x02
+FIELD_INK = 0x0F
+
+
+class Status(object):
+    """Decoded ST2 status reply"""
+
+    def __init__(self, fields=None):
+        """
+        @param fields : Raw ST2 fields, by field type
+        """
+        if fields is None:
+            fields = {}
+        self.fields = fields
+        self.time = time.monotonic()
+
+        state = fields.get(FIELD_STATE, b"")
+        self.code = state[0] if state else None
+        self.state = STATES.get(self.code, "unknown")
+
+        error = fields.get(FIELD_ERROR, b"")
+        self.error = error[0] if error else None
+
+        # Ink level (percent), by colour code
+        self.ink = {}
+        ink = fields.get(FIELD_INK, b"")
+        if ink:
+            size = ink[0]
+            for pos in range(1, len(ink) - size + 1, size):
+                self.ink[ink[pos + 1]] = ink[pos + size - 1]
+
+    @property
+    def failed(self):
+        return self.code == 0x00 or self.error is not None
+
+    @property
+    def busy(self):
+        """Printer cannot currently take data at full speed"""
+        return self.state in ("busy", "self-printing", "cleaning", "paused")
+
+    @property
+    def ready(self):
+        """Printer is waiting for data"""
+        return self.state in ("waiting", "idle")
+
+    def __repr__(self):
+        return f"Status(state={self.state!r}, error={self.error!r}, ink={self.ink!r})"
+
+
+def parse_st2(data):
+    """Parse the body (after the header and length) of an ST2 reply"""
+    fields = {}
+    pos = 0
+    while pos + 2 <= len(data):
+        kind, size = data[pos], data[pos + 1]
+        fields[kind] = bytes(data[pos + 2 : pos + 2 + size])
+        pos += 2 + size
+    return Status(fields)
+
+
+def encode_st2(fields):
+    """Encode an ST2 reply from raw fields (for emulators and tests)"""
+    body = b"".join(
+        struct.pack("BB", kind, len(value)) + value for kind, value in fields.items()
+    )
+    return ST2 + struct.pack("<H", len(body)) + body
+
+
+class StatusReader(object):
+    """Incremental parser of status replies in a back-channel byte stream
+
+    Bytes are fed as they arrive; replies split across reads are kept until
+    complete, and unrelated bytes are skipped.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        """Add received bytes; return the list of completed Status replies"""
+        if data:
+            self.buffer += data
+
+        replies = []
+        buffer = self.buffer
+        while True:
+            start = buffer.find(ST2)
+            if start < 0:
+                # Keep a possible partial header
+                del buffer[: max(0, len(buffer) - len(ST2) + 1)]
+                break
+
+            head = start + len(ST2)
+            if len(buffer) < head + 2:
+                del buffer[:start]
+                break
+
+            (size,) = struct.unpack_from("<H", buffer, head)
+            if len(buffer) < head + 2 + size:
+                del buffer[:start]
+                break
+
+            replies.append(parse_st2(buffer[head + 2 : head + 2 + size]))
+            del buffer[: head + 2 + size]
+
+        return replies
+
+
+class StatusMonitor(object):
+    """Poll a transport for printer status, without blocking the data path"""
+
+    def __init__(self, io: epson.io.Io, interval=1.0):
+        """
+        @param io       : Transport with a back-channel (see epson.io)
+        @param interval : Minimum seconds between two status queries
+        """
+        self.io = io
+        self.interval = interval
+        self.reader = StatusReader()
+
+        # Latest Status, and when the last query was sent
+        self.status = None
+        self.queried = None
+        self.replies = 0
+
+    def query(self):
+        """Send a status request; call only between two commands"""
+        self.io.send(QUERY)
+        self.queried = time.monotonic()
+
+    def poll(self, query=False, timeout=0.0):
+        """Read pending replies, optionally querying when the interval has passed
+
+        Returns the latest Status (or None).
+        """
+        now = time.monotonic()
+        if query and (self.queried is None or now - self.queried >= self.interval):
+            self.query()
+
+        while True:
+            data = self.io.recv(timeout=timeout)
+            if not data:
+                break
+            for status in self.reader.feed(data):
+                self.status = status
+                self.replies += 1
+            timeout = 0.0
+
+        return self.status
+
+    def wait(self, timeout=5.0, query=True):
+        """Query and wait up to 'timeout' seconds for a reply
+
+        Without 'query', only wait for a reply the printer sends by itself.
+        """
+        replies = self.replies
+        if query:
+            self.query()
+        deadline = time.monotonic() + timeout
+        while self.replies == replies:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                return None
+            self.poll(timeout=min(left, 0.1))
+        return self.status
+
+
+class FlowControl(epson.io.Io):
+    """Transport wrapper pacing the data sent to match the printer
+
+    Data is sent in chunks at a target rate. The rate grows additively
+    while the printer keeps up and is cut multiplicatively (AIMD) when it
+    reports being busy, or when the transport blocks for much longer than
+    the chunk should take. The sender pauses while the printer reports an
+    error, and raises after 'error_timeout' seconds.
+
+    Status replies are read from 'status_io', by default the transport
+    itself. Queries are REMOTE1 commands, which printers do not accept in
+    the middle of an ESC/P-R job: only enable 'query' when 'status_io' is
+    a separate control channel (see epson.d4); otherwise replies are only
+    read as they arrive.
+    """
+
+    def __init__(
+        self,
+        io: epson.io.Io,
+        rate=1 << 20,
+        min_rate=16 << 10,
+        max_rate=64 << 20,
+        chunk=64 << 10,
+        interval=1.0,
+        query=False,
+        error_timeout=300.0,
+        status_io=None,
+    ):
+        """
+        @param io            : Underlying transport (see epson.io)
+        @param rate          : Initial rate, in bytes per second
+        @param min_rate      : Lowest rate
+        @param max_rate      : Highest rate
+        @param chunk         : Bytes sent between two status polls
+        @param interval      : Minimum seconds between two status queries
+        @param query         : Send status queries (else only read replies)
+        @param error_timeout : Seconds to wait for a printer error to clear
+        @param status_io     : Transport of the status channel
+        """
+        self.io = io
+        self.rate = float(rate)
+        self.min_rate = float(min_rate)
+        self.max_rate = float(max_rate)
+        self.chunk = chunk
+        self.query = query
+        self.error_timeout = error_timeout
+        if status_io is None:
+            status_io = io
+        self.monitor = StatusMonitor(status_io, interval=interval)
+
+        # Additive increase per chunk, and multiplicative decrease
+        self.increase = float(chunk)
+        self.decrease = 0.5
+
+        self.sent = 0
+        self.stalls = 0
+        self._next = None
+
+    def open(self):
+        self.io.open()
+
+    def close(self):
+        self.io.close()
+
+    def recv(self, expected=None, timeout=0.0):
+        return self.io.recv(expected=expected, timeout=timeout)
+
+    def _backoff(self):
+        self.rate = max(self.min_rate, self.rate * self.decrease)
+        self.stalls += 1
+
+    def _check(self, query):
+        status = self.monitor.poll(query=query and self.query)
+        if status is None:
+            return
+
+        if status.failed:
+            # Never inject a query into the data stream unless asked to
+            queries = self.query or self.monitor.io is not self.io
+            deadline = time.monotonic() + self.error_timeout
+            while status is not None and status.failed:
+                if time.monotonic() > deadline:
+                    raise Exception(f"Printer error {status.error} did not clear.")
+                status = self.monitor.wait(timeout=1.0, query=queries) or status
+                time.sleep(0.1)
+            self._next = None
+        elif status.busy:
+            self._backoff()
+            # Only react once to each reply
+            self.monitor.status = None
+        elif status.ready:
+            self.monitor.status = None
+
+    def send(self, data=None):
+        view = memoryview(data)
+        self._check(query=True)
+
+        for pos in range(0, len(view), self.chunk):
+            piece = view[pos : pos + self.chunk]
+
+            now = time.monotonic()
+            if self._next is not None and self._next > now:
+                time.sleep(self._next - now)
+                now = self._next
+
+            self.io.send(piece)
+            took = time.monotonic() - now
+            expected = len(piece) / self.rate
+
+            if took > 4 * expected + 0.05:
+                # The transport pushed back
+                self._backoff()
+            else:
+                self.rate = min(self.max_rate, self.rate + self.increase)
+
+            self._next = max(now + took, now + len(piece) / self.rate)
+            self.sent += len(piece)
+
+            if pos + self.chunk < len(view):
+                self._check(query=False)
@@ -0,0 +1,55 @@
+import os
+import threading
+
+from epson.cache import PageCache
+
+
+def test_disk_entries(tmp_path):
+    cache = PageCache(directory=str(tmp_path))
+    key = PageCache.key("page", 1)
+    cache.put(key, b"data")
+    cache.clear()
+    assert cache.get(key) == b"data"
+    assert cache.disk_hits == 1
+
+    # A new cache finds the entry on disk
+    assert PageCache(directory=str(tmp_path)).get(key) == b"data"
+
+
+def test_partial_files_are_not_entries(tmp_path):
+    PageCache(directory=str(tmp_path))
+    (tmp_path / "tmp" / "tmpabc123").write_bytes(b"partial")
+
+    cache = PageCache(directory=str(tmp_path))
+    assert cache.as_dict()["disk_entries"] == 0
+    assert os.listdir(tmp_path / "tmp") == []
+
+
+def test_concurrent_use(tmp_path):
+    cache = PageCache(max_entries=8, directory=str(tmp_path), disk_bytes=4000)
+    keys = [PageCache.key(n) for n in range(64)]
+
+    def work(seed):
+        for n in range(200):
+            key = keys[(seed * 7 + n) % len(keys)]
+            data = cache.get(key)
+            if data is None:
+                cache.put(key, key.encode() * 3)
+            else:
+                assert data == key.encode() * 3
+
+    threads = [threading.Thread(target=work, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    stats = cache.as_dict()
+    assert stats["disk_bytes"] <= 4000
+    files = [
+        name
+        for sub in os.listdir(tmp_path)
+        if sub != "tmp"
+        for name in os.listdir(tmp_path / sub)
+    ]
+    assert len(files) == stats["disk_entries"]
@@ -0,0 +1,18 @@
+import random
+
+import epson.color
+from epson.color import Lut3D
+
+
+def test_memo_budget_shared_by_tables(monkeypatch):
+    monkeypatch.setattr(epson.color, "MemoBudget", 1000)
+    luts = [Lut3D(lambda r, g, b, k=k: (r * k, g, b), points=5) for k in (1, 0.5)]
+    data = random.Random(0).randbytes(3 * 800)
+
+    first = [lut.apply(data) for lut in luts]
+    for lut in luts:
+        lut.apply(b"")
+    assert sum(len(lut._memo) for lut in luts) <= 1000
+
+    # Trimming only costs recomputation
+    assert [lut.apply(data) for lut in luts] == first
@@ -0,0 +1,25 @@
+import random
+
+from epson.constant import run_length_encode, run_length_encode_gray
+from epson.decode import rle_decode
+
+
+def gray_lines():
+    rnd = random.Random(0)
+    yield b""
+    yield b"\x00"
+    yield b"\xff" * 1000
+    yield bytes(range(256)) * 2
+    for _ in range(50):
+        line = bytearray()
+        while len(line) < 600:
+            line += bytes((rnd.randrange(4),)) * rnd.choice((1, 1, 2, 3, 130, 300))
+        yield bytes(line)
+
+
+def test_gray_decodes_to_expanded_pixels():
+    for line in gray_lines():
+        pixels = bytes(sample for sample in line for _ in range(3))
+        encoded = run_length_encode_gray(line, 3)
+        assert rle_decode(encoded, 3) == pixels
+        assert rle_decode(encoded, 3) == rle_decode(run_length_encode(pixels, 3), 3)
@@ -0,0 +1,32 @@
+import io
+
+import epson.escp
+import epson.escpr
+import epson.io
+import epson.raster
+from epson.decode import Decoder
+
+
+def decode_pages(job_class, crop, rasters):
+    memory = epson.io.Memory()
+    job = job_class(io=memory)
+    job.crop = crop
+    job.print_pages(rasters=rasters)
+    return list(Decoder(io.BytesIO(memory.getvalue())).pages())
+
+
+def test_cropped_pages_equal_full_pages():
+    size = (120, 100)
+    rasters = [
+        epson.raster.Pattern(size, kind="blank"),
+        epson.raster.TestImage(size=size),
+        epson.raster.Pattern(size, kind="blank"),
+    ]
+    for job_class in (epson.escpr.Job, epson.escp.Job):
+        full = decode_pages(job_class, False, rasters)
+        cropped = decode_pages(job_class, True, rasters)
+        assert len(full) == len(cropped) == 3
+        assert [page.number for page in cropped] == [1, 2, 3]
+        assert full == cropped
+        # Blank pages are not equal to printed ones
+        assert cropped[0] != cropped[1]
@@ -0,0 +1,18 @@
+import threading
+
+from epson.emulator import _Buffer
+
+
+def test_read_larger_than_capacity():
+    buffer = _Buffer(capacity=16)
+    data = bytes(range(100))
+
+    def produce():
+        for pos in range(0, len(data), 10):
+            buffer.put(data[pos : pos + 10])
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    assert buffer.read(100) == data
+    producer.join(timeout=5)
+    assert not producer.is_alive()
@@ -0,0 +1,56 @@
+import hashlib
+import io
+import time
+
+import pytest
+
+import epson.escp
+import epson.escpr
+import epson.io
+import epson.raster
+from epson.constant import CM
+from epson.decode import Decoder
+
+# Output of the encoders before page cropping was added, for the job below
+BASELINE = {
+    epson.escpr.Job: (136802, "0916fc57b2d894bf6650652812f5e4db"),
+    epson.escp.Job: (15726, "5d675a57c9033eda0b18520fb6435dce"),
+}
+
+
+@pytest.mark.parametrize("job_class", list(BASELINE))
+def test_default_output_is_unchanged(monkeypatch, job_class):
+    now = time.struct_time((2024, 1, 2, 3, 4, 5, 0, 1, 0))
+    monkeypatch.setattr(time, "localtime", lambda *args: now)
+
+    image = epson.raster.TestImage(size=(120, 90))
+    memory = epson.io.Memory()
+    job = job_class(io=memory)
+    assert not job.crop
+    job.print_pages(rasters=[image])
+    job.name = "other"
+    job.print_pages(rasters=[image, image])
+    job.name = "ESCPRLib"
+    job.dpi = 720
+    job.print_pages(rasters=[image])
+
+    data = memory.getvalue()
+    assert (len(data), hashlib.md5(data).hexdigest()) == BASELINE[job_class]
+
+
+def decode_pages(job_class, **settings):
+    memory = epson.io.Memory()
+    job = job_class(io=memory)
+    for name, value in settings.items():
+        setattr(job, name, value)
+    job.print_pages(rasters=[epson.raster.TestImage(size=(120, 90))])
+    return list(Decoder(io.BytesIO(memory.getvalue())).pages())
+
+
+@pytest.mark.parametrize("job_class", list(BASELINE))
+def test_monochrome_sends_colour_unless_host_gray(job_class):
+    color = decode_pages(job_class)
+    mono = decode_pages(job_class, cm=CM.MONOCHROME)
+    gray = decode_pages(job_class, cm=CM.MONOCHROME, host_gray=True)
+    assert mono == color
+    assert gray != color
@@ -0,0 +1,71 @@
+import struct
+
+import pytest
+
+import epson.raster
+
+
+class Canvas(epson.raster.Image):
+    """Mutable image, which does not call invalidate()"""
+
+    def __init__(self, size=(16, 100)):
+        super(Canvas, self).__init__(size=size)
+        self.rows = [b"\xff" * size[0] * 3 for _ in range(size[1])]
+
+    def line(self, y=0):
+        return self.rows[y]
+
+
+def test_digest_follows_changes():
+    canvas = Canvas()
+    before = canvas.digest()
+    canvas.rows[70] = b"\0" * len(canvas.rows[70])
+    assert canvas.digest() != before
+
+
+def test_pnm_truncated_header(tmp_path):
+    for header in (b"P6\n12 1", b"P6\n# comment", b"P5 3 2 255"):
+        path = tmp_path / "truncated.pnm"
+        path.write_bytes(header)
+        with pytest.raises(ValueError):
+            epson.raster.PNMImage(str(path))
+
+
+def test_pnm_rows(tmp_path):
+    path = tmp_path / "image.ppm"
+    path.write_bytes(b"P6\n# comment\n2 2\n255\n" + bytes(range(12)))
+    image = epson.raster.PNMImage(str(path))
+    assert image.size == (2, 2)
+    assert image.line(1) == bytes(range(6, 12))
+    image.close()
+
+
+def tiff(entries):
+    """Little-endian TIFF with one IFD of (tag, type, value) entries"""
+    ifd = struct.pack("<H", len(entries))
+    for tag, kind, value in entries:
+        ifd += struct.pack("<HHLL", tag, kind, 1, value)
+    return b"II*\0" + struct.pack("<L", 8) + ifd + struct.pack("<L", 0)
+
+
+def test_tiff_rows(tmp_path):
+    path = tmp_path / "image.tif"
+    data = bytes(range(12))
+    entries = [(256, 3, 2), (257, 3, 2), (258, 3, 8), (277, 3, 3)]
+    entries += [(279, 4, len(data)), (273, 4, 0)]
+    entries[-1] = (273, 4, len(tiff(entries)))
+    path.write_bytes(tiff(entries) + data)
+    image = epson.raster.TIFFImage(str(path))
+    assert image.size == (2, 2)
+    assert image.line(1) == bytes(range(6, 12))
+    image.close()
+
+
+def test_tiff_without_strips(tmp_path):
+    # Tiled: TileWidth, TileLength, TileOffsets, TileByteCounts
+    path = tmp_path / "tiled.tif"
+    entries = [(256, 3, 16), (257, 3, 16), (322, 3, 16), (323, 3, 16)]
+    entries += [(324, 4, 0), (325, 4, 0)]
+    path.write_bytes(tiff(entries))
+    with pytest.raises(ValueError, match="no strip offsets"):
+        epson.raster.TIFFImage(str(path))
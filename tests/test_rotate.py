@@ -0,0 +1,56 @@
+import epson.escp
+import epson.escpr
+import epson.io
+import epson.raster
+import epson.rotate
+from epson.constant import *
+from epson.settings import JobSettings
+
+
+class Counting(epson.raster.Pattern):
+    """Pattern counting its bitline() calls"""
+
+    def __init__(self, *args, **kwargs):
+        super(Counting, self).__init__(*args, **kwargs)
+        self.calls = 0
+
+    def bitline(self, y=0, ci=CI.BLACK, bpp=1):
+        self.calls += 1
+        return super(Counting, self).bitline(y=y, ci=ci, bpp=bpp)
+
+
+def test_bitlines_read_once_per_plane():
+    source = Counting(size=(60, 100), kind="noise", rows=100)
+    rotated = epson.rotate.Rotate(source, band=16)
+
+    job = epson.escp.Job(io=epson.io.Memory())
+    job.crop = False
+    planes = job._planes()
+    assert len(planes) == 4
+    job.print_pages(rasters=[rotated])
+
+    # Each plane of each band reads every source row once
+    assert source.calls == len(planes) * source.size[1] * 4
+
+
+def test_print_pages_closes_rotations(monkeypatch):
+    closed = []
+    close = epson.rotate.Rotate.close
+
+    def counting(self):
+        closed.append(self)
+        close(self)
+
+    monkeypatch.setattr(epson.rotate.Rotate, "close", counting)
+
+    settings = JobSettings(msid=MSID.ENV_10_L, rotate=epson.rotate.CLOCKWISE)
+    for job in (
+        epson.escpr.Job(io=epson.io.Memory(), settings=settings),
+        epson.escp.Job(io=epson.io.Memory()),
+    ):
+        job.settings = job.settings.replace(msid=MSID.ENV_10_L, rotate="clockwise")
+        pages = [epson.raster.Pattern((50, 80), kind="text") for _ in range(3)]
+        closed.clear()
+        job.print_pages(rasters=pages)
+        assert len(closed) == 3
+        assert all(rotated._buffer is None for rotated in closed)
@@ -0,0 +1,115 @@
+import queue
+import socket
+import threading
+import time
+
+import pytest
+
+import epson.io
+from epson.scheduler import Scheduler
+
+
+class Broken(epson.io.Io):
+    """Transport failing with something other than a connection error"""
+
+    def send(self, data=None):
+        raise ValueError("broken transport")
+
+
+class Sink(object):
+    """Local TCP printer keeping every spool it receives
+
+    Connections are only read once 'ready' is set, so a spool larger than
+    the socket buffers keeps its printer busy until then.
+    """
+
+    def __init__(self):
+        self.spools = queue.Queue()
+        self.ready = threading.Event()
+        self.ready.set()
+        self.server = socket.create_server(("127.0.0.1", 0))
+        self.port = self.server.getsockname()[1]
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def transport(self):
+        return epson.io.Network("127.0.0.1", self.port)
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self.server.accept()
+            except OSError:
+                break
+            self.ready.wait()
+            with conn:
+                data = bytearray()
+                while True:
+                    chunk = conn.recv(1 << 16)
+                    if not chunk:
+                        break
+                    data += chunk
+            self.spools.put(bytes(data))
+
+    def received(self, count):
+        return [self.spools.get(timeout=30) for _ in range(count)]
+
+    def close(self):
+        self.server.close()
+
+
+def refused_port():
+    """A local port with nothing listening on it"""
+    with socket.create_server(("127.0.0.1", 0)) as server:
+        return server.getsockname()[1]
+
+
+def test_transport_error_fails_job():
+    scheduler = Scheduler([Broken])
+    future = scheduler.submit_data(b"job")
+    with pytest.raises(ValueError):
+        future.result(timeout=5)
+
+    # The printer thread survives, and closing does not hang
+    assert scheduler.printers[0].thread.is_alive()
+    scheduler.close(wait=True)
+    assert not scheduler.printers[0].thread.is_alive()
+
+
+def test_jobs_go_to_least_busy_printer():
+    busy, idle = Sink(), Sink()
+    busy.ready.clear()
+    scheduler = Scheduler([busy.transport, idle.transport])
+    try:
+        large = bytes(64 << 20)
+        held = scheduler.submit_data(large)
+
+        # While the first printer is still sending, later jobs go to the other
+        assert scheduler.submit_data(b"first").result(timeout=10) == 1
+        assert scheduler.submit_data(b"second").result(timeout=10) == 1
+        assert not held.done()
+
+        busy.ready.set()
+        assert held.result(timeout=30) == 0
+        scheduler.close(wait=True)
+        assert busy.received(1) == [large]
+        assert idle.received(2) == [b"first", b"second"]
+    finally:
+        busy.ready.set()
+        busy.close()
+        idle.close()
+
+
+def test_failed_connection_retries_on_other_printer():
+    port = refused_port()
+    sink = Sink()
+    scheduler = Scheduler([lambda: epson.io.Network("127.0.0.1", port), sink.transport])
+    try:
+        assert scheduler.submit_data(b"job").result(timeout=10) == 1
+        assert not scheduler.printers[0].available(time.monotonic())
+
+        # The failed printer is skipped while it cools down
+        assert scheduler.submit_data(b"next").result(timeout=10) == 1
+        scheduler.close(wait=True)
+        assert sink.received(2) == [b"job", b"next"]
+    finally:
+        sink.close()
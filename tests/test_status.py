@@ -0,0 +1,29 @@
+import epson.io
+import epson.status
+from epson.status import FIELD_ERROR, FIELD_STATE, FlowControl, encode_st2
+
+
+class Printer(epson.io.Memory):
+    """Memory transport replying with scripted status replies"""
+
+    def __init__(self, replies):
+        super(Printer, self).__init__()
+        self.replies = list(replies)
+
+    def recv(self, expected=None, timeout=0.0):
+        if self.replies:
+            return self.replies.pop(0)
+        return b""
+
+
+def test_no_query_in_data_stream():
+    error = encode_st2({FIELD_STATE: b"\x00", FIELD_ERROR: b"\x04"})
+    idle = encode_st2({FIELD_STATE: b"\x04"})
+    printer = Printer([error, b"", idle])
+
+    flow = FlowControl(printer, chunk=16, error_timeout=10.0)
+    data = bytes(range(256))
+    flow.send(data)
+
+    assert printer.getvalue() == data
+    assert b"REMOTE1" not in printer.getvalue()